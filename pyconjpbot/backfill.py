@@ -0,0 +1,426 @@
+"""
+Slack のエクスポートから plusplus と用語コマンドのデータベースを作り直す
+
+エクスポート(zip またはディレクトリ)を1日分ずつ読み込み、ボットと同じパターンで
+++ と用語コマンドを判定して、大きなトランザクションでまとめて書き込む
+中断した場合は、同じエクスポートを指定すると続きの日付から読み込む
+
+$ python -m pyconjpbot.backfill export.zip [--batch-size 10000] [--channel general]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import time
+import zipfile
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from peewee import CharField, Model
+from slackbot import settings
+
+from .manager import PluginsManager
+from .plugins import plusplus, term
+from .plugins.plusplus_model import db as plusplus_db
+from .plugins.plusplus_model import load_history, resolve_name
+from .plugins.term_model import MODES, Response, Term
+from .plugins.term_model import db as term_db
+from .plugins.term_model import hash_text
+
+# 1回のトランザクションで書き込むメッセージ数の目安(1日分の途中では区切らない)
+BATCH_SIZE = 10000
+# エクスポートの1日分のメッセージのファイル(チャンネル名/YYYY-MM-DD.json)
+DAY_FILE = re.compile(r"^(?P<channel>[^/]+)/(?P<day>\d{4}-\d{2}-\d{2})\.json$")
+# 進捗を表示する間隔(秒)
+PROGRESS_INTERVAL = 5
+# ボットが処理しないメッセージの種類
+IGNORED_SUBTYPES = {"message_changed", "message_deleted", "bot_message"}
+
+
+class Checkpoint(Model):
+    """
+    エクスポートごとの読み込み済みの最後の日付
+
+    データと同じトランザクションで保存するため、データベースごとに持つ
+    """
+
+    export = CharField(primary_key=True)
+    day = CharField()
+
+
+class PlusplusCheckpoint(Checkpoint):
+    class Meta:
+        database = plusplus_db
+        table_name = "backfill_checkpoint"
+
+
+class TermCheckpoint(Checkpoint):
+    class Meta:
+        database = term_db
+        table_name = "backfill_checkpoint"
+
+
+plusplus_db.create_tables_on_connect([PlusplusCheckpoint])
+term_db.create_tables_on_connect([TermCheckpoint])
+
+
+def _checkpoint(model: type[Checkpoint], export: str) -> str:
+    """
+    読み込み済みの最後の日付を返す(未読み込みなら空文字列)
+    """
+    checkpoint = model.get_or_none(model.export == export)
+    return checkpoint.day if checkpoint else ""
+
+
+class SlackExport:
+    """
+    Slack のエクスポート(zip またはディレクトリ)を1日分ずつ読み込む
+
+    全体をメモリに読み込まないように、1日分の全チャンネルのファイルのみを読み込む
+    """
+
+    def __init__(self, path: str, channels: list[str] | None = None) -> None:
+        self.path = Path(path)
+        self.name = self.path.name
+        self._zip = zipfile.ZipFile(self.path) if self.path.is_file() else None
+        if self._zip is not None:
+            names = self._zip.namelist()
+        else:
+            names = [p.relative_to(self.path).as_posix() for p in self.path.glob("*/*")]
+        # 日付ごとのファイル名
+        self._days: dict[str, list[str]] = defaultdict(list)
+        for name in names:
+            m = DAY_FILE.match(name)
+            if m and (not channels or m["channel"] in channels):
+                self._days[m["day"]].append(name)
+
+    def _read(self, name: str) -> Any:
+        if self._zip is not None:
+            with self._zip.open(name) as f:
+                return json.load(f)
+        with open(self.path / name, encoding="utf-8") as f:
+            return json.load(f)
+
+    def days(self) -> list[str]:
+        """
+        メッセージのある日付を古い順に返す
+        """
+        return sorted(self._days)
+
+    def users(self) -> dict[str, dict]:
+        """
+        ユーザーIDごとのユーザー情報を返す
+        """
+        try:
+            members = self._read("users.json")
+        except (KeyError, FileNotFoundError):
+            return {}
+        return {user["id"]: user for user in members}
+
+    def messages(self, day: str) -> list[dict]:
+        """
+        指定された日付の全チャンネルのメッセージを投稿された順に返す
+        """
+        messages = []
+        for name in self._days[day]:
+            channel = name.split("/")[0]
+            for msg in self._read(name):
+                if msg.get("type", "message") == "message" and "text" in msg:
+                    msg.setdefault("channel", channel)
+                    messages.append(msg)
+        messages.sort(key=lambda msg: float(msg.get("ts", 0)))
+        return messages
+
+
+class Backfill:
+    """
+    メッセージをボットと同じパターンで判定し、++ と用語コマンドの操作をためて書き込む
+
+    - パターンは読み込んだプラグインの listen_to、respond_to をそのまま使う
+    - 用語コマンドの有無はメモリ上で管理し、書き込みはトランザクションの中で行う
+    """
+
+    def __init__(
+        self, export: str, users: dict[str, dict], bot_name: str | None = None
+    ) -> None:
+        self.export = export
+        self.users = users
+        self.plugins = PluginsManager()
+        self._command = _command_matcher(users, bot_name)
+        # データベースごとの読み込み済みの最後の日付
+        self.plusplus_day = _checkpoint(PlusplusCheckpoint, export)
+        self.term_day = _checkpoint(TermCheckpoint, export)
+        self.commands = {t.command for t in Term.select(Term.command)}
+        # 書き込み待ちの ++ と用語コマンドの操作
+        self._events: list[tuple[str, int, datetime]] = []
+        self._operations: list[tuple] = []
+        self.messages = 0
+        self.plusplus = 0
+        self.terms = 0
+
+    @property
+    def resume_day(self) -> str:
+        return min(self.plusplus_day, self.term_day)
+
+    @property
+    def pending(self) -> int:
+        return len(self._events) + len(self._operations)
+
+    def _user_name(self, user_id: str) -> str:
+        return self.users.get(user_id, {}).get("name", "")
+
+    def process(self, day: str, messages: list[dict]) -> None:
+        """
+        1日分のメッセージを処理する
+        """
+        for msg in messages:
+            user = msg.get("user")
+            if (
+                not user
+                or msg.get("subtype") in IGNORED_SUBTYPES
+                or "bot_id" in msg
+                or self.users.get(user, {}).get("is_bot")
+            ):
+                continue
+            self.messages += 1
+            created = datetime.fromtimestamp(float(msg["ts"]))
+            m = self._command.match(msg["text"]) if self._command else None
+            if m:
+                if day > self.term_day:
+                    self._respond_to(m["text"], user, created)
+            elif day > self.plusplus_day:
+                self._listen_to(msg["text"], created)
+
+    def _listen_to(self, text: str, created: datetime) -> None:
+        for func, args in self.plugins.get_plugins("listen_to", text):
+            if args is None:
+                # マッチするプラグインがない
+                continue
+            if func is plusplus.multi_plusplus:
+                targets, sign = args
+                delta = 1 if sign == "++" else -1
+                for name in plusplus.parse_names(targets, self._user_name):
+                    self._events.append((resolve_name(name), delta, created))
+
+    def _respond_to(self, text: str, user: str, created: datetime) -> None:
+        for func, args in self.plugins.get_plugins("respond_to", text):
+            if args is None:
+                # マッチするプラグインがない
+                continue
+            if func is term.term_create:
+                self._term_create(args[0], user, created)
+            elif func is term.term_drop:
+                self._term_drop(args[1])
+            elif func is term.term_mode:
+                self._term_mode(args[0], args[1])
+            elif func is term.response:
+                self._response(args[0], args[1], user, created)
+            elif func is term.import_responses:
+                self._import(args[0], args[1], user, created)
+            elif func is term.return_response:
+                self._hit(args[0], created)
+
+    def _term_create(self, command: str, user: str, created: datetime) -> None:
+        if command in ("list", "help", "stats"):
+            return
+        command = command.lower()
+        if command in term.RESERVED or command in self.commands:
+            return
+        self.commands.add(command)
+        self._operations.append(("create", command, user, created))
+
+    def _term_drop(self, command: str) -> None:
+        command = command.lower()
+        if command in term.RESERVED or command not in self.commands:
+            return
+        self.commands.remove(command)
+        self._operations.append(("drop", command))
+
+    def _term_mode(self, command: str, mode: str | None) -> None:
+        command = command.lower()
+        if command in self.commands and mode in MODES:
+            self._operations.append(("mode", command, mode))
+
+    def _response(
+        self, command: str, params: str, user: str, created: datetime
+    ) -> None:
+        if command in term.RESERVED or command not in self.commands:
+            return
+        data = params.split(maxsplit=1)
+        if not data or params.strip() == "import":
+            # 1行目が import のみの場合は _import で処理する
+            return
+        subcommand = data[0]
+        if subcommand == "pop":
+            self._operations.append(("pop", command))
+        elif subcommand in ("list", "search"):
+            return
+        elif subcommand in ("del", "delete", "remove"):
+            if len(data) > 1:
+                self._operations.append(("delete", command, data[1]))
+        elif subcommand == "weight":
+            args = data[1].split(maxsplit=1) if len(data) > 1 else []
+            if len(args) == 2 and args[0].isdigit():
+                self._operations.append(("weight", command, int(args[0]), args[1]))
+        elif subcommand == "add":
+            if len(data) > 1:
+                self._operations.append(("add", command, data[1], user, created))
+        else:
+            self._operations.append(("add", command, params, user, created))
+
+    def _import(
+        self, command: str, text: str | None, user: str, created: datetime
+    ) -> None:
+        if command in term.RESERVED or command not in self.commands:
+            return
+        for line in (text or "").splitlines():
+            if line.strip():
+                self._operations.append(("add", command, line.strip(), user, created))
+
+    def _hit(self, command: str, created: datetime) -> None:
+        # どの応答を返したかはエクスポートからわからないので、用語の回数のみ数える
+        if command in self.commands:
+            self._operations.append(("hit", command, created))
+
+    def commit(self, day: str) -> None:
+        """
+        ためた操作をデータベースごとに1つのトランザクションで書き込み、
+        同じトランザクションで読み込み済みの日付を記録する
+        """
+        if day > self.plusplus_day:
+            with plusplus_db.atomic():
+                load_history(self._events)
+                PlusplusCheckpoint.insert(export=self.export, day=day).on_conflict(
+                    "replace"
+                ).execute()
+            self.plusplus += len(self._events)
+            self.plusplus_day = day
+        if day > self.term_day:
+            with term_db.atomic():
+                for operation in self._operations:
+                    _apply(*operation)
+                TermCheckpoint.insert(export=self.export, day=day).on_conflict(
+                    "replace"
+                ).execute()
+            self.terms += len(self._operations)
+            self.term_day = day
+        self._events = []
+        self._operations = []
+
+
+def _command_matcher(users: dict[str, dict], bot_name: str | None) -> re.Pattern | None:
+    """
+    ボットへのコマンド(ALIASES やボットへのメンションで始まる)を判定するパターンを返す
+    """
+    prefixes = [
+        re.escape(alias)
+        for alias in getattr(settings, "ALIASES", "").split(",")
+        if alias
+    ]
+    if bot_name:
+        prefixes.append(re.escape(bot_name) + ":")
+        for user_id, user in users.items():
+            if user.get("name") == bot_name:
+                prefixes.append(rf"<@{user_id}>:?")
+    if not prefixes:
+        return None
+    return re.compile(rf"^(?:{'|'.join(prefixes)}) ?(?P<text>[\s\S]*)$")
+
+
+def _apply(operation: str, command: str, *args: Any) -> None:
+    """
+    用語コマンドの操作をデータベースに反映する
+    """
+    if operation == "create":
+        creator, created = args
+        Term.insert(
+            command=command, creator=creator, created=created
+        ).on_conflict_ignore().execute()
+        return
+
+    term = Term.get_or_none(Term.command == command)
+    if term is None:
+        return
+    if operation == "drop":
+        term.delete_instance(recursive=True)
+    elif operation == "add":
+        text, creator, created = args
+        Response.insert(
+            term=term,
+            text=text,
+            text_hash=hash_text(text),
+            creator=creator,
+            created=created,
+        ).on_conflict_ignore().execute()
+    elif operation == "delete":
+        (text,) = args
+        Response.delete().where(
+            Response.term == term, Response.text_hash == hash_text(text)
+        ).execute()
+    elif operation == "mode":
+        (term.mode,) = args
+        term.save(only=[Term.mode])
+    elif operation == "hit":
+        (created,) = args
+        Term.update(hits=Term.hits + 1, last_used=created).where(
+            Term.id == term.id
+        ).execute()
+    elif operation == "weight":
+        weight, text = args
+        Response.update(weight=weight).where(
+            Response.term == term, Response.text_hash == hash_text(text)
+        ).execute()
+    elif operation == "pop":
+        last = term.response_set.order_by(Response.created.desc()).first()
+        if last is not None:
+            last.delete_instance()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("export", help="Slack のエクスポート(zip またはディレクトリ)")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="1回のトランザクションで書き込む操作数の目安",
+    )
+    parser.add_argument(
+        "--channel", action="append", help="読み込むチャンネル(複数指定可)"
+    )
+    parser.add_argument("--bot-name", help="メンションをコマンドとして扱うボットの名前")
+    args = parser.parse_args()
+
+    export = SlackExport(args.export, args.channel)
+    backfill = Backfill(export.name, export.users(), args.bot_name)
+    days = [day for day in export.days() if day > backfill.resume_day]
+    if backfill.resume_day:
+        print(f"resuming after {backfill.resume_day}")
+    print(f"days: {len(days)}")
+
+    start = reported = time.perf_counter()
+    for i, day in enumerate(days, start=1):
+        backfill.process(day, export.messages(day))
+        committed = backfill.pending >= args.batch_size or i == len(days)
+        if committed:
+            backfill.commit(day)
+        now = time.perf_counter()
+        if committed or now - reported >= PROGRESS_INTERVAL:
+            reported = now
+            print(
+                f"{day} ({i}/{len(days)} days) "
+                f"messages: {backfill.messages:,} "
+                f"written ++: {backfill.plusplus:,} "
+                f"term: {backfill.terms:,} "
+                f"({backfill.messages / (now - start):,.0f} messages/sec)",
+                flush=True,
+            )
+    print("done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+ベンチマーク用の Slack メッセージのコーパスを読み込む/生成する
+"""
+
+from __future__ import annotations
+
+import json
+import random
+from pathlib import Path
+
+# 合成コーパスに使うメッセージのテンプレート
+SYNTHETIC_MESSAGES = (
+    # 通常の会話(どのパターンにもマッチしないものが大半)
+    (60, "今日の{n}時からミーティングをしましょう"),
+    (60, "資料をアップロードしたので確認お願いします"),
+    (40, "I think we should update the sponsor page by tomorrow"),
+    (30, "了解です、ありがとうございます!"),
+    (20, "{n}件のレビューが残っています"),
+    # plusplus
+    (10, "takanory terada++ ありがとう"),
+    (5, "<@U0123ABCD>++"),
+    # JIRA の issue id
+    (8, "ISSHA-{n} の件どうなりましたか"),
+    # 計算
+    (5, "{n} * 12 + 3"),
+    # リアクション
+    (8, "お昼はラーメンにしよう"),
+    (5, "懇親会のビールとピザを注文しました"),
+    # あいさつ
+    (5, "おはようございます"),
+    (3, "そろそろ寝ます"),
+)
+
+# ボットへのコマンド(respond_to)のテンプレート
+COMMAND_MESSAGES = (
+    (10, "$ping"),
+    (5, "$help"),
+    (5, "$shuffle a b c d"),
+    (5, "$choice ラーメン カレー 寿司"),
+    (5, "$cal"),
+    (5, "$translate hello world"),
+    (5, "$wikipedia Python"),
+    (5, "$jira search スポンサー"),
+    (3, "$jira assignee takanory"),
+    (3, "$github repos"),
+    (3, "$github search sprint"),
+    (3, "$google pycon"),
+    (5, "$term list"),
+    (5, "$plusplus search taka"),
+    (3, "$gadmin member list staff"),
+    (3, "$drive db スポンサー"),
+    (3, "$pycamp summary"),
+    (5, "$suddendeath 突然の死"),
+    (5, "$manual スポンサー"),
+    (3, "$startup"),
+    (3, "$stats"),
+)
+
+
+def generate_corpus(count: int, seed: int = 0, commands: bool = False) -> list[dict]:
+    """
+    合成した Slack のメッセージイベントの一覧を返す
+
+    :param commands: ボットへのコマンドも含める
+    """
+    rand = random.Random(seed)
+    messages: tuple[tuple[int, str], ...] = SYNTHETIC_MESSAGES
+    if commands:
+        messages += COMMAND_MESSAGES
+    weights = [weight for weight, _ in messages]
+    templates = [template for _, template in messages]
+    events = []
+    for i in range(count):
+        template = rand.choices(templates, weights)[0]
+        events.append(
+            {
+                "type": "message",
+                "channel": "C0123ABCD",
+                "user": "U0123ABCD",
+                "text": template.format(n=rand.randint(1, 3000)),
+                "ts": f"{1600000000 + i}.000100",
+            }
+        )
+    return events
+
+
+def load_corpus(path: str | Path) -> list[dict]:
+    """
+    記録された Slack のメッセージイベントの一覧を読み込む
+
+    1行1イベントの JSON Lines 形式と、Slack のエクスポート形式(JSONの配列)に対応
+    """
+    events = []
+    with open(path, encoding="utf-8") as f:
+        if str(path).endswith(".json"):
+            events = json.load(f)
+        else:
+            events = [json.loads(line) for line in f if line.strip()]
+    return [
+        event
+        for event in events
+        if event.get("type", "message") == "message" and "text" in event
+    ]
@@ -0,0 +1,428 @@
+"""
+ベンチマーク用に外部サービスの代わりをするプロセス内のフェイク
+
+requests の HTTP 通信をホストごとのフェイクに振り分けるため、
+ネットワークに接続せずにプラグインを実行できる
+
+- Slack Web API(slack.com)
+- JIRA REST API(/rest/api/ で始まるパス)
+- GitHub API(api.github.com)
+- connpass API(connpass.com)
+- Microsoft Translator API(*.cognitive.microsofttranslator.com)
+- Google 検索(google.com)、Wikipedia(*.wikipedia.org)
+- Google API は get_service() を FakeGoogleService に差し替える
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# users.list で返すユーザー数
+USER_COUNT = 500
+
+# 1x1 の透過PNG
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kg"
+    "AAAABJRU5ErkJggg=="
+)
+
+Route = Callable[[str, dict, Any], Any]
+
+
+def _user(i: int) -> dict:
+    return {
+        "id": f"U{i:08d}",
+        "name": f"user{i}",
+        "real_name": f"User {i}",
+        "is_admin": i == 0,
+        "deleted": False,
+        "profile": {"display_name": f"user{i}", "image_48": ""},
+    }
+
+
+def _slack(path: str, params: dict, body: Any) -> Any:
+    """
+    Slack Web API のフェイク
+    """
+    method = path.rsplit("/", 1)[-1]
+    if method == "users.list":
+        # limit ごとにページ分割して返す
+        limit = int(params.get("limit", 200))
+        start = int(params.get("cursor") or 0)
+        end = min(start + limit, USER_COUNT)
+        members = [_user(i) for i in range(start, end)]
+        cursor = str(end) if end < USER_COUNT else ""
+        return {
+            "ok": True,
+            "members": members,
+            "response_metadata": {"next_cursor": cursor},
+        }
+    if method == "users.info":
+        user_id = params.get("user", "U00000000")
+        return {"ok": True, "user": dict(_user(0), id=user_id)}
+    if method == "conversations.members":
+        return {"ok": True, "members": [f"U{i:08d}" for i in range(20)]}
+    if method == "users.getPresence":
+        return {"ok": True, "presence": "active"}
+    if method in ("chat.postMessage", "chat.postEphemeral"):
+        return {"ok": True, "channel": params.get("channel"), "ts": f"{time.time()}"}
+    if method == "files.getUploadURLExternal":
+        return {
+            "ok": True,
+            "upload_url": "https://files.slack.com/upload/v1/fake",
+            "file_id": "F00000000",
+        }
+    if method == "files.completeUploadExternal":
+        return {"ok": True, "files": [{"id": "F00000000", "title": "fake"}]}
+    return {"ok": True}
+
+
+def _jira_issue(key: str) -> dict:
+    return {
+        "id": "10000",
+        "key": key,
+        "self": f"http://jira.example.com/rest/api/2/issue/{key}",
+        "fields": {
+            "summary": f"{key} のサマリー",
+            "assignee": {"displayName": "takanory", "name": "takanory"},
+            "status": {"name": "Open"},
+        },
+    }
+
+
+def _jira(path: str, params: dict, body: Any) -> Any:
+    """
+    JIRA REST API のフェイク
+    """
+    if path.endswith("/serverInfo"):
+        return {
+            "baseUrl": "http://jira.example.com",
+            "version": "9.4.0",
+            "versionNumbers": [9, 4, 0],
+            "deploymentType": "Server",
+        }
+    if "/issue/" in path:
+        return _jira_issue(path.rsplit("/", 1)[-1].upper())
+    if path.endswith("/search"):
+        issues = [_jira_issue(f"ISSHA-{i}") for i in range(1, 11)]
+        return {"startAt": 0, "maxResults": 50, "total": len(issues), "issues": issues}
+    if path.endswith("/myself"):
+        return {"name": "pyconjpbot", "displayName": "pyconjpbot"}
+    if path.endswith("/field") or path.endswith("/user/search"):
+        return []
+    if "/filter/" in path:
+        return []
+    return {}
+
+
+def _github_repo(i: int) -> dict:
+    name = f"repo{i}"
+    return {
+        "id": i,
+        "name": name,
+        "full_name": f"pyconjp/{name}",
+        "description": f"{name} の説明",
+        "html_url": f"https://github.com/pyconjp/{name}",
+        "url": f"https://api.github.com/repos/pyconjp/{name}",
+    }
+
+
+def _github(path: str, params: dict, body: Any) -> Any:
+    """
+    GitHub API のフェイク
+    """
+    if path.endswith("/repos"):
+        return [_github_repo(i) for i in range(10)]
+    if path.startswith("/orgs/"):
+        login = path.split("/")[2]
+        return {"login": login, "url": f"https://api.github.com/orgs/{login}"}
+    if path.startswith("/search/"):
+        items = [
+            {
+                "title": f"issue {i}",
+                "name": f"file{i}.py",
+                "path": f"src/file{i}.py",
+                "html_url": f"https://github.com/pyconjp/repo0/issues/{i}",
+                "url": f"https://api.github.com/repos/pyconjp/repo0/issues/{i}",
+            }
+            for i in range(3)
+        ]
+        return {"total_count": len(items), "incomplete_results": False, "items": items}
+    return {}
+
+
+def _connpass(path: str, params: dict, body: Any) -> Any:
+    """
+    connpass API のフェイク(開催予定のイベントはない)
+    """
+    return {"results_returned": 0, "results_available": 0, "events": []}
+
+
+def _translator(path: str, params: dict, body: Any) -> Any:
+    """
+    Microsoft Translator API のフェイク
+    """
+    if path.endswith("/languages"):
+        return {"translation": {"ja": {"name": "Japanese", "nativeName": "日本語"}}}
+    texts = json.loads(body or "[]")
+    return [
+        {"translations": [{"text": f"[{params.get('to')}] {item['Text']}"}]}
+        for item in texts
+    ]
+
+
+def _wikipedia(path: str, params: dict, body: Any) -> Any:
+    """
+    Wikipedia API のフェイク
+    """
+    if params.get("list") == "search":
+        query = params.get("srsearch", "")
+        return {
+            "query": {
+                "search": [{"title": query}],
+                "searchinfo": {"totalhits": 1, "suggestion": None},
+            }
+        }
+    title = params.get("titles", "Python")
+    page = {
+        "pageid": 1,
+        "title": title,
+        "fullurl": f"https://ja.wikipedia.org/wiki/{title}",
+        "extract": f"{title} のページの概要",
+    }
+    return {"query": {"pages": {"1": page}}}
+
+
+def _google(path: str, params: dict, body: Any) -> Any:
+    """
+    Google 検索のフェイク(HTMLを返す)
+    """
+    query = params.get("q", "")
+    return (
+        "<html><body>"
+        f'<a href="/url?q=https://example.com/{query}&sa=U"><h3>{query}</h3></a>'
+        '<img src="logo.png"><img src="https://example.com/image.png">'
+        "</body></html>"
+    )
+
+
+def _route(host: str, path: str) -> Route | None:
+    if host.endswith("slack.com") and path.startswith("/api/"):
+        return _slack
+    if path.startswith("/rest/api/"):
+        return _jira
+    if host == "api.github.com":
+        return _github
+    if host.endswith("connpass.com") and path.startswith("/api/"):
+        return _connpass
+    if host.endswith("microsofttranslator.com"):
+        return _translator
+    if host.endswith("wikipedia.org"):
+        return _wikipedia
+    if host.endswith("google.com") and path == "/search":
+        return _google
+    return None
+
+
+class FakeTransport:
+    """
+    requests の HTTPAdapter.send を差し替えて、フェイクにリクエストを振り分ける
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        # 1リクエストごとに待つ秒数(外部サービスの応答時間の代わり)
+        self.latency = latency
+        self.requests: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._original: Callable | None = None
+
+    def install(self) -> None:
+        self._original = HTTPAdapter.send
+        transport = self
+
+        def send(adapter, request, **kwargs):
+            return transport.send(request)
+
+        HTTPAdapter.send = send  # type: ignore
+
+    def uninstall(self) -> None:
+        if self._original is not None:
+            HTTPAdapter.send = self._original  # type: ignore
+            self._original = None
+
+    def send(self, request: requests.PreparedRequest) -> requests.Response:
+        url = urlsplit(request.url or "")
+        host = url.hostname or ""
+        with self._lock:
+            self.requests[host] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = request.body
+        content_type = request.headers.get("Content-Type", "")
+        if body and "x-www-form-urlencoded" in content_type:
+            if isinstance(body, bytes):
+                body = body.decode()
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+        elif body and content_type.startswith("application/json"):
+            data = json.loads(body)
+            if isinstance(data, dict):
+                params.update(data)
+
+        route = _route(host, url.path)
+        if route is not None:
+            result = route(url.path, params, body)
+            if isinstance(result, str):
+                return _response(request, 200, result.encode(), "text/html")
+            content = json.dumps(result).encode()
+            return _response(request, 200, content, "application/json")
+        if url.path.endswith((".png", ".jpg", ".gif")):
+            return _response(request, 200, PNG, "image/png")
+        if host == "files.slack.com":
+            return _response(request, 200, b"OK", "text/plain")
+        return _response(request, 404, b"Not Found", "text/plain")
+
+
+def _response(
+    request: requests.PreparedRequest, status: int, content: bytes, content_type: str
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK" if status == 200 else "Not Found"
+    response._content = content
+    response.headers["Content-Type"] = f"{content_type}; charset=utf-8"
+    response.encoding = "utf-8"
+    response.url = request.url or ""
+    response.request = request
+    return response
+
+
+class _FakeRequest:
+    """
+    Google API のリクエストのフェイク
+    """
+
+    def __init__(self, result: dict) -> None:
+        self._result = result
+
+    def execute(self, *args: Any, **kwargs: Any) -> dict:
+        return self._result
+
+
+class FakeGoogleService:
+    """
+    googleapiclient の Resource のフェイク
+
+    service.members().list(groupKey=group).execute() のように
+    メソッドをつなげて呼び出すと、最後のメソッド名に合わせた結果を返す
+    """
+
+    def __init__(self, name: str = "", version: str = "") -> None:
+        self.name = name
+
+    def __getattr__(self, attr: str) -> Callable[..., Any]:
+        def method(*args: Any, **kwargs: Any) -> Any:
+            if attr in ("list", "get", "insert", "delete", "update", "patch"):
+                return _FakeRequest(self._result(attr))
+            return self
+
+        return method
+
+    def _result(self, method: str) -> dict:
+        if method != "list":
+            return {}
+        if self.name == "drive":
+            return {
+                "files": [
+                    {
+                        "id": f"file{i}",
+                        "name": f"ファイル{i}",
+                        "mimeType": "application/vnd.google-apps.document",
+                        "webViewLink": f"https://docs.google.com/document/d/{i}",
+                        "modifiedTime": "2020-01-01T00:00:00.000Z",
+                    }
+                    for i in range(5)
+                ]
+            }
+        if self.name == "admin":
+            emails = [f"user{i}@pycon.jp" for i in range(10)]
+            return {
+                "members": [{"email": email} for email in emails],
+                "users": [
+                    {"primaryEmail": email, "name": {"fullName": email}}
+                    for email in emails
+                ],
+                "groups": [],
+            }
+        return {"values": [], "items": []}
+
+
+def patch_google_services() -> int:
+    """
+    読み込み済みのモジュールの get_service() を FakeGoogleService に差し替える
+
+    差し替えたモジュールの数を返す
+    """
+    count = 0
+    for name, module in list(sys.modules.items()):
+        if name.startswith("pyconjpbot.") and hasattr(module, "get_service"):
+            module.get_service = FakeGoogleService  # type: ignore
+            count += 1
+    return count
+
+
+class _FakeUsers(dict):
+    """
+    slackbot の SlackClient.users のフェイク
+    """
+
+    def get(self, user_id: str, default: Any = None) -> dict:  # type: ignore
+        return dict(_user(1), id=user_id)
+
+
+class FakeSlackClient:
+    """
+    slackbot の SlackClient(RTM API)のフェイク
+
+    送信したメッセージは数だけ数える
+    """
+
+    def __init__(self) -> None:
+        self.login_data = {"self": {"id": "UBOT00000", "name": "pyconjpbot"}}
+        self.users = _FakeUsers()
+        self.channels: dict[str, dict] = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def rtm_send_message(
+        self, channel: str, message: str, attachments: Any = None, thread_ts: Any = None
+    ) -> None:
+        with self._lock:
+            self.sent += 1
+
+    def send_message(self, channel: str, message: str, *args: Any, **kwargs: Any):
+        with self._lock:
+            self.sent += 1
+
+    def react_to_message(self, emojiname: str, channel: str, timestamp: str) -> None:
+        pass
+
+    def upload_file(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def parse_channel_data(self, channel_data: list) -> None:
+        pass
+
+    def parse_user_data(self, user_data: list) -> None:
+        pass
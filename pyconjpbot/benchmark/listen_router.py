@@ -0,0 +1,93 @@
+"""
+listen_to のマッチングを総当たりと ListenRouter で比較するベンチマーク
+
+- before: 変更前のパターン(reaction が全メッセージにマッチする '.')を総当たりで判定
+- brute force: 現在のパターンを総当たりで判定
+- after: 現在のパターンを ListenRouter で判定
+
+いずれもマッチングの時間のみを計測する(before で全メッセージに対して
+reaction ハンドラーを呼び出していた時間は含まない)
+
+$ python -m pyconjpbot.benchmark.listen_router [corpus.jsonl] [-n 20000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+from slackbot import manager
+
+from ..manager import PluginsManager
+from ..plugins.reaction import reaction
+from .corpus import generate_corpus, load_corpus
+
+# ListenRouter の導入前に reaction プラグインが使っていたパターン
+REACTION_BEFORE = re.compile(".")
+
+
+def _measure(get_plugins: Callable, texts: list[str]) -> tuple[float, list]:
+    """
+    全テキストのマッチングにかかった秒数と結果を返す
+    """
+    results = []
+    start = time.perf_counter()
+    for text in texts:
+        results.append(list(get_plugins("listen_to", text)))
+    return time.perf_counter() - start, results
+
+
+def _brute_force(listen_to: dict) -> Callable:
+    """
+    指定したパターンを slackbot と同じく総当たりで判定する get_plugins を返す
+    """
+    plugins = SimpleNamespace(commands={"listen_to": listen_to})
+    return lambda c, t: manager.PluginsManager.get_plugins(plugins, c, t)
+
+
+def _before_patterns(listen_to: dict) -> dict:
+    """
+    reaction プラグインのパターンを変更前の '.' に戻したパターンを返す
+    """
+    return {
+        REACTION_BEFORE if func is reaction else pattern: func
+        for pattern, func in listen_to.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="?", help="記録したメッセージのファイル")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="合成件数")
+    args = parser.parse_args()
+
+    if args.corpus:
+        events = load_corpus(args.corpus)
+    else:
+        events = generate_corpus(args.count)
+    texts = [event["text"] for event in events]
+
+    plugins = PluginsManager()
+    plugins.init_plugins()
+    print(f"listen_to patterns: {len(plugins.commands['listen_to'])}")
+    print(f"messages: {len(texts)}")
+
+    listen_to = plugins.commands["listen_to"]
+    before, _ = _measure(_brute_force(_before_patterns(listen_to)), texts)
+    brute_force, expected = _measure(_brute_force(listen_to), texts)
+    after, actual = _measure(plugins.get_plugins, texts)
+    if expected != actual:
+        raise SystemExit("ListenRouter の結果が総当たりの結果と一致しません")
+
+    print(f"before:      {len(texts) / before:12,.0f} messages/sec")
+    print(f"brute force: {len(texts) / brute_force:12,.0f} messages/sec")
+    print(f"after:       {len(texts) / after:12,.0f} messages/sec")
+    print(f"speedup (before -> after):      {before / after:.2f}x")
+    print(f"speedup (brute force -> after): {brute_force / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Slack のメッセージを実際のディスパッチャーとプラグインで処理するベンチマーク
+
+外部サービスはプロセス内のフェイクに置き換えるため、ネットワークに接続せずに実行できる
+
+$ python -m pyconjpbot.benchmark.replay [corpus.jsonl] [-n 2000] [--latency 20]
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from collections import defaultdict
+from functools import partial
+from pathlib import Path
+
+from peewee import Model, SqliteDatabase
+
+from ..dispatcher import MessageDispatcher
+from ..lazyimport import rss
+from ..manager import PluginsManager
+from ..metrics import metrics
+from ..ratelimit import scheduler
+from ..resources import LazyDatabase
+from ..startup import import_costs
+from .corpus import generate_corpus, load_corpus
+from .fakes import FakeSlackClient, FakeTransport, patch_google_services
+
+MB = 1024 * 1024
+# RSS の最大値を計測する間隔(秒)
+RSS_INTERVAL = 0.05
+
+
+class _InlinePool:
+    """
+    受け取ったメッセージをその場でディスパッチする slackbot の WorkerPool の代わり
+    """
+
+    def __init__(self, func) -> None:
+        self.func = func
+
+    def start(self) -> None:
+        pass
+
+    def add_task(self, msg) -> None:
+        self.func(msg)
+
+
+class _PeakRSS:
+    """
+    ベンチマーク中の RSS の最大値を計測するスレッド
+    """
+
+    def __init__(self) -> None:
+        self.peak = rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, rss())
+
+
+def _use_temporary_databases(directory: str) -> list[str]:
+    """
+    プラグインのデータベースを一時ディレクトリの SQLite に差し替える
+
+    差し替えたデータベースの名前を返す
+    """
+    replaced = []
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("pyconjpbot."):
+            continue
+        for attr, value in list(vars(module).items()):
+            if isinstance(value, LazyDatabase):
+                path = os.path.join(directory, f"{name}.db")
+                value.replace(partial(SqliteDatabase, path))
+                replaced.append(f"{name}.{attr}")
+            elif isinstance(value, SqliteDatabase):
+                value.init(os.path.join(directory, f"{name}.{attr}.db"))
+                value.create_tables(_models(value))
+                replaced.append(f"{name}.{attr}")
+    return replaced
+
+
+def _models(database: SqliteDatabase) -> list[type[Model]]:
+    """
+    データベースを使用している読み込み済みのモデルを返す
+    """
+    models = set()
+    for name, module in list(sys.modules.items()):
+        if name.startswith("pyconjpbot."):
+            for value in vars(module).values():
+                if not isinstance(value, type) or not issubclass(value, Model):
+                    continue
+                meta = getattr(value, "_meta", None)
+                if meta is not None and meta.database is database:
+                    models.add(value)
+    return list(models)
+
+
+def _plugin_latency() -> list[tuple[str, int, int, float, float]]:
+    """
+    プラグインのモジュールごとの回数、エラー数、合計時間、p95を返す
+    """
+    totals: dict[str, list] = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    for name, stats in metrics.handlers().items():
+        plugin = name.rsplit(".", 1)[0]
+        total = totals[plugin]
+        total[0] += stats.calls
+        total[1] += stats.errors
+        total[2] += stats.latency.sum
+        total[3] = max(total[3], stats.latency.quantile(0.95))
+    return sorted(
+        ((plugin, *total) for plugin, total in totals.items()),
+        key=lambda row: row[3],
+        reverse=True,
+    )
+
+
+def _tracemalloc_by_plugin(snapshot: tracemalloc.Snapshot) -> list[tuple[str, int]]:
+    """
+    プラグインのファイルごとに確保したままのメモリのバイト数を返す
+    """
+    root = Path(__file__).resolve().parent.parent
+    sizes: dict[str, int] = defaultdict(int)
+    for stat in snapshot.statistics("filename"):
+        path = Path(stat.traceback[0].filename)
+        if root in path.parents:
+            sizes[str(path.relative_to(root))] += stat.size
+    return sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="?", help="記録したメッセージのファイル")
+    parser.add_argument("-n", "--count", type=int, default=2000, help="合成件数")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="外部サービスの応答時間(ミリ秒)"
+    )
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="プラグインごとのメモリを計測する"
+    )
+    parser.add_argument("--top", type=int, default=20, help="表示するプラグイン数")
+    args = parser.parse_args()
+    # attachments に fallback がないという slack_sdk の警告は表示しない
+    warnings.filterwarnings("ignore", category=UserWarning, module="slack_sdk")
+
+    if args.corpus:
+        events = load_corpus(args.corpus)
+    else:
+        events = generate_corpus(args.count, commands=True)
+
+    transport = FakeTransport(latency=args.latency / 1000)
+    transport.install()
+    # レートリミットの待ち時間はベンチマークの対象外にする
+    scheduler.enabled = False
+
+    rss_start = rss()
+    plugins = PluginsManager()
+    plugins.init_plugins()
+    rss_loaded = rss()
+    patch_google_services()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    databases = _use_temporary_databases(tmpdir.name)
+
+    client = FakeSlackClient()
+    dispatcher = MessageDispatcher(client, plugins, None)
+    dispatcher._pool = _InlinePool(dispatcher.dispatch_msg)
+    dispatcher._handlers.start()
+
+    print(f"messages: {len(events)}")
+    print(f"databases: {', '.join(databases) or '-'}")
+    if args.tracemalloc:
+        tracemalloc.start()
+    peak = _PeakRSS()
+    peak.start()
+
+    start = time.perf_counter()
+    for event in events:
+        dispatcher._on_new_message(copy.deepcopy(event))
+    dispatched = time.perf_counter() - start
+    if not dispatcher._handlers.join(timeout=600):
+        print("warning: handlers did not finish in 600 seconds")
+    elapsed = time.perf_counter() - start
+
+    peak.stop()
+    snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+    transport.uninstall()
+    tmpdir.cleanup()
+
+    print(f"dispatch:   {len(events) / dispatched:12,.0f} messages/sec")
+    print(f"end-to-end: {len(events) / elapsed:12,.0f} messages/sec")
+    print(f"replies sent via RTM: {client.sent}")
+    requests = ", ".join(f"{h}={n}" for h, n in transport.requests.most_common())
+    print(f"fake HTTP requests: {requests or '-'}")
+
+    print("\nplugin latency:")
+    print("  calls | errors | total(s) | p95(s) | plugin")
+    for plugin, calls, errors, total, p95 in _plugin_latency()[: args.top]:
+        print(f"  {calls:5d} | {errors:6d} | {total:8.3f} | {p95:6.3f} | {plugin}")
+
+    print("\nmemory (RSS):")
+    print(f"  before plugins: {rss_start / MB:8.1f} MB")
+    print(f"  after plugins:  {rss_loaded / MB:8.1f} MB")
+    print(f"  peak:           {peak.peak / MB:8.1f} MB")
+    print(f"  after replay:   {rss() / MB:8.1f} MB")
+
+    print("\nplugin import RSS:")
+    costs = sorted(
+        import_costs().items(),
+        key=lambda item: item[1].rss_after - item[1].rss_before,
+        reverse=True,
+    )
+    for module, cost in costs[: args.top]:
+        delta = (cost.rss_after - cost.rss_before) / MB
+        print(f"  {delta:+8.1f} MB | {cost.seconds:6.3f}s | {module}")
+
+    if snapshot is not None:
+        print("\nallocated by plugin files (tracemalloc):")
+        for filename, size in _tracemalloc_by_plugin(snapshot)[: args.top]:
+            print(f"  {size / 1024:10.1f} KB | {filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from slackbot import bot, settings
+
+from .dispatcher import MessageDispatcher
+from .manager import PluginsManager
+
+
+class Bot(bot.Bot):
+    """
+    pyconjpbot 用の PluginsManager と MessageDispatcher を使用する Bot
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._plugins = PluginsManager()
+        self._dispatcher = MessageDispatcher(
+            self._client, self._plugins, settings.ERRORS_TO
+        )
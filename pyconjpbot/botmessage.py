@@ -1,9 +1,139 @@
 from __future__ import annotations
 
+import functools
 import json
+import logging
+import threading
+from typing import Callable
 
+from slack_sdk.errors import SlackApiError
 from slackbot.dispatcher import Message
 
+from .ratelimit import scheduler
+from .slackapi import get_client
+
+logger = logging.getLogger(__name__)
+
+# まとめて送信するメッセージのテキストの最大文字数
+# chat.postMessage API は 4000 文字以内を推奨している
+MAX_TEXT_LENGTH = 4000
+# 1つのメッセージに付けられる Attachments の最大数
+MAX_ATTACHMENTS = 100
+
+_local = threading.local()
+
+
+class OutputBuffer:
+    """
+    ハンドラーの実行中に送信するメッセージを溜めておくバッファー
+
+    同じチャンネル、スレッドに続けて送信するメッセージは、
+    送信順を保ったまま Slack の制限内で1つのメッセージにまとめる
+    """
+
+    def __init__(self) -> None:
+        # (channel, thread_ts, texts, attachments) のリスト
+        self._messages: list[tuple[str, str | None, list[str], list[dict]]] = []
+
+    def _last(self, channel: str, thread_ts: str | None) -> tuple | None:
+        if not self._messages:
+            return None
+        last = self._messages[-1]
+        if last[0] != channel or last[1] != thread_ts:
+            return None
+        return last
+
+    def add_text(self, channel: str, thread_ts: str | None, text: str) -> None:
+        last = self._last(channel, thread_ts)
+        # Attachments はテキストの後に表示されるので、その後ろにはテキストを追加しない
+        if last is not None and not last[3]:
+            texts = last[2]
+            length = sum(len(t) + 1 for t in texts) + len(text)
+            if length <= MAX_TEXT_LENGTH:
+                texts.append(text)
+                return
+        self._messages.append((channel, thread_ts, [text], []))
+
+    def add_attachments(
+        self, channel: str, thread_ts: str | None, attachments: list[dict]
+    ) -> None:
+        last = self._last(channel, thread_ts)
+        if last is not None and len(last[3]) + len(attachments) <= MAX_ATTACHMENTS:
+            last[3].extend(attachments)
+            return
+        self._messages.append((channel, thread_ts, [], list(attachments)))
+
+    def flush(self, raise_errors: bool = True) -> None:
+        """
+        溜めたメッセージを chat.postMessage API で送信する
+
+        送信に失敗したメッセージはログに出力して残りのメッセージの送信を続け、
+        raise_errors の場合は全て送信したあとに最初の例外を送出する
+        """
+        messages, self._messages = self._messages, []
+        client = get_client()
+        error: Exception | None = None
+        for channel, thread_ts, texts, attachments in messages:
+            try:
+                client.chat_postMessage(
+                    channel=channel,
+                    text="\n".join(texts),
+                    attachments=attachments or None,
+                    thread_ts=thread_ts,
+                )
+            except Exception as e:
+                logger.exception("failed to send a buffered message to %s", channel)
+                error = error or e
+        if raise_errors and error is not None:
+            raise error
+
+
+def _get_buffer() -> OutputBuffer | None:
+    return getattr(_local, "buffer", None)
+
+
+def coalesce_output(func: Callable) -> Callable:
+    """
+    ハンドラー内の botsend/botwebapi の送信をまとめるデコレーター
+
+    ハンドラーの実行中はメッセージを送信せずに溜めておき、
+    ハンドラーの終了時にできるだけ少ない API 呼び出しで送信する
+
+    @respond_to(r"^gadmin member")
+    @coalesce_output
+    def gadmin_member_insert_delete(message, ...):
+        ...
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _get_buffer() is not None:
+            # すでにまとめている場合はそのまま実行する
+            return func(*args, **kwargs)
+
+        buffer = OutputBuffer()
+        _local.buffer = buffer
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            _local.buffer = None
+            # 送信の失敗はログに出力し、ハンドラーの例外をそのまま送出する
+            buffer.flush(raise_errors=False)
+            raise
+        _local.buffer = None
+        buffer.flush()
+        return result
+
+    return wrapper
+
+
+def _thread_ts(message: Message) -> str | None:
+    if "thread_ts" in message.body:
+        # スレッド内のメッセージの場合
+        return message.thread_ts
+    # 親メッセージの場合
+    return None
+
 
 def botsend(message: Message, text: str) -> None:
     """
@@ -12,12 +142,23 @@ def botsend(message: Message, text: str) -> None:
     :param messsage: slackbotのmessageオブジェクト
     :param text: 送信するテキストメッセージ
     """
+    buffer = _get_buffer()
+    if buffer is not None:
+        buffer.add_text(message.body["channel"], _thread_ts(message), text)
+        return
+
+    # RTM API での送信もレートリミットに合わせて待たせる
+    channel = message.body["channel"]
     if "thread_ts" in message.body:
         # スレッド内のメッセージの場合
-        message.send(text, thread_ts=message.thread_ts)
+        scheduler.call(
+            "rtm.send",
+            channel,
+            lambda: message.send(text, thread_ts=message.thread_ts),
+        )
     else:
         # 親メッセージの場合
-        message.send(text, thread_ts=None)
+        scheduler.call("rtm.send", channel, lambda: message.send(text, thread_ts=None))
 
 
 def botreply(message: Message, text: str) -> None:
@@ -27,28 +168,82 @@ def botreply(message: Message, text: str) -> None:
     :param messsage: slackbotのmessageオブジェクト
     :param text: 送信するテキストメッセージ
     """
+    channel = message.body["channel"]
     if "thread_ts" in message.body:
         # スレッド内のメッセージの場合
-        message.reply(text, in_thread=True)
+        scheduler.call("rtm.send", channel, lambda: message.reply(text, in_thread=True))
     else:
         # 親メッセージの場合
-        message.reply(text)
+        scheduler.call("rtm.send", channel, lambda: message.reply(text))
 
 
 def botwebapi(message: Message, attachments: list[dict] | str) -> None:
     """
     スレッドの親かどうかで応答先を切り替える message.send_webapi() の代わりの関数
 
+    共有の WebClient で chat.postMessage API を呼び出す
+    - https://api.slack.com/methods/chat.postMessage
+
     :param messsage: slackbotのmessageオブジェクト
     :param attachments: 送信するAttachments(JSON)
     """
-    # 文字列じゃないときはJSON文字列にする
-    if not isinstance(attachments, str):
-        attachments = json.dumps(attachments)
-
-    if "thread_ts" in message.body:
-        # スレッド内のメッセージの場合
-        message.send_webapi("", attachments, thread_ts=message.thread_ts)
+    # JSON文字列のときはリストに戻す
+    if isinstance(attachments, str):
+        attachment_list: list[dict] = json.loads(attachments)
     else:
-        # 親メッセージの場合
-        message.send_webapi("", attachments)
+        attachment_list = attachments
+
+    thread_ts = _thread_ts(message)
+    buffer = _get_buffer()
+    if buffer is not None:
+        buffer.add_attachments(message.body["channel"], thread_ts, attachment_list)
+        return
+
+    get_client().chat_postMessage(
+        channel=message.body["channel"],
+        text="",
+        attachments=attachment_list,
+        thread_ts=thread_ts,
+    )
+
+
+def botreact(message: Message, emoji: str) -> None:
+    """
+    message.react() の代わりの関数
+
+    共有の WebClient で reactions.add API を呼び出す
+    - https://api.slack.com/methods/reactions.add
+
+    :param messsage: slackbotのmessageオブジェクト
+    :param emoji: リアクションの絵文字の名前
+    """
+    try:
+        get_client().reactions_add(
+            channel=message.body["channel"],
+            timestamp=message.body["ts"],
+            name=emoji,
+        )
+    except SlackApiError as e:
+        # すでに同じリアクションがついている場合は無視する
+        if e.response.get("error") != "already_reacted":
+            raise
+
+
+def botupload(message: Message, fname: str, fpath: str) -> None:
+    """
+    スレッドの親かどうかで応答先を切り替える message.channel.upload_file() の代わりの関数
+
+    共有の WebClient でファイルをアップロードする
+    - https://api.slack.com/methods/files.getUploadURLExternal
+    - https://api.slack.com/methods/files.completeUploadExternal
+
+    :param messsage: slackbotのmessageオブジェクト
+    :param fname: アップロードするファイルの名前
+    :param fpath: アップロードするファイルのパス
+    """
+    get_client().files_upload_v2(
+        channel=message.body["channel"],
+        file=fpath,
+        filename=fname,
+        thread_ts=_thread_ts(message),
+    )
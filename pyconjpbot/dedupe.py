@@ -0,0 +1,194 @@
+"""
+Slack から再送されたイベントを重複して処理しないための仕組み
+
+Slack は応答が遅いとイベントを再送するため、同じメッセージで
+plusplus が2回カウントされたり、JIRA の issue が2回作成されたりする
+チャンネルとメッセージの ts の組で、処理済みのイベントを判定する
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from peewee import (
+    CharField,
+    CompositeKey,
+    DatabaseProxy,
+    FloatField,
+    Model,
+    PeeweeException,
+    SqliteDatabase,
+    chunked,
+)
+from slackbot import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 処理済みとして覚えておくイベントの数
+DEDUPE_WINDOW = 10000
+# この件数を記録するごとに、古いイベントをデータベースから削除する
+PRUNE_INTERVAL = 1000
+# 記録したイベントをデータベースに書き込む間隔(秒)
+SAVE_INTERVAL = 1
+
+# DEDUPE_DB が指定された場合のみ初期化する
+db = DatabaseProxy()
+
+
+class DeliveredEvent(Model):
+    """
+    処理済みのイベントを保存するモデル
+    """
+
+    channel = CharField()
+    ts = CharField()
+    received = FloatField(index=True)
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("channel", "ts")
+
+
+class EventDeduplicator:
+    """
+    直近に受け取ったイベントを覚えておき、再送されたイベントを判定する
+
+    path を指定すると SQLite にも保存し、再起動後も重複を判定できる
+    保存はバックグラウンドのスレッドで行い、データベースを使えない場合は
+    メモリ上の記録だけで判定を続ける
+    """
+
+    def __init__(
+        self,
+        window: int = DEDUPE_WINDOW,
+        path: str | None = None,
+        interval: float = SAVE_INTERVAL,
+    ) -> None:
+        self.window = window
+        self.path = path
+        self.interval = interval
+        # (チャンネル, ts) ごとの受け取った時刻(古い順)
+        self._seen: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._opened = False
+        # データベースに保存するかどうか(接続に失敗したら False にする)
+        self._persistent = False
+        self._inserted = 0
+        # 書き込み待ちのイベントと、この時刻より古いイベントの削除の予約
+        self._pending: list[tuple[str, str, float]] = []
+        self._prune_before: float | None = None
+        # 重複として破棄したイベントの数
+        self.duplicates = 0
+
+    def _open(self) -> None:
+        """
+        データベースに接続し、保存済みの直近のイベントを読み込む
+        """
+        self._opened = True
+        if not self.path:
+            return
+        try:
+            db.initialize(SqliteDatabase(self.path, pragmas={"journal_mode": "wal"}))
+            db.create_tables([DeliveredEvent], safe=True)
+            query = (
+                DeliveredEvent.select()
+                .order_by(DeliveredEvent.received.desc())
+                .limit(self.window)
+            )
+            events = list(query)
+        except PeeweeException:
+            logger.exception(
+                "failed to open %s, deduplicating events in memory only", self.path
+            )
+            return
+        for event in reversed(events):
+            self._seen[(event.channel, event.ts)] = event.received
+        logger.info("loaded %d delivered events from %s", len(self._seen), self.path)
+        self._persistent = True
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.save)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.save()
+
+    def is_duplicate(self, channel: str | None, ts: str | None) -> bool:
+        """
+        処理済みのイベントなら True を返す
+
+        初めてのイベントは処理済みとして記録する
+        チャンネルや ts がないイベントは判定できないので常に False を返す
+        """
+        if not channel or not ts:
+            return False
+
+        key = (channel, ts)
+        with self._lock:
+            if not self._opened:
+                self._open()
+            if key in self._seen:
+                self.duplicates += 1
+                return True
+            received = time.time()
+            self._seen[key] = received
+            while len(self._seen) > self.window:
+                self._seen.popitem(last=False)
+            if self._persistent:
+                self._pending.append((channel, ts, received))
+                self._inserted += 1
+                if self._inserted % PRUNE_INTERVAL == 0:
+                    self._prune_before = next(iter(self._seen.values()))
+        return False
+
+    def save(self) -> None:
+        """
+        書き込み待ちのイベントをデータベースに保存し、予約された古いイベントを削除する
+
+        保存に失敗したイベントは再起動後の判定に使えなくなるだけなので、
+        ログに出力して破棄する
+        """
+        with self._save_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+                prune_before, self._prune_before = self._prune_before, None
+            if not events and prune_before is None:
+                return
+            try:
+                with db.atomic():
+                    # SQLite の変数の数の上限を超えないように分けて書き込む
+                    for batch in chunked(events, 100):
+                        DeliveredEvent.insert_many(
+                            batch,
+                            fields=[
+                                DeliveredEvent.channel,
+                                DeliveredEvent.ts,
+                                DeliveredEvent.received,
+                            ],
+                        ).on_conflict("replace").execute()
+                    if prune_before is not None:
+                        DeliveredEvent.delete().where(
+                            DeliveredEvent.received < prune_before
+                        ).execute()
+            except PeeweeException:
+                logger.exception(
+                    "failed to save %d delivered events to %s", len(events), self.path
+                )
+
+
+deduplicator = EventDeduplicator(
+    window=getattr(settings, "DEDUPE_WINDOW", DEDUPE_WINDOW),
+    path=getattr(settings, "DEDUPE_DB", None),
+)
+metrics.register_counter(
+    "duplicate_events_total",
+    "Number of redelivered Slack events dropped before dispatch",
+    lambda: deduplicator.duplicates,
+)
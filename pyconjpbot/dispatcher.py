@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import logging
+import time
+import traceback
+from functools import partial
+from typing import Callable
+
+from slackbot import dispatcher, settings
+from slackbot.dispatcher import Message
+
+from .dedupe import deduplicator
+from .metrics import (
+    METRICS_INTERVAL,
+    MetricsWriter,
+    instrument_requests,
+    measure,
+    metrics,
+)
+from .slackusers import users
+from .workerpool import HandlerPool
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDispatcher(dispatcher.MessageDispatcher):
+    """
+    ハンドラーを HandlerPool で実行する MessageDispatcher
+    """
+
+    def __init__(self, slackclient, plugins, errors_to: str | None) -> None:
+        super().__init__(slackclient, plugins, errors_to)
+        self._handlers = HandlerPool.from_settings()
+        metrics.register_gauge(
+            "handler_queued",
+            "Number of handlers waiting to run",
+            self._handlers.qsize,
+        )
+        metrics.register_gauge(
+            "handler_queue_wait_seconds",
+            "Moving average of time handlers wait before running",
+            lambda: self._handlers.latency,
+        )
+        instrument_requests()
+
+    def start(self) -> None:
+        super().start()
+        self._handlers.start()
+        # ハンドラーが待たないように、ユーザー一覧は起動時にバックグラウンドで取得する
+        users.start()
+        # Prometheus のメトリクスファイルを定期的に書き出す
+        metrics_file = getattr(settings, "METRICS_FILE", None)
+        if metrics_file:
+            interval = getattr(settings, "METRICS_INTERVAL", METRICS_INTERVAL)
+            MetricsWriter(metrics_file, interval).start()
+
+    def loop(self) -> None:
+        while True:
+            events = self._client.rtm_read()
+            for event in events:
+                self._on_event(event)
+            time.sleep(1)
+
+    def _on_event(self, event: dict) -> None:
+        """
+        RTM API で受け取ったイベントを処理する
+        """
+        event_type = event.get("type")
+        if event_type == "message":
+            self._on_new_message(event)
+        elif event_type in [
+            "channel_created",
+            "channel_rename",
+            "group_joined",
+            "group_rename",
+            "im_created",
+        ]:
+            self._client.parse_channel_data([event["channel"]])
+        elif event_type in ["team_join", "user_change"]:
+            self._client.parse_user_data([event["user"]])
+            # ユーザー情報のキャッシュも更新する
+            users.update(event["user"])
+
+    def _on_new_message(self, msg: dict) -> None:
+        """
+        再送されたメッセージはハンドラーに渡す前に破棄する
+        """
+        if msg.get("subtype") != "message_changed" and deduplicator.is_duplicate(
+            msg.get("channel"), msg.get("ts")
+        ):
+            logger.info("dropped duplicate event %s %s", msg["channel"], msg["ts"])
+            return
+        super()._on_new_message(msg)
+
+    def _dispatch_msg_handler(self, category: str, msg: dict) -> bool:
+        responded = False
+        for func, args in self._plugins.get_plugins(category, msg.get("text", None)):
+            if func:
+                responded = True
+                self._handlers.submit(func, partial(self._run_handler, func, msg, args))
+        return responded
+
+    def _run_handler(self, func: Callable, msg: dict, args: tuple) -> None:
+        """
+        ハンドラーを実行し、例外が発生したらエラーをSlackに送信する
+
+        実行回数や処理時間は metrics に記録する
+        """
+        try:
+            with measure(func):
+                func(Message(self._client, msg), *args)
+        except Exception:
+            logger.exception(
+                'failed to handle message %s with plugin "%s"',
+                msg["text"],
+                func.__name__,
+            )
+            reply = f'[{func.__name__}] I had a problem handling "{msg["text"]}"\n'
+            tb = f"```\n{traceback.format_exc()}\n```"
+            if self._errors_to:
+                self._client.rtm_send_message(msg["channel"], reply)
+                self._client.rtm_send_message(self._errors_to, f"{reply}\n{tb}")
+            else:
+                self._client.rtm_send_message(msg["channel"], f"{reply}\n{tb}")
@@ -2,17 +2,23 @@ from __future__ import annotations
 
 import random
 import string
+from typing import TYPE_CHECKING
 
-from googleapiclient.discovery import Resource
-from googleapiclient.errors import HttpError
-from slack_sdk import WebClient
-from slackbot import settings
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
-from ..botmessage import botsend
+from ..botmessage import botsend, coalesce_output
+from ..lazyimport import lazy_import
+from ..slackapi import get_client
+from ..slackusers import users
 from .google_api import get_service
 
+if TYPE_CHECKING:
+    from googleapiclient import errors
+    from googleapiclient.discovery import Resource
+else:
+    errors = lazy_import("googleapiclient.errors")
+
 DOMAIN = "pycon.jp"
 
 # https://developers.google.com/admin-sdk/directory
@@ -63,9 +69,7 @@ def _is_admin(user: str) -> bool:
 
     :param user: SlackのユーザーID
     """
-    client = WebClient(token=settings.API_TOKEN)
-    user_info = client.users_info(user=user)
-    return user_info["user"]["is_admin"]
+    return users.is_admin(user)
 
 
 def _remove_email_link(email: str) -> str:
@@ -110,7 +114,7 @@ def _send_password_on_dm(message: Message, email: str, password: str) -> None:
     """
     # ユーザーとのDMのチャンネルIDを取得
     user = message._body["user"]
-    client = WebClient(token=settings.API_TOKEN)
+    client = get_client()
     result = client.conversations_open(users=user)
     dm_channel = result["channel"]["id"]
 
@@ -165,7 +169,7 @@ def _gadmin_user_insert(
         botsend(message, f"ユーザー `{email}` を追加しました")
         # password をユーザーにDMで伝える
         _send_password_on_dm(message, email, password)
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"ユーザーの追加に失敗しました\n`{e}`")
 
 
@@ -188,7 +192,7 @@ def _gadmin_user_delete(service: Resource, message: Message, email: str) -> None
         else:
             service.users().delete(userKey=email).execute()
             botsend(message, f"ユーザー `{email}` を削除しました")
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"ユーザーの削除に失敗しました\n`{e}`")
 
 
@@ -211,7 +215,7 @@ def _gadmin_user_update(
             botsend(message, f"ユーザー `{email}` を停止しました")
         else:
             botsend(message, f"ユーザー `{email}` を再開しました")
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"ユーザー情報の更新に失敗しました\n`{e}`")
 
 
@@ -234,7 +238,7 @@ def _gadmin_user_password_reset(
         botsend(message, f"ユーザー `{email}` のパスワードをリセットしました")
         # password を実行ユーザーにDMで伝える
         _send_password_on_dm(message, email, password)
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"ユーザーパスワードのリセットに失敗しました\n`{e}`")
 
 
@@ -302,7 +306,7 @@ def gadmin_alias_list(message: Message, email: str) -> None:
         else:
             msg = f"`{email}` のエイリアスはありません"
             botsend(message, msg)
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"エイリアスの取得失敗しました\n`{e}`")
 
 
@@ -322,7 +326,7 @@ def _gadmin_alias_insert(
     try:
         service.users().aliases().insert(userKey=email, body=body).execute()
         botsend(message, f"`{email}` にエイリアス `{alias}` を追加しました")
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"エイリアスの追加に失敗しました\n`{e}`")
 
 
@@ -339,7 +343,7 @@ def _gadmin_alias_delete(
     try:
         service.users().aliases().delete(userKey=email, alias=alias).execute()
         botsend(message, f"`{email}` からエイリアス `{alias}` を削除しました")
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"エイリアスの削除に失敗しました\n`{e}`")
 
 
@@ -403,7 +407,7 @@ def _gadmin_group_insert(
     }
     try:
         service.groups().insert(body=body).execute()
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"グループの追加に失敗しました\n`{e}`")
         return
     botsend(message, f"`{group}` グループを追加しました")
@@ -433,7 +437,7 @@ def _gadmin_group_delete(message: Message, service: Resource, group: str) -> Non
         else:
             service.groups().delete(groupKey=group).execute()
             botsend(message, f"`{group}` グループを削除しました")
-    except HttpError as e:
+    except errors.HttpError as e:
         botsend(message, f"グループの削除に失敗しました\n`{e}`")
         return
 
@@ -478,7 +482,7 @@ def gadmin_member_list(message: Message, group: str) -> None:
     group = _get_default_domain_email(group)
     try:
         members_list = service.members().list(groupKey=group).execute()
-    except HttpError:
+    except errors.HttpError:
         botsend(message, f"`{group}` に合致するグループはありません")
         return
 
@@ -510,7 +514,7 @@ def _gadmin_member_insert(
         try:
             service.members().insert(groupKey=group, body=body).execute()
             botsend(message, f"`{group}` グループに `{email}` を追加しました")
-        except HttpError as e:
+        except errors.HttpError as e:
             # TODO: グループが間違っている場合とメンバーのエラーの場合わけ
             botsend(message, f"メンバーの追加に失敗しました\n`{e}`")
 
@@ -530,12 +534,13 @@ def _gadmin_member_delete(
         try:
             service.members().delete(groupKey=group, memberKey=email).execute()
             botsend(message, f"`{group}` グループから `{email}` を削除しました")
-        except HttpError as e:
+        except errors.HttpError as e:
             # TODO: グループが間違っている場合とメンバーのエラーの場合わけ
             botsend(message, f"メンバーの削除に失敗しました\n`{e}`")
 
 
 @respond_to(r"^gadmin\s+member\s+(insert|delete)\s+(\S*)\s+(.*)")
+@coalesce_output
 def gadmin_member_insert_delete(
     message: Message, command: str, group: str, email: str
 ) -> None:
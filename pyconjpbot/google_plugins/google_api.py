@@ -1,10 +1,23 @@
+from __future__ import annotations
+
 import os.path
 from datetime import datetime
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import Resource, build
+from typing import TYPE_CHECKING
+
+from ..lazyimport import lazy_import
+
+if TYPE_CHECKING:
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import credentials as oauth2_credentials
+    from google_auth_oauthlib import flow as oauth_flow
+    from googleapiclient import discovery
+    from googleapiclient.discovery import Resource
+else:
+    # Google API のライブラリは重いので最初の接続時にインポートする
+    google_requests = lazy_import("google.auth.transport.requests")
+    oauth2_credentials = lazy_import("google.oauth2.credentials")
+    oauth_flow = lazy_import("google_auth_oauthlib.flow")
+    discovery = lazy_import("googleapiclient.discovery")
 
 SCOPES = [
     # Google Spreadseets
@@ -37,7 +50,7 @@ def get_service(name: str, version: str) -> Resource:
     serviceオブジェクトを返す
     """
     credentials = get_credentials()
-    service = build(name, version, credentials=credentials)
+    service = discovery.build(name, version, credentials=credentials)
     return service
 
 
@@ -56,13 +69,17 @@ def get_credentials():
     # created automatically when the authorization flow completes for the first
     # time.
     if os.path.exists(token_file):
-        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+        creds = oauth2_credentials.Credentials.from_authorized_user_file(
+            token_file, SCOPES
+        )
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            creds.refresh(google_requests.Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(credential_file, SCOPES)
+            flow = oauth_flow.InstalledAppFlow.from_client_secrets_file(
+                credential_file, SCOPES
+            )
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
         with open(token_file, "w") as token:
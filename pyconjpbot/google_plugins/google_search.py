@@ -1,11 +1,17 @@
+from typing import TYPE_CHECKING
 from urllib.parse import quote, unquote
 
 import requests
-from bs4 import BeautifulSoup
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend
+from ..lazyimport import lazy_import
+
+if TYPE_CHECKING:
+    import bs4
+else:
+    bs4 = lazy_import("bs4")
 
 
 @respond_to(r"google\s+(.*)")
@@ -21,7 +27,7 @@ def google(message: Message, keywords: str) -> None:
     query = quote(keywords)
     url = f"https://google.com/search?q={query}"
     r = requests.get(url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = bs4.BeautifulSoup(r.text, "html.parser")
 
     answer = soup.find("h3")
     if not answer:
@@ -64,7 +70,7 @@ def google_image(message: Message, keywords: str) -> None:
         "(KHTML, like Gecko) Chrome/43.0.2357.134 Safari/537.36"
     )
     r = requests.get(url, headers={"User-agent": useragent})
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = bs4.BeautifulSoup(r.text, "html.parser")
     images = soup.find_all("img")[1:]
 
     if images:
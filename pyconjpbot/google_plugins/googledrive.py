@@ -1,8 +1,10 @@
+from __future__ import annotations
+
 import argparse
 from argparse import Namespace
 from collections import OrderedDict
+from typing import TYPE_CHECKING
 
-from googleapiclient.discovery import Resource
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
@@ -10,6 +12,9 @@ from ..botmessage import botsend, botwebapi
 from .folder_model import Folder
 from .google_api import get_service
 
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
 # Google Drive API の Scope
 SCOPES = "https://www.googleapis.com/auth/drive.metadata.readonly"
 
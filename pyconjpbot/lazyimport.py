@@ -0,0 +1,124 @@
+"""
+重いモジュールを最初の利用時にインポートする仕組み
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from importlib import import_module
+from types import ModuleType
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# モジュール名ごとの遅延インポートの状態
+_registry: dict[str, ImportRecord] = {}
+_registry_lock = threading.Lock()
+
+
+def rss() -> int:
+    """
+    現在のプロセスの常駐メモリ(RSS)のバイト数を返す
+
+    /proc がない環境では最大 RSS を返す
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS はバイト、Linux はキロバイト
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class ImportRecord:
+    """
+    遅延インポートするモジュールとインポートにかかったコスト
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.module: ModuleType | None = None
+        self._lock = threading.Lock()
+        # このモジュールを利用するプラグイン
+        self.plugins: list[str] = []
+        # インポートにかかった秒数と、前後の RSS(未インポートならNone)
+        self.elapsed: float | None = None
+        self.rss_before: int | None = None
+        self.rss_after: int | None = None
+
+    def load(self) -> ModuleType:
+        """
+        モジュールをインポートして返す
+        """
+        module = self.module
+        if module is not None:
+            return module
+        with self._lock:
+            if self.module is None:
+                already_imported = self.name in sys.modules
+                before = rss()
+                start = time.perf_counter()
+                self.module = import_module(self.name)
+                if not already_imported:
+                    # 他の経路ですでにインポート済みの場合は記録しない
+                    self.elapsed = time.perf_counter() - start
+                    self.rss_before = before
+                    self.rss_after = rss()
+                    logger.info("imported %s in %.3f seconds", self.name, self.elapsed)
+            return self.module
+
+
+class LazyModule:
+    """
+    属性に初めてアクセスしたときにモジュールをインポートするプロキシ
+
+    モジュールの属性と衝突しないように、プロキシ自身は公開の属性を持たない
+
+    sympy = lazy_import("sympy")
+    sympy.sympify(text)  # ここで初めて sympy をインポートする
+    """
+
+    def __init__(self, record: ImportRecord) -> None:
+        self.__record = record
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.__record.load(), attr)
+
+    def __repr__(self) -> str:
+        record = self.__record
+        state = "loaded" if record.module is not None else "not loaded"
+        return f"<LazyModule {record.name!r} ({state})>"
+
+
+def lazy_import(name: str) -> Any:
+    """
+    最初に属性にアクセスしたときにインポートするモジュールを返す
+
+    同じモジュールは複数のプラグインで共有する
+    型チェック用には TYPE_CHECKING で通常のインポートを併用する
+    """
+    # 呼び出し元のプラグインのモジュール名
+    plugin = sys._getframe(1).f_globals.get("__name__", "")
+    with _registry_lock:
+        record = _registry.get(name)
+        if record is None:
+            record = _registry[name] = ImportRecord(name)
+        if plugin not in record.plugins:
+            record.plugins.append(plugin)
+    return LazyModule(record)
+
+
+def lazy_modules() -> list[ImportRecord]:
+    """
+    登録済みの遅延インポートのモジュールを登録順に返す
+    """
+    with _registry_lock:
+        return list(_registry.values())
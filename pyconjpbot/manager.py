@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from glob import glob
+from importlib import import_module
+from importlib.util import find_spec
+from typing import Callable, Iterator
+
+from slackbot import manager
+
+from .lazyimport import rss
+from .router import ListenRouter
+from .startup import record_import, report
+
+logger = logging.getLogger(__name__)
+
+
+class PluginsManager(manager.PluginsManager):
+    """
+    listen_to のパターンを ListenRouter でまとめて判定する PluginsManager
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._router: ListenRouter | None = None
+
+    def init_plugins(self) -> None:
+        super().init_plugins()
+        self._router = ListenRouter(self.commands["listen_to"])
+        logger.info("startup report\n%s", report())
+
+    def _load_plugins(self, plugin: str) -> None:
+        """
+        プラグインを読み込み、モジュールごとのインポートにかかった秒数とメモリを記録する
+        """
+        logger.info('loading plugin "%s"', plugin)
+        spec = find_spec(plugin)
+        if spec is None:
+            logger.error("Failed to find %s", plugin)
+            return
+        if spec.submodule_search_locations:
+            path_name = spec.submodule_search_locations[0]
+        else:
+            path_name = spec.origin or ""
+
+        module_list = [plugin]
+        if not path_name.endswith(".py"):
+            module_list = [
+                ".".join((plugin, os.path.split(f)[-1][:-3]))
+                for f in glob(f"{path_name}/[!_]*.py")
+            ]
+        for module in module_list:
+            rss_before = rss()
+            start = time.perf_counter()
+            try:
+                import_module(module)
+            except Exception:
+                logger.exception("Failed to import %s", module)
+            record_import(module, time.perf_counter() - start, rss_before, rss())
+
+    def _get_router(self) -> ListenRouter:
+        """
+        プラグインが追加されていたら ListenRouter を作り直して返す
+        """
+        listen_to = self.commands["listen_to"]
+        if self._router is None or len(self._router) != len(listen_to):
+            self._router = ListenRouter(listen_to)
+        return self._router
+
+    def get_plugins(
+        self, category: str, text: str | None
+    ) -> Iterator[tuple[Callable | None, tuple | None]]:
+        if category != "listen_to":
+            yield from super().get_plugins(category, text)
+            return
+
+        has_matching_plugin = False
+        for func, args in self._get_router().match(text or ""):
+            has_matching_plugin = True
+            yield func, args
+
+        if not has_matching_plugin:
+            yield None, None
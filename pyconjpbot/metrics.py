@@ -0,0 +1,408 @@
+"""
+ハンドラーごとの実行回数、エラー数、処理時間の計測
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 処理時間のヒストグラムのバケット(秒)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Prometheus のメトリクスファイルを書き出す間隔(秒)
+METRICS_INTERVAL = 60
+# メトリクス名の接頭辞
+PREFIX = "pyconjpbot"
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    バケットごとの件数と合計値を持つヒストグラム
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        # 最後の要素は最大のバケットを超えた件数
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self) -> Histogram:
+        copied = Histogram(self.buckets)
+        copied.counts = list(self.counts)
+        copied.count = self.count
+        copied.sum = self.sum
+        return copied
+
+    def quantile(self, q: float) -> float:
+        """
+        指定された分位数が含まれるバケットの上限を返す(概算値)
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class HandlerStats:
+    """
+    ハンドラー1つ分の計測結果
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+        # ハンドラー内で Slack や外部の HTTP 通信にかかった時間
+        self.outbound = Histogram()
+        self.outbound_calls = 0
+        # ハンドラー内で Slack のレートリミットのために待った時間
+        self.ratelimit_wait = Histogram()
+        # 過負荷などで破棄した回数と、後回しにした回数
+        self.shed = 0
+        self.deferred = 0
+
+
+class _Run:
+    """
+    実行中のハンドラーの外部通信の集計
+    """
+
+    def __init__(self) -> None:
+        self.outbound = 0.0
+        self.outbound_calls = 0
+        self.ratelimit_wait = 0.0
+
+
+class Metrics:
+    """
+    ハンドラーごとの計測結果を保持する
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._handlers: dict[str, HandlerStats] = {}
+        # 通信の種類(slack, http)ごとの回数と合計時間
+        self._outbound: dict[str, list[float]] = {}
+        # 他のモジュールが登録する Prometheus のゲージとカウンター
+        # (メトリクス名ごとの種類、説明、値を返す関数)
+        self._collectors: dict[str, tuple[str, str, Callable[[], float]]] = {}
+
+    def _stats(self, name: str) -> HandlerStats:
+        stats = self._handlers.get(name)
+        if stats is None:
+            stats = self._handlers[name] = HandlerStats()
+        return stats
+
+    def record(self, name: str, elapsed: float, run: _Run, error: bool) -> None:
+        with self._lock:
+            stats = self._stats(name)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.latency.observe(elapsed)
+            stats.outbound.observe(run.outbound)
+            stats.outbound_calls += run.outbound_calls
+            stats.ratelimit_wait.observe(run.ratelimit_wait)
+
+    def record_shed(self, name: str) -> None:
+        with self._lock:
+            self._stats(name).shed += 1
+
+    def record_deferred(self, name: str) -> None:
+        with self._lock:
+            self._stats(name).deferred += 1
+
+    def record_outbound(self, kind: str, elapsed: float) -> None:
+        with self._lock:
+            total = self._outbound.setdefault(kind, [0, 0.0])
+            total[0] += 1
+            total[1] += elapsed
+
+    def register_gauge(self, name: str, help: str, func: Callable[[], float]) -> None:
+        """
+        メトリクスファイルに出力するゲージ(増減する現在の値)を登録する
+        """
+        with self._lock:
+            self._collectors[name] = ("gauge", help, func)
+
+    def register_counter(self, name: str, help: str, func: Callable[[], float]) -> None:
+        """
+        メトリクスファイルに出力するカウンター(増えるだけの累計値)を登録する
+
+        Prometheus の命名規則に合わせて、名前は _total で終わらせる
+        """
+        with self._lock:
+            self._collectors[name] = ("counter", help, func)
+
+    def handlers(self) -> dict[str, HandlerStats]:
+        """
+        ハンドラー名ごとの計測結果のコピーを返す
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self._handlers.items():
+                copied = HandlerStats()
+                copied.calls = stats.calls
+                copied.errors = stats.errors
+                copied.latency = stats.latency.copy()
+                copied.outbound = stats.outbound.copy()
+                copied.outbound_calls = stats.outbound_calls
+                copied.ratelimit_wait = stats.ratelimit_wait.copy()
+                copied.shed = stats.shed
+                copied.deferred = stats.deferred
+                result[name] = copied
+            return result
+
+    def prometheus(self) -> str:
+        """
+        Prometheus のテキスト形式で計測結果を返す
+        """
+        handlers = self.handlers()
+        with self._lock:
+            outbound = {kind: list(total) for kind, total in self._outbound.items()}
+            collectors = dict(self._collectors)
+
+        lines = []
+        for metric, help, attr in (
+            ("handler_calls_total", "Number of handler calls", "calls"),
+            ("handler_errors_total", "Number of handler errors", "errors"),
+            (
+                "handler_outbound_calls_total",
+                "Number of outbound calls made by handlers",
+                "outbound_calls",
+            ),
+            ("handler_shed_total", "Number of handler calls shed", "shed"),
+            ("handler_deferred_total", "Number of handler calls deferred", "deferred"),
+        ):
+            lines.append(f"# HELP {PREFIX}_{metric} {help}")
+            lines.append(f"# TYPE {PREFIX}_{metric} counter")
+            for name, stats in sorted(handlers.items()):
+                value = getattr(stats, attr)
+                lines.append(f'{PREFIX}_{metric}{{handler="{name}"}} {value}')
+
+        for metric, help, attr in (
+            ("handler_latency_seconds", "Handler latency", "latency"),
+            (
+                "handler_outbound_seconds",
+                "Time spent in outbound Slack/HTTP calls per handler call",
+                "outbound",
+            ),
+            (
+                "handler_ratelimit_wait_seconds",
+                "Time spent waiting for Slack rate limit per handler call",
+                "ratelimit_wait",
+            ),
+        ):
+            lines.append(f"# HELP {PREFIX}_{metric} {help}")
+            lines.append(f"# TYPE {PREFIX}_{metric} histogram")
+            for name, stats in sorted(handlers.items()):
+                lines.extend(
+                    _histogram_lines(f"{PREFIX}_{metric}", name, getattr(stats, attr))
+                )
+
+        for metric, help, index in (
+            ("outbound_calls_total", "Number of outbound calls", 0),
+            ("outbound_seconds_total", "Time spent in outbound calls", 1),
+        ):
+            lines.append(f"# HELP {PREFIX}_{metric} {help}")
+            lines.append(f"# TYPE {PREFIX}_{metric} counter")
+            for kind, total in sorted(outbound.items()):
+                lines.append(f'{PREFIX}_{metric}{{kind="{kind}"}} {total[index]}')
+
+        for metric, (kind, help, func) in sorted(collectors.items()):
+            try:
+                value = func()
+            except Exception:
+                logger.exception("failed to get %s %s", kind, metric)
+                continue
+            lines.append(f"# HELP {PREFIX}_{metric} {help}")
+            lines.append(f"# TYPE {PREFIX}_{metric} {kind}")
+            lines.append(f"{PREFIX}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Prometheus のテキスト形式でファイルに書き出す
+
+        node_exporter が書き込み途中のファイルを読まないように、
+        一時ファイルに書き出してから置き換える
+        """
+        text = self.prometheus()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+
+def _histogram_lines(metric: str, name: str, histogram: Histogram) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{handler="{name}",le="+Inf"}} {histogram.count}')
+    lines.append(f'{metric}_sum{{handler="{name}"}} {histogram.sum}')
+    lines.append(f'{metric}_count{{handler="{name}"}} {histogram.count}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def handler_name(func: Callable) -> str:
+    return f"{func.__module__}.{func.__name__}"
+
+
+@contextmanager
+def measure(func: Callable) -> Iterator[None]:
+    """
+    ハンドラーの実行時間、エラー、外部通信の時間を計測する
+    """
+    run = _Run()
+    _local.run = run
+    error = False
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.run = None
+        metrics.record(handler_name(func), elapsed, run, error)
+
+
+@contextmanager
+def outbound(kind: str) -> Iterator[None]:
+    """
+    Slack や外部の HTTP 通信にかかった時間を計測する
+
+    入れ子になった場合は一番外側だけを計測する(Slack API の中の HTTP 通信など)
+    """
+    if getattr(_local, "outbound", False):
+        yield
+        return
+
+    _local.outbound = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.outbound = False
+        metrics.record_outbound(kind, elapsed)
+        run = getattr(_local, "run", None)
+        if run is not None:
+            run.outbound += elapsed
+            run.outbound_calls += 1
+
+
+def record_ratelimit_wait(elapsed: float) -> None:
+    """
+    Slack のレートリミットのために待った時間を、実行中のハンドラーに記録する
+
+    待ち時間は outbound() の通信の時間には含めない
+    """
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.ratelimit_wait += elapsed
+
+
+def instrument_requests() -> None:
+    """
+    requests での HTTP 通信の時間を計測するようにする
+    """
+    send = requests.Session.send
+    if getattr(send, "instrumented", False):
+        return
+
+    @functools.wraps(send)
+    def instrumented_send(self, request, **kwargs):
+        with outbound("http"):
+            return send(self, request, **kwargs)
+
+    instrumented_send.instrumented = True  # type: ignore
+    requests.Session.send = instrumented_send  # type: ignore
+
+
+class MetricsWriter:
+    """
+    一定間隔で Prometheus のメトリクスファイルを書き出すスレッド
+    """
+
+    def __init__(self, path: str, interval: float = METRICS_INTERVAL) -> None:
+        self.path = path
+        self.interval = interval
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                metrics.write(self.path)
+            except OSError:
+                logger.exception("failed to write metrics to %s", self.path)
+
+
+def stats_report(top: int = 20) -> str:
+    """
+    処理時間の合計が長い順にハンドラーの計測結果を返す
+    """
+    handlers = metrics.handlers()
+    if not handlers:
+        return "まだハンドラーが実行されていません"
+
+    lines = [
+        "回数 | エラー | 破棄 | 平均(秒) | p95(秒) | 通信(秒) | 待ち(秒) | ハンドラー"
+    ]
+    ranking = sorted(
+        handlers.items(), key=lambda item: item[1].latency.sum, reverse=True
+    )
+    for name, stats in ranking[:top]:
+        # 破棄されただけのハンドラーは実行回数が0
+        calls = stats.calls or 1
+        average = stats.latency.sum / calls
+        outbound_average = stats.outbound.sum / calls
+        wait_average = stats.ratelimit_wait.sum / calls
+        lines.append(
+            f"{stats.calls:4d} | {stats.errors:6d} | {stats.shed:4d} | "
+            f"{average:8.3f} | {stats.latency.quantile(0.95):7.3f} | "
+            f"{outbound_average:8.3f} | {wait_average:8.3f} | {name}"
+        )
+    return "```\n" + "\n".join(lines) + "\n```"
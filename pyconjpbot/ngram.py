@@ -0,0 +1,150 @@
+"""
+文字列の部分一致とあいまい検索のための n-gram のインデックス
+
+日本語の名前は2文字のことが多いため、FTS5 の trigram ではなく
+1文字と2文字(bigram)の n-gram をメモリ上に持つ
+"""
+
+from __future__ import annotations
+
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Iterable, NamedTuple
+
+# あいまい検索で結果に含める類似度の下限(Dice 係数)
+FUZZY_THRESHOLD = 0.4
+
+
+def normalize(text: str) -> str:
+    """
+    全角/半角と大文字/小文字の違いを吸収する
+    """
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def ngrams(text: str) -> set[str]:
+    """
+    1文字と2文字の n-gram の集合を返す
+    """
+    grams = set(text)
+    grams.update(text[i : i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def bigrams(text: str) -> set[str]:
+    """
+    類似度の計算に使う2文字の n-gram の集合を返す(1文字の場合はその文字)
+    """
+    if len(text) < 2:
+        return {text}
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class Match(NamedTuple):
+    """
+    検索結果
+    """
+
+    key: str
+    # 1.0 は部分一致、それ未満はあいまい検索の類似度
+    score: float
+
+
+class NgramIndex:
+    """
+    文字列をキーとする n-gram の転置インデックス
+
+    index = NgramIndex(["takanory", "terada"])
+    index.search("taka")  # => [Match(key="takanory", score=1.0)]
+    """
+
+    def __init__(self, keys: Iterable[str] = ()) -> None:
+        self._lock = threading.Lock()
+        # n-gram ごとのキーの集合
+        self._postings: dict[str, set[str]] = defaultdict(set)
+        # キーごとの正規化した文字列
+        self._keys: dict[str, str] = {}
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._keys
+
+    def add(self, key: str) -> None:
+        """
+        キーを追加する(追加済みの場合は何もしない)
+        """
+        with self._lock:
+            if key in self._keys:
+                return
+            text = self._keys[key] = normalize(key)
+            for gram in ngrams(text):
+                self._postings[gram].add(key)
+
+    def remove(self, key: str) -> None:
+        """
+        キーを削除する(存在しない場合は何もしない)
+        """
+        with self._lock:
+            text = self._keys.pop(key, None)
+            if text is None:
+                return
+            for gram in ngrams(text):
+                keys = self._postings[gram]
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def search(self, keyword: str, fuzzy: bool = True) -> list[Match]:
+        """
+        キーワードを含むキーを返す
+
+        部分一致を先に(完全一致、前方一致、短い順)、
+        fuzzy の場合は続けてあいまい検索の結果を類似度の高い順に返す
+        """
+        query = normalize(keyword)
+        if not query:
+            return []
+        with self._lock:
+            matches = self._substring(query)
+            fuzzy_matches = self._fuzzy(query, matches) if fuzzy else []
+
+        def order(key: str) -> tuple:
+            text = self._keys.get(key, "")
+            return (text != query, not text.startswith(query), len(text), key)
+
+        results = [Match(key, 1.0) for key in sorted(matches, key=order)]
+        results.extend(fuzzy_matches)
+        return results
+
+    def _substring(self, query: str) -> set[str]:
+        postings = [self._postings.get(gram, set()) for gram in bigrams(query)]
+        # 一番キーの少ない n-gram から絞り込む
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            if not candidates:
+                break
+            candidates &= keys
+        return {key for key in candidates if query in self._keys[key]}
+
+    def _fuzzy(self, query: str, exclude: set[str]) -> list[Match]:
+        query_grams = bigrams(query)
+        shared: Counter[str] = Counter()
+        for gram in query_grams:
+            shared.update(self._postings.get(gram, ()))
+
+        matches = []
+        for key, count in shared.items():
+            if key in exclude:
+                continue
+            key_grams = len(bigrams(self._keys[key]))
+            score = 2 * count / (len(query_grams) + key_grams)
+            if score >= FUZZY_THRESHOLD:
+                matches.append(Match(key, score))
+        matches.sort(key=lambda match: (-match.score, match.key))
+        return matches
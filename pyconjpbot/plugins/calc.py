@@ -1,16 +1,25 @@
 import re
+from typing import TYPE_CHECKING
 
 from slackbot.bot import listen_to
 from slackbot.dispatcher import Message
-from sympy import SympifyError, sympify
 
 from ..botmessage import botsend
+from ..lazyimport import lazy_import
+from ..workerpool import fast_lane
+
+if TYPE_CHECKING:
+    import sympy
+else:
+    # sympy は重いので最初の計算時にインポートする
+    sympy = lazy_import("sympy")
 
 # 単一の数字っぽい文字列を表すパターン
 NUM_PATTERN = re.compile(r"^\s*[-+]?[\d.,]+\s*$")
 
 
 @listen_to(r"^(([-+*/^%!(),.\d\s]|pi|e|sqrt|sin|cos|tan)+)$")
+@fast_lane
 def calc(message: Message, expression: str, dummy_: str) -> None:
     """
     数式っぽい文字列だったら計算して結果を返す
@@ -21,8 +30,8 @@ def calc(message: Message, expression: str, dummy_: str) -> None:
     try:
         # カンマを削除
         expression = expression.replace(",", "")
-        result = sympify(expression)
-    except SympifyError:
+        result = sympy.sympify(expression)
+    except sympy.SympifyError:
         # 数式じゃなかったら無視する
         return
 
@@ -33,7 +42,7 @@ def calc(message: Message, expression: str, dummy_: str) -> None:
         try:
             # カンマをつけて出力する
             answer = f"{float(result):,}"
-        except SympifyError:
+        except sympy.SympifyError:
             # 答えが数値じゃなかったら無視する
             return
 
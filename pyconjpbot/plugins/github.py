@@ -1,12 +1,23 @@
-from github import Github
+from typing import TYPE_CHECKING
+
 from slackbot import settings
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend, botwebapi
-
-github = Github(settings.GITHUB_TOKEN)
-org = github.get_organization(settings.GITHUB_ORGANIZATION)
+from ..lazyimport import lazy_import
+from ..resources import lazy
+
+if TYPE_CHECKING:
+    import github as pygithub
+else:
+    pygithub = lazy_import("github")
+
+github = lazy("github", lambda: pygithub.Github(settings.GITHUB_TOKEN))
+org = lazy(
+    "github_organization",
+    lambda: github.get_organization(settings.GITHUB_ORGANIZATION),
+)
 
 
 @respond_to(r"^github\s+repos")
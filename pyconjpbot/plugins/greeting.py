@@ -8,9 +8,11 @@ from slackbot.bot import listen_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botreply
+from ..workerpool import LOW, priority
 
 
 @listen_to("おはよう|お早う")
+@priority(LOW)
 def morning(message: Message) -> None:
     replies = (
         "おはよう",
@@ -21,6 +23,7 @@ def morning(message: Message) -> None:
 
 
 @listen_to("こんにち[はわ]")
+@priority(LOW)
 def noon(message: Message) -> None:
     replies = (
         "こんにちは",
@@ -31,6 +34,7 @@ def noon(message: Message) -> None:
 
 
 @listen_to("いってきま|行ってきま")
+@priority(LOW)
 def go(message: Message) -> None:
     replies = (
         "いってらっしゃい",
@@ -42,6 +46,7 @@ def go(message: Message) -> None:
 
 
 @listen_to("眠た?い|ねむた?い|寝る|寝ます")
+@priority(LOW)
 def night(message: Message) -> None:
     replies = (
         "おやすみなさい",
@@ -3,23 +3,21 @@ from __future__ import annotations
 import argparse
 import re
 from argparse import Namespace
+from typing import TYPE_CHECKING
 from urllib.parse import quote
 
-from jira import JIRA, JIRAError
 from slackbot import settings
 from slackbot.bot import listen_to, respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend, botwebapi
+from ..lazyimport import lazy_import
+from .jira_api import CLEAN_JIRA_URL, jira
 
-# Clean JIRA Url to not have trailing / if exists
-CLEAN_JIRA_URL = settings.JIRA_URL
-if settings.JIRA_URL[-1:] == "/":
-    CLEAN_JIRA_URL = CLEAN_JIRA_URL[:-1]
-
-# Login to jira
-jira_auth = (settings.JIRA_USER, settings.JIRA_PASS)
-jira = JIRA(CLEAN_JIRA_URL, basic_auth=jira_auth)
+if TYPE_CHECKING:
+    from jira import exceptions as jira_exceptions
+else:
+    jira_exceptions = lazy_import("jira.exceptions")
 
 # デフォルトの検索対象プロジェクトを設定ファイルから読み込む
 DEFAULT_PROJECT = settings.JIRA_DEFAULT_PROJECT
@@ -87,7 +85,7 @@ def create_attachments(issue_id: str) -> list[dict] | None:
     try:
         # JIRAからissue情報を取得
         issue = jira.issue(issue_id)
-    except JIRAError:
+    except jira_exceptions.JIRAError:
         # 存在しない場合はNoneを返す
         return None
 
@@ -231,7 +229,7 @@ def _send_jira_search_responce(message: Message, query: str, title: str) -> None
 
     try:
         issues = jira.search_issues(query)
-    except JIRAError as err:
+    except jira_exceptions.JIRAError as err:
         # なんらかのエラーが発生
         botsend(message, f"JIRAError: `{err.text}`")
         return
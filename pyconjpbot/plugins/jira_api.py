@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from slackbot import settings
+
+from ..lazyimport import lazy_import
+from ..resources import lazy
+
+if TYPE_CHECKING:
+    from jira import JIRA, client
+else:
+    # jira パッケージは重いのでログイン時にインポートする
+    client = lazy_import("jira.client")
+
+# Clean JIRA Url to not have trailing / if exists
+CLEAN_JIRA_URL = settings.JIRA_URL
+if settings.JIRA_URL[-1:] == "/":
+    CLEAN_JIRA_URL = CLEAN_JIRA_URL[:-1]
+
+
+def _login() -> JIRA:
+    """
+    JIRA にログインする
+    """
+    jira_auth = (settings.JIRA_USER, settings.JIRA_PASS)
+    return client.JIRA(CLEAN_JIRA_URL, basic_auth=jira_auth)
+
+
+# jira, pycamp プラグインで共有する JIRA との接続(最初の利用時にログインする)
+jira = lazy("jira", _login)
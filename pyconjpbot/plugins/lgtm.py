@@ -3,14 +3,23 @@ from __future__ import annotations
 from io import BytesIO
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
 import requests
-from PIL import Image, ImageDraw, ImageFont
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
-from ..botmessage import botsend
+from ..botmessage import botsend, botupload
+from ..lazyimport import lazy_import
+
+if TYPE_CHECKING:
+    from PIL import Image, ImageDraw, ImageFont
+else:
+    # Pillow は画像を生成するときにインポートする
+    Image = lazy_import("PIL.Image")
+    ImageDraw = lazy_import("PIL.ImageDraw")
+    ImageFont = lazy_import("PIL.ImageFont")
 
 FONT = "NotoSansCJKjp-Bold.otf"
 
@@ -133,7 +142,7 @@ def lgtm_create(message: Message, url: str, text: str = "LGTM") -> None:
         with NamedTemporaryFile(suffix=".png") as fp:
             im.save(fp, format="png")
             fname = f"{basename}-{text.lower()}{idx}.png"
-            message.channel.upload_file(fname=fname, fpath=fp.name)
+            botupload(message, fname, fp.name)
 
 
 @respond_to(r"^lgtm\s+help")
@@ -3,15 +3,17 @@ import random
 from datetime import date
 
 import git
-from slack_sdk import WebClient
-from slackbot import settings
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botreply, botsend, botwebapi
+from ..slackapi import get_client
+from ..slackusers import users
+from ..workerpool import fast_lane
 
 
 @respond_to(r"^help$")
+@fast_lane
 def help(message: Message) -> None:
     """
     helpページのURLを返す
@@ -20,6 +22,7 @@ def help(message: Message) -> None:
 
 
 @respond_to(r"^shuffle\s+(.*)")
+@fast_lane
 def shuffle(message: Message, words_str: str) -> None:
     """
     指定したキーワードをシャッフルして返す
@@ -33,6 +36,7 @@ def shuffle(message: Message, words_str: str) -> None:
 
 
 @respond_to(r"^choice\s+(.*)")
+@fast_lane
 def choice(message: Message, words_str: str) -> None:
     """
     指定したキーワードから一つを選んで返す
@@ -45,6 +49,7 @@ def choice(message: Message, words_str: str) -> None:
 
 
 @respond_to(r"^ping$")
+@fast_lane
 def ping(message: Message) -> None:
     """
     pingに対してpongで応答する
@@ -79,7 +84,6 @@ def random_command(message: Message, subcommand: str = "") -> None:
 
     - https://api.slack.com/methods/conversations.members
     - https://api.slack.com/methods/users.getPresence
-    - https://api.slack.com/methods/users.info
     """
 
     if subcommand == "help":
@@ -93,7 +97,7 @@ def random_command(message: Message, subcommand: str = "") -> None:
 
     # チャンネルのメンバー一覧を取得
     channel = message.body["channel"]
-    client = WebClient(token=settings.API_TOKEN)
+    client = get_client()
     result = client.conversations_members(channel=channel)
     members = result["members"]
 
@@ -112,14 +116,14 @@ def random_command(message: Message, subcommand: str = "") -> None:
                 members.remove(member_id)
                 member_id = None
 
-    user_info = client.users_info(user=member_id)
-    name = user_info["user"]["name"]
+    name = users.get_name(member_id)
     botsend(message, f"{name} さん、君に決めた！")
 
 
 @respond_to(r"^cal$")
 @respond_to(r"^cal\s+(\d+)$")
 @respond_to(r"^cal\s+(\d+)\s+(\d+)$")
+@fast_lane
 def cal_command(message: Message, month_str: str = "", year_str: str = "") -> None:
     """
     一ヶ月のカレンダーを返す
@@ -137,6 +141,7 @@ def cal_command(message: Message, month_str: str = "", year_str: str = "") -> No
 
 
 @respond_to(r"^cal\s+help$")
+@fast_lane
 def cal_help(message: Message) -> None:
     """
     cal コマンドのヘルプを返す
@@ -1,13 +1,25 @@
+import math
 import random
+from typing import Callable
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-from slackbot import settings
 from slackbot.bot import listen_to, respond_to
 from slackbot.dispatcher import Message
 
-from ..botmessage import botsend, botwebapi
-from .plusplus_model import Plusplus
+from ..botmessage import botsend, botwebapi, coalesce_output
+from ..slackusers import users
+from .plusplus_model import (
+    RANKING_SIZE,
+    Plusplus,
+    delete_history,
+    flush_counters,
+    get_counters,
+    merge_counters,
+    ranking,
+    rename_counter,
+    resolve_name,
+    search_names,
+    update_counters,
+)
 
 PLUS_MESSAGE = (
     "leveled up!",
@@ -16,6 +28,18 @@ PLUS_MESSAGE = (
     "(☝՞ਊ ՞)☝ウェーイ",
 )
 
+# 検索結果の1ページの件数
+SEARCH_PAGE_SIZE = 20
+# ランキングで表示する件数
+RANKING_TOP = 10
+# ランキングの期間の表示名
+RANKING_WINDOWS = {
+    "all": "全期間",
+    "month": "過去30日間",
+    "week": "過去7日間",
+    "day": "過去24時間",
+}
+
 MINUS_MESSAGE = (
     "leveled down.",
     "レベルが下がりました",
@@ -24,43 +48,33 @@ MINUS_MESSAGE = (
 )
 
 
-def _get_user_name(user_id: str) -> str:
+def parse_names(
+    targets: str, get_name: Callable[[str], str] = users.get_name
+) -> list[str]:
     """
-    指定された Slack の user_id に対応する username を返す
-
-    WebClient で users.list API を呼び出す
-    - https://api.slack.com/methods/users.info
-    """
-    client = WebClient(token=settings.API_TOKEN)
-    try:
-        response = client.users_info(user=user_id)
-        return response["user"]["name"]
-    except SlackApiError:
-        return ""
+    ++ の対象の文字列から名前の一覧を返す
 
-
-def _update_count(message: Message, target: str, plusplus: str) -> None:
-    """
-    指定ユーザーのカウンターを更新する
+    :param get_name: ユーザーIDからユーザー名を返す関数
     """
-    target = target.lower()
-    # 1文字の対象は無視する
-    if len(target) < 2:
-        return
-    plus, created = Plusplus.get_or_create(name=target, defaults={"counter": 0})
-
-    if plusplus == "++":
-        plus.counter += 1
-        msg = random.choice(PLUS_MESSAGE)
-    else:
-        plus.counter -= 1
-        msg = random.choice(MINUS_MESSAGE)
-    plus.save()
-
-    botsend(message, f"{target} {msg} (通算: {plus.counter})")
+    names = []
+    for target in targets.split():
+        # user_id(<@XXXXXX>)をユーザー名に変換する
+        if target.startswith("<@"):
+            user_id = target[2:-1]  # user_idを取り出す
+            target = get_name(user_id)
+        # 先頭に @ があったら削除する
+        if target.startswith("@"):
+            target = target[1:]
+        target = target.lower()
+        # 1文字の対象は無視する
+        if len(target) < 2:
+            continue
+        names.append(target)
+    return names
 
 
 @listen_to(r"^(.*):?\s*(\+\+|--)")
+@coalesce_output
 def multi_plusplus(message: Message, targets: str, plusplus: str) -> None:
     """
     指定された複数の名前に対して ++ する
@@ -71,15 +85,20 @@ def multi_plusplus(message: Message, targets: str, plusplus: str) -> None:
     日本語++
     takanory  @terada++ コメント
     """
-    for target in targets.split():
-        # user_id(<@XXXXXX>)をユーザー名に変換する
-        if target.startswith("<@"):
-            user_id = target[2:-1]  # user_idを取り出す
-            target = _get_user_name(user_id)
-        # 先頭に @ があったら削除する
-        if target.startswith("@"):
-            target = target[1:]
-        _update_count(message, target, plusplus)
+    # 変更前や統合元の名前は現在の名前でカウントする
+    names = [resolve_name(name) for name in parse_names(targets)]
+
+    # 全員分のカウンターを1回でまとめて更新する
+    if plusplus == "++":
+        counters = update_counters(names, 1)
+        messages = PLUS_MESSAGE
+    else:
+        counters = update_counters(names, -1)
+        messages = MINUS_MESSAGE
+
+    for name in dict.fromkeys(names):
+        msg = random.choice(messages)
+        botsend(message, f"{name} {msg} (通算: {counters[name]})")
 
 
 @respond_to(r"^plusplus\s+(del|delete)\s+(\S+)")
@@ -88,7 +107,7 @@ def plusplus_delete(message: Message, subcommand: str, name: str) -> None:
     指定された名前を削除する
     カウントが10未満のもののみ削除する
     """
-
+    flush_counters()
     try:
         plus = Plusplus.get(name=name)
     except Plusplus.DoesNotExist:
@@ -100,6 +119,7 @@ def plusplus_delete(message: Message, subcommand: str, name: str) -> None:
         return
 
     plus.delete_instance()
+    delete_history(name)
     message.send(f"`{name}` を削除しました")
 
 
@@ -108,20 +128,20 @@ def plusplus_rename(message: Message, old: str, new: str) -> None:
     """
     指定された old から new に名前を変更する
     """
+    flush_counters()
     try:
         oldplus = Plusplus.get(name=old)
     except Plusplus.DoesNotExist:
         botsend(message, f"`{old}` という名前は登録されていません")
         return
 
-    newplus, created = Plusplus.get_or_create(name=new, counter=oldplus.counter)
-    if not created:
+    if Plusplus.get_or_none(name=new) is not None:
         # すでに存在している
         message.send(f"`{new}` という名前はすでに登録されています")
         return
 
-    # 入れ替える
-    oldplus.delete_instance()
+    # old は new の別名として残す
+    rename_counter(old, new)
     botsend(message, f"`{old}` から `{new}` に名前を変更しました(count: {oldplus.counter})")
 
 
@@ -130,6 +150,13 @@ def plusplus_merge(message: Message, old: str, new: str) -> None:
     """
     指定された old と new を一つにまとめる
     """
+    flush_counters()
+    # 統合先に統合済みの名前が指定された場合は、現在の名前に統合する
+    new = resolve_name(new)
+    if old == new:
+        botsend(message, f"`{old}` と `{new}` は同じ名前です")
+        return
+
     try:
         oldplus = Plusplus.get(name=old)
     except Plusplus.DoesNotExist:
@@ -145,35 +172,47 @@ def plusplus_merge(message: Message, old: str, new: str) -> None:
     oldcount = oldplus.counter
     newcount = newplus.counter
 
-    # 値を統合する
-    newplus.counter += oldplus.counter
-    newplus.save()
-    oldplus.delete_instance()
+    # 値を統合し、old は new の別名として残す
+    counter = merge_counters(old, new)
 
     botsend(
         message,
         (
             f"`{old}` を `{new}` に統合しました"
-            f"(count: {oldcount} + {newcount} = {newplus.counter})"
+            f"(count: {oldcount} + {newcount} = {counter})"
         ),
     )
 
 
-@respond_to(r"^plusplus\s+search\s+(\S+)")
-def plusplus_search(message: Message, keyword: str) -> None:
+@respond_to(r"^plusplus\s+search\s+(\S+)(?:\s+(\d+))?")
+def plusplus_search(message: Message, keyword: str, page: str) -> None:
     """
     指定されたキーワードを含む名前とカウントの一覧を返す
+
+    部分一致する名前のあとに、似ている名前を返す
     """
-    pattern = f"%{keyword}%"
-    pluses = Plusplus.select().where(Plusplus.name**pattern)
+    matches = search_names(keyword)
 
-    if len(pluses) == 0:
+    if len(matches) == 0:
         botsend(message, f"`{keyword}` を含む名前はありません")
     else:
-        pretext = f"`{keyword}` を含む名前とカウントの一覧です\n"
-        text = ""
-        for plus in pluses:
-            text += f"- {plus.name}(count: {plus.counter})\n"
+        pages = math.ceil(len(matches) / SEARCH_PAGE_SIZE)
+        current = min(max(int(page or 1), 1), pages)
+        start = (current - 1) * SEARCH_PAGE_SIZE
+        matches = matches[start : start + SEARCH_PAGE_SIZE]
+        counters = get_counters([match.key for match in matches])
+
+        pretext = (
+            f"`{keyword}` を含む名前とカウントの一覧です({current}/{pages}ページ)\n"
+        )
+        lines = []
+        for match in matches:
+            # 部分一致しない名前は似ている名前として表示する
+            similar = "" if match.score >= 1 else "(似ている名前)"
+            lines.append(f"- {match.key}(count: {counters.get(match.key, 0)}){similar}")
+        if current < pages:
+            lines.append(f"次のページ: `$plusplus search {keyword} {current + 1}`")
+        text = "\n".join(lines)
         attachments = [
             {
                 "pretext": pretext,
@@ -184,6 +223,37 @@ def plusplus_search(message: Message, keyword: str) -> None:
         botwebapi(message, attachments)
 
 
+@respond_to(r"^plusplus\s+ranking(?:\s+(all|month|week|day))?(?:\s+(\d+))?$")
+def plusplus_ranking(message: Message, window: str, count: str) -> None:
+    """
+    指定された期間のカウントの多い順の一覧を返す
+    """
+    window = window or "all"
+    top = min(max(int(count), 1), RANKING_SIZE) if count else RANKING_TOP
+    # バッファーにある増減もランキングに含める
+    flush_counters()
+    rows = ranking.top(window, top)
+    if not rows:
+        msg = f"{RANKING_WINDOWS[window]}の plusplus ランキングの結果はありません"
+        msg += "(カウントが 0 以外の名前がありません)"
+        botsend(message, msg)
+        return
+
+    pretext = f"{RANKING_WINDOWS[window]}の plusplus ランキングです"
+    lines = [
+        f"{rank}. {name}(count: {counter})"
+        for rank, (name, counter) in enumerate(rows, start=1)
+    ]
+    attachments = [
+        {
+            "pretext": pretext,
+            "text": "\n".join(lines),
+            "mrkdwn_in": ["pretext", "text"],
+        }
+    ]
+    botwebapi(message, attachments)
+
+
 @respond_to(r"^plusplus\s+help+")
 def plusplus_help(message: Message) -> None:
     """
@@ -193,9 +263,10 @@ def plusplus_help(message: Message) -> None:
         message,
         """- `名前1 名前2++`: 指定された名前に +1 カウントする
 - `名前1 名前2--`: 指定された名前に -1 カウントする
-- `$plusplus search (キーワード)`: 名前にキーワードを含む一覧を返す
+- `$plusplus search (キーワード) [ページ]`: 名前にキーワードを含む一覧を返す(似ている名前も含む)
+- `$plusplus ranking [all|month|week|day] [件数]`: カウントの多い順の一覧を返す
 - `$plusplus delete (名前)`: カウントを削除する(カウント10未満のみ)
-- `$plusplus rename (変更前) (変更後)`: カウントする名前を変更する
-- `$plusplus merge (統合元) (統合先)`: 2つの名前のカウントを統合先の名前にまとめる
+- `$plusplus rename (変更前) (変更後)`: カウントする名前を変更する(変更前の名前も変更後の名前でカウントする)
+- `$plusplus merge (統合元) (統合先)`: 2つの名前のカウントを統合先の名前にまとめる(統合元の名前も統合先の名前でカウントする)
 """,
     )
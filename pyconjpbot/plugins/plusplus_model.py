@@ -1,8 +1,53 @@
+from __future__ import annotations
+
+import atexit
+import logging
 import os.path
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from peewee import (
+    EXCLUDED,
+    CharField,
+    DateTimeField,
+    IntegerField,
+    Model,
+    SqliteDatabase,
+    chunked,
+    fn,
+)
+from slackbot import settings
+
+from ..ngram import Match, NgramIndex
+from ..resources import LazyDatabase, lazy
 
-from peewee import CharField, IntegerField, Model, SqliteDatabase
+logger = logging.getLogger(__name__)
 
-db = SqliteDatabase(os.path.join(os.path.dirname(__file__), "plusplus.db"))
+# カウンターのバッファーを書き込む間隔(秒)
+FLUSH_INTERVAL = 10
+# バッファーの名前の数がこの数以上になったらすぐに書き込む
+FLUSH_SIZE = 100
+# ランキングとしてキャッシュする件数
+RANKING_SIZE = 100
+# まとめて書き込むときの1回の INSERT の行数(SQLite の変数の数の上限を超えないようにする)
+INSERT_SIZE = 500
+# ランキングの期間ごとの集計の単位と、集計する範囲(現在の単位を除く)
+WINDOWS = {
+    "day": ("hour", timedelta(hours=23)),
+    "week": ("day", timedelta(days=6)),
+    "month": ("day", timedelta(days=29)),
+}
+
+db = LazyDatabase(
+    "plusplus.db",
+    # WAL モードにして、書き込み中でも読み込みを待たせない
+    lambda: SqliteDatabase(
+        os.path.join(os.path.dirname(__file__), "plusplus.db"),
+        pragmas={"journal_mode": "wal", "synchronous": "normal"},
+    ),
+)
 
 
 class Plusplus(Model):
@@ -11,11 +56,585 @@ class Plusplus(Model):
     """
 
     name = CharField(primary_key=True)
-    counter = IntegerField(default=0)
+    # ランキングで使用する
+    counter = IntegerField(default=0, index=True)
 
     class Meta:
         database = db
 
 
-db.connect()
-db.create_tables([Plusplus], safe=True)
+class PlusplusLog(Model):
+    """
+    plusplusの増減の履歴(追記のみ)
+    """
+
+    name = CharField(index=True)
+    delta = IntegerField()
+    created = DateTimeField(default=datetime.now, index=True)
+
+    class Meta:
+        database = db
+
+
+class PlusplusRollup(Model):
+    """
+    名前ごとの1時間ごと、1日ごとの増減の合計
+    """
+
+    name = CharField()
+    # 集計の単位(hour または day)
+    period = CharField()
+    start = DateTimeField()
+    delta = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        indexes = (
+            (("name", "period", "start"), True),
+            (("period", "start"), False),
+        )
+
+
+class PlusplusAlias(Model):
+    """
+    名前の変更前や統合元の名前(別名)と、現在の名前の対応
+    """
+
+    alias = CharField(primary_key=True)
+    name = CharField(index=True)
+
+    class Meta:
+        database = db
+
+
+# 最初のクエリの実行時に接続してテーブルを作成する
+db.create_tables_on_connect([Plusplus, PlusplusLog, PlusplusRollup, PlusplusAlias])
+
+
+def _truncate(dt: datetime, period: str) -> datetime:
+    """
+    日時を集計の単位の開始日時に切り捨てる
+    """
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        dt = dt.replace(hour=0)
+    return dt
+
+
+def _upsert(deltas: dict[str, int]) -> None:
+    """
+    名前ごとの増減を counter = counter + delta として upsert し、
+    履歴と1時間ごと、1日ごとの集計に追加する
+
+    トランザクションの中で呼び出す
+    """
+    _upsert_counters(deltas)
+
+    now = datetime.now()
+    logs = [
+        {"name": name, "delta": delta, "created": now} for name, delta in deltas.items()
+    ]
+    PlusplusLog.insert_many(logs).execute()
+    for period in ("hour", "day"):
+        start = _truncate(now, period)
+        rollups = [
+            {"name": name, "period": period, "start": start, "delta": delta}
+            for name, delta in deltas.items()
+        ]
+        _upsert_rollups(rollups)
+
+
+def _upsert_counters(deltas: dict[str, int]) -> None:
+    rows = [{"name": name, "counter": delta} for name, delta in deltas.items()]
+    Plusplus.insert_many(rows).on_conflict(
+        conflict_target=[Plusplus.name],
+        update={Plusplus.counter: Plusplus.counter + EXCLUDED.counter},
+    ).execute()
+
+
+def _upsert_rollups(rows: list[dict]) -> None:
+    PlusplusRollup.insert_many(rows).on_conflict(
+        conflict_target=[
+            PlusplusRollup.name,
+            PlusplusRollup.period,
+            PlusplusRollup.start,
+        ],
+        update={PlusplusRollup.delta: PlusplusRollup.delta + EXCLUDED.delta},
+    ).execute()
+
+
+def _stored_counters(names: list[str]) -> dict[str, int]:
+    """
+    データベースに保存されているカウンターの値を返す
+    """
+    query = Plusplus.select().where(Plusplus.name.in_(names))
+    return {plus.name: plus.counter for plus in query}
+
+
+class CounterBuffer:
+    """
+    カウンターの増減をメモリ上でまとめてから書き込むバッファー
+
+    - 同じ名前への増減は1つにまとめる
+    - FLUSH_INTERVAL 秒ごと、FLUSH_SIZE 件たまったとき、終了時に書き込む
+    - 読み込みはデータベースの値にバッファーの増減を足して返す
+    """
+
+    def __init__(
+        self, interval: float = FLUSH_INTERVAL, size: int = FLUSH_SIZE
+    ) -> None:
+        self.interval = interval
+        self.size = size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # 書き込み待ちの増減と、書き込み中の増減
+        self._pending: dict[str, int] = {}
+        self._flushing: dict[str, int] = {}
+        # 書き込みが完了するたびに増やす(読み込み中の書き込みの検出に使う)
+        self._generation = 0
+        self._started = False
+
+    def _start(self) -> None:
+        self._started = True
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to flush plusplus counters")
+
+    def add(self, names: list[str], delta: int) -> dict[str, int]:
+        """
+        指定された名前のカウンターを増減し、増減後の値を返す
+        """
+        counts = Counter(names)
+        with self._lock:
+            if not self._started:
+                self._start()
+            for name, count in counts.items():
+                self._pending[name] = self._pending.get(name, 0) + delta * count
+            full = len(self._pending) >= self.size
+        if full:
+            self.flush()
+        return self.counters(list(counts))
+
+    def counters(self, names: list[str]) -> dict[str, int]:
+        """
+        データベースの値にバッファーの増減を足したカウンターの値を返す
+        """
+        while True:
+            with self._lock:
+                generation = self._generation
+                deltas = {
+                    name: self._pending.get(name, 0) + self._flushing.get(name, 0)
+                    for name in names
+                }
+            stored = _stored_counters(names)
+            with self._lock:
+                # 読み込み中に書き込みが完了したら二重に数えるので読み直す
+                if generation == self._generation:
+                    break
+        return {name: stored.get(name, 0) + deltas[name] for name in names}
+
+    def names(self) -> list[str]:
+        """
+        バッファーにある名前の一覧を返す
+        """
+        with self._lock:
+            return list(self._pending.keys() | self._flushing.keys())
+
+    def flush(self) -> None:
+        """
+        バッファーの増減をデータベースに書き込む
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+            try:
+                with db.atomic():
+                    _upsert(self._flushing)
+                    totals = _stored_counters(list(self._flushing))
+                    ranking.update(self._flushing, totals)
+            except Exception:
+                # 書き込めなかった増減は次回に持ち越す
+                with self._lock:
+                    for name, delta in self._flushing.items():
+                        self._pending[name] = self._pending.get(name, 0) + delta
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+                self._generation += 1
+
+
+class Ranking:
+    """
+    plusplus のランキングのキャッシュ
+
+    - 全期間: counter のインデックスで上位 RANKING_SIZE 件を読み込む
+    - 過去24時間、7日、30日: 1時間ごと、1日ごとの集計から読み込む
+    - カウンターを更新するたびに、キャッシュを少しずつ更新する
+    """
+
+    def __init__(self, size: int = RANKING_SIZE) -> None:
+        self.size = size
+        self._lock = threading.Lock()
+        # 期間ごとの名前とカウント
+        # 全期間は上位 size 件のみ、それ以外は期間内に増減した全ての名前
+        self._scores: dict[str, dict[str, int]] = {}
+        # 期間ごとの読み込んだときの集計の開始日時
+        self._since: dict[str, datetime | None] = {}
+        # 期間ごとのカウントの多い順の一覧
+        self._sorted: dict[str, list[tuple[str, int]]] = {}
+
+    def top(self, window: str, count: int) -> list[tuple[str, int]]:
+        """
+        指定された期間(all, day, week, month)のカウントの多い順の一覧を返す
+        """
+        with self._lock:
+            since = self._window_start(window)
+            if window not in self._scores or self._since[window] != since:
+                # 初回か、集計の単位が切り替わったので読み込み直す
+                self._scores[window] = self._load(window, since)
+                self._since[window] = since
+                self._sorted.pop(window, None)
+            ranking = self._sorted.get(window)
+            if ranking is None:
+                # 増減が打ち消し合ってカウントが 0 の名前はランキングに含めない
+                scores = [item for item in self._scores[window].items() if item[1]]
+                ranking = sorted(scores, key=lambda item: (-item[1], item[0]))[
+                    : self.size
+                ]
+                self._sorted[window] = ranking
+            return ranking[:count]
+
+    def _window_start(self, window: str) -> datetime | None:
+        if window == "all":
+            return None
+        period, span = WINDOWS[window]
+        return _truncate(datetime.now(), period) - span
+
+    def _load(self, window: str, since: datetime | None) -> dict[str, int]:
+        if since is None:
+            query = Plusplus.select().order_by(Plusplus.counter.desc()).limit(self.size)
+            return {plus.name: plus.counter for plus in query}
+        period, _ = WINDOWS[window]
+        total = fn.SUM(PlusplusRollup.delta)
+        query = (
+            PlusplusRollup.select(PlusplusRollup.name, total.alias("total"))
+            .where(PlusplusRollup.period == period, PlusplusRollup.start >= since)
+            .group_by(PlusplusRollup.name)
+        )
+        # 集計は変更前の名前のまま残っているので、現在の名前にまとめる
+        scores: dict[str, int] = defaultdict(int)
+        for rollup in query:
+            scores[aliases.resolve(rollup.name)] += rollup.total
+        return dict(scores)
+
+    def update(self, deltas: dict[str, int], totals: dict[str, int]) -> None:
+        """
+        カウンターの増減をキャッシュに反映する
+        """
+        with self._lock:
+            all_time = self._scores.get("all")
+            if all_time is not None and not self._update_all_time(all_time, totals):
+                # 上位から外れた可能性があり、代わりの名前がわからないので読み込み直す
+                del self._scores["all"]
+            self._sorted.pop("all", None)
+
+            for window in WINDOWS:
+                scores = self._scores.get(window)
+                if scores is None:
+                    continue
+                for name, delta in deltas.items():
+                    scores[name] = scores.get(name, 0) + delta
+                self._sorted.pop(window, None)
+
+    def _update_all_time(self, scores: dict[str, int], totals: dict[str, int]) -> bool:
+        """
+        全期間の上位の一覧を更新する(判断できない場合は False を返す)
+        """
+        # キャッシュしていない名前のカウントはこの値以下
+        floor = min(scores.values()) if len(scores) >= self.size else None
+        for name, total in totals.items():
+            if name in scores:
+                if floor is not None and total < floor:
+                    return False
+                scores[name] = total
+            elif floor is None or total > floor:
+                scores[name] = total
+        while len(scores) > self.size:
+            del scores[min(scores, key=scores.__getitem__)]
+        return True
+
+    def invalidate(self) -> None:
+        """
+        名前の変更や削除のあとにキャッシュを破棄する
+        """
+        with self._lock:
+            self._scores.clear()
+            self._sorted.clear()
+
+
+ranking = Ranking()
+
+
+class AliasMap:
+    """
+    別名から現在の名前への対応表
+
+    別名の別名は作らず、常に1回の参照で現在の名前がわかるようにする
+
+    aliases.add("takanory", "takanory.net")
+    aliases.resolve("takanory")  # => "takanory.net"
+    """
+
+    def __init__(self, names: dict[str, str] | None = None) -> None:
+        self._lock = threading.Lock()
+        # 別名ごとの現在の名前
+        self._names: dict[str, str] = {}
+        # 現在の名前ごとの別名の集合
+        self._aliases: dict[str, set[str]] = defaultdict(set)
+        for alias, name in (names or {}).items():
+            self._names[alias] = name
+            self._aliases[name].add(alias)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def resolve(self, name: str) -> str:
+        """
+        別名なら現在の名前を、そうでなければそのまま返す
+        """
+        return self._names.get(name, name)
+
+    def aliases_of(self, name: str) -> list[str]:
+        """
+        現在の名前の別名の一覧を返す
+        """
+        with self._lock:
+            return sorted(self._aliases.get(name, ()))
+
+    def add(self, alias: str, name: str) -> None:
+        """
+        alias を name の別名にする(alias の別名も name の別名にする)
+        """
+        with self._lock:
+            # name が別名だった場合は、現在の名前に戻す
+            previous = self._names.pop(name, None)
+            if previous is not None:
+                self._aliases[previous].discard(name)
+            moved = self._aliases.pop(alias, set())
+            moved.add(alias)
+            for key in moved:
+                self._names[key] = name
+            self._aliases[name].update(moved)
+
+    def remove(self, name: str) -> list[str]:
+        """
+        現在の名前の別名を全て削除し、削除した別名を返す
+        """
+        with self._lock:
+            removed = self._aliases.pop(name, set())
+            for alias in removed:
+                del self._names[alias]
+            return sorted(removed)
+
+
+def _load_aliases() -> AliasMap:
+    return AliasMap({a.alias: a.name for a in PlusplusAlias.select()})
+
+
+# 別名の対応表(最初に参照したときにデータベースから読み込む)
+aliases = lazy("plusplus_aliases", _load_aliases)
+
+
+# PLUSPLUS_BUFFER = True の場合のみカウンターの増減をバッファーにためる
+buffer = (
+    CounterBuffer(
+        interval=getattr(settings, "PLUSPLUS_FLUSH_INTERVAL", FLUSH_INTERVAL),
+        size=getattr(settings, "PLUSPLUS_FLUSH_SIZE", FLUSH_SIZE),
+    )
+    if getattr(settings, "PLUSPLUS_BUFFER", False)
+    else None
+)
+
+
+def _build_index() -> NgramIndex:
+    """
+    全ての名前(バッファーにある名前を含む)の n-gram のインデックスを作成する
+    """
+    index = NgramIndex(plus.name for plus in Plusplus.select(Plusplus.name))
+    if buffer is not None:
+        for name in buffer.names():
+            index.add(name)
+    return index
+
+
+# $plusplus search で使う名前のインデックス(最初の検索時に作成する)
+name_index = lazy("plusplus_names", _build_index)
+
+
+def update_counters(names: list[str], delta: int) -> dict[str, int]:
+    """
+    指定された名前のカウンターをまとめて増減し、更新後の値を返す
+
+    1つのトランザクションで counter = counter + delta として upsert するため、
+    同じ名前への同時の更新でもカウントが失われない
+    同じ名前が複数回指定された場合はその回数分増減する
+    """
+    counts = Counter(names)
+    if not counts:
+        return {}
+    if name_index.ready:
+        for name in counts:
+            name_index.add(name)
+    if buffer is not None:
+        return buffer.add(names, delta)
+    deltas = {name: delta * count for name, count in counts.items()}
+    with db.atomic():
+        _upsert(deltas)
+        totals = _stored_counters(list(counts))
+        # 書き込みの順番にランキングを更新するため、トランザクションの中で更新する
+        ranking.update(deltas, totals)
+    return totals
+
+
+def flush_counters() -> None:
+    """
+    バッファーの増減をデータベースに書き込む(名前の変更や削除の前に呼び出す)
+    """
+    if buffer is not None:
+        buffer.flush()
+
+
+def resolve_name(name: str) -> str:
+    """
+    別名なら現在の名前を返す(データベースは参照しない)
+    """
+    return aliases.resolve(name)
+
+
+def _save_alias(alias: str, name: str) -> None:
+    """
+    データベースに alias を name の別名として保存する
+
+    トランザクションの中で呼び出す
+    """
+    PlusplusAlias.delete().where(PlusplusAlias.alias == name).execute()
+    PlusplusAlias.update(name=name).where(PlusplusAlias.name == alias).execute()
+    PlusplusAlias.insert(alias=alias, name=name).on_conflict("replace").execute()
+
+
+def _aliased(old: str, new: str) -> None:
+    """
+    old を new の別名にしたあとに、メモリ上の対応表、ランキング、インデックスを更新する
+    """
+    aliases.add(old, new)
+    ranking.invalidate()
+    if name_index.ready:
+        name_index.remove(old)
+        name_index.add(new)
+
+
+def rename_counter(old: str, new: str) -> None:
+    """
+    old の名前を new に変更し、old を new の別名にする
+
+    集計と履歴は old のまま残し、読み込むときに new にまとめる
+    """
+    with db.atomic():
+        Plusplus.update(name=new).where(Plusplus.name == old).execute()
+        _save_alias(old, new)
+    _aliased(old, new)
+
+
+def merge_counters(old: str, new: str) -> int:
+    """
+    old のカウントを new に足して old を削除し、old を new の別名にする
+
+    統合後の new のカウントを返す
+    """
+    with db.atomic():
+        oldplus = Plusplus.get_by_id(old)
+        Plusplus.update(counter=Plusplus.counter + oldplus.counter).where(
+            Plusplus.name == new
+        ).execute()
+        oldplus.delete_instance()
+        _save_alias(old, new)
+        counter = Plusplus.get_by_id(new).counter
+    _aliased(old, new)
+    return counter
+
+
+def delete_history(name: str) -> None:
+    """
+    名前の削除のときに、別名と集計を削除してランキングに表示されないようにする
+    """
+    names = [name, *aliases.aliases_of(name)]
+    with db.atomic():
+        PlusplusRollup.delete().where(PlusplusRollup.name.in_(names)).execute()
+        PlusplusAlias.delete().where(PlusplusAlias.name == name).execute()
+    aliases.remove(name)
+    ranking.invalidate()
+    if name_index.ready:
+        name_index.remove(name)
+
+
+def load_history(events: list[tuple[str, int, datetime]]) -> None:
+    """
+    過去のメッセージの増減をまとめて書き込む(Slack のエクスポートの読み込みで使用する)
+
+    events は (名前, 増減, 日時) の一覧で、履歴と集計はその日時で記録する
+    トランザクションの中で呼び出す
+    """
+    if not events:
+        return
+    deltas: Counter[str] = Counter()
+    rollups: Counter[tuple[str, str, datetime]] = Counter()
+    for name, delta, created in events:
+        deltas[name] += delta
+        for period in ("hour", "day"):
+            rollups[(name, period, _truncate(created, period))] += delta
+
+    for names in chunked(deltas, INSERT_SIZE):
+        _upsert_counters({name: deltas[name] for name in names})
+    logs = [
+        {"name": name, "delta": delta, "created": created}
+        for name, delta, created in events
+    ]
+    for rows in chunked(logs, INSERT_SIZE):
+        PlusplusLog.insert_many(rows).execute()
+    rows = [
+        {"name": name, "period": period, "start": start, "delta": delta}
+        for (name, period, start), delta in rollups.items()
+    ]
+    for batch in chunked(rows, INSERT_SIZE):
+        _upsert_rollups(batch)
+
+    ranking.invalidate()
+    if name_index.ready:
+        for name in deltas:
+            name_index.add(name)
+
+
+def search_names(keyword: str) -> list[Match]:
+    """
+    キーワードを含む名前を、部分一致、あいまい検索の順に返す
+    """
+    return name_index.search(keyword)
+
+
+def get_counters(names: list[str]) -> dict[str, int]:
+    """
+    指定された名前のカウンターの値を返す(バッファーの増減も含む)
+    """
+    if buffer is not None:
+        return buffer.counters(names)
+    return _stored_counters(names)
@@ -4,29 +4,32 @@ import json
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import requests
-from bs4 import BeautifulSoup
 from dateutil import parser
-from jira import JIRA, JIRAError
-from PIL import Image, ImageDraw, ImageFont
 from requests.auth import HTTPBasicAuth
 from slackbot import settings
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 from slackbot.utils import create_tmp_file
 
-from ..botmessage import botsend, botwebapi
+from ..botmessage import botsend, botupload, botwebapi
 from ..google_plugins.google_api import get_service
-
-# Clean JIRA Url to not have trailing / if exists
-CLEAN_JIRA_URL = settings.JIRA_URL
-if settings.JIRA_URL[-1:] == "/":
-    CLEAN_JIRA_URL = CLEAN_JIRA_URL[:-1]
-
-# Login to jira
-jira_auth = (settings.JIRA_USER, settings.JIRA_PASS)
-jira = JIRA(CLEAN_JIRA_URL, basic_auth=jira_auth)
+from ..lazyimport import lazy_import
+from .jira_api import CLEAN_JIRA_URL, jira
+
+if TYPE_CHECKING:
+    import bs4
+    from jira import exceptions as jira_exceptions
+    from PIL import Image, ImageDraw, ImageFont
+else:
+    # 重いモジュールは最初に使うときにインポートする
+    bs4 = lazy_import("bs4")
+    jira_exceptions = lazy_import("jira.exceptions")
+    Image = lazy_import("PIL.Image")
+    ImageDraw = lazy_import("PIL.ImageDraw")
+    ImageFont = lazy_import("PIL.ImageFont")
 
 # Python Boot Camp の issue を作成するJIRAのプロジェクトとコンポーネント名
 PROJECT = "ISSHA"
@@ -310,7 +313,7 @@ def pycamp_create(
         issue.update(description=desc)
 
         botsend(message, f"チケットを作成しました: {issue.permalink()}")
-    except JIRAError as e:
+    except jira_exceptions.JIRAError as e:
         botsend(message, f"`$pycamp` エラー: {e.text}")
 
 
@@ -322,7 +325,7 @@ def get_participants(url: str) -> list[dict]:
     :return: 参加者情報の一覧(辞書の配列)
     """
     r = requests.get(url)
-    soup = BeautifulSoup(r.content, "html.parser")
+    soup = bs4.BeautifulSoup(r.content, "html.parser")
     td = soup.find("td", class_="participation")
     participants = []
     for ptype in td.select("div.ptype"):
@@ -462,7 +465,7 @@ def get_connpass_info(connpass_url: str) -> dict:
     # 参加者とTAの一覧を取得する
     staffs = []
     r = requests.get(connpass_url + "participation")
-    soup = BeautifulSoup(r.text, "html.parser")
+    soup = bs4.BeautifulSoup(r.text, "html.parser")
     # TAとスタッフの情報を取得する
     for div in soup.select("div.participation_table_area"):
         ptype = div.find("span", class_="label_ptype_name").text
@@ -524,7 +527,7 @@ def pycamp_count_staff(message: Message) -> None:
 
     BASE_URL = "https://www.pycon.jp/support/bootcamp.html"
     r = requests.get(BASE_URL)
-    soup = BeautifulSoup(r.content, "html.parser")
+    soup = bs4.BeautifulSoup(r.content, "html.parser")
     id9 = soup.select_one("#id9")
     for atag in id9.select("a.external"):
         link = atag["href"]
@@ -589,7 +592,7 @@ def pycamp_logo(message: Message, title: str) -> None:
 
         with create_tmp_file() as tmpf:
             logo_image.save(tmpf, "png")
-            message.channel.upload_file(name, tmpf)
+            botupload(message, name, tmpf)
 
     botsend(message, "ロゴ画像を作成しました")
 
@@ -5,6 +5,9 @@ import re
 from slackbot.bot import listen_to
 from slackbot.dispatcher import Message
 
+from ..botmessage import botreact
+from ..workerpool import LOW, priority
+
 # リアクション対象のキーワードと絵文字
 REACTION = {
     ("肉", "meat"): "meat_on_bone",
@@ -20,16 +23,24 @@ REACTION = {
     ("ラーメン", "ramen"): "ramen",
 }
 
+# リアクション対象のいずれかのキーワードを含むメッセージにマッチするパターン
+REACTION_PATTERN = "|".join(
+    word
+    for words in REACTION
+    for word in ((words,) if isinstance(words, str) else words)
+)
+
 
 def _react(message: Message, emojis: list[str]) -> None:
     """
     指定された emoji を reaction で返す
     """
     for emoji in emojis:
-        message.react(emoji)
+        botreact(message, emoji)
 
 
-@listen_to(".")
+@listen_to(REACTION_PATTERN, re.IGNORECASE)
+@priority(LOW)
 def reaction(message: Message) -> None:
     """
     メッセージの中にリアクションする文字列があれば、emojiでリアクションする
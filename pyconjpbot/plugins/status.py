@@ -0,0 +1,34 @@
+from slackbot.bot import respond_to
+from slackbot.dispatcher import Message
+
+from ..botmessage import botsend
+from ..metrics import stats_report
+from ..startup import importtime_report, report
+from ..workerpool import fast_lane
+
+
+@respond_to(r"^startup$")
+@fast_lane
+def startup(message: Message) -> None:
+    """
+    プラグインの読み込み時間と外部サービスへの接続にかかった時間を返す
+    """
+    botsend(message, report())
+
+
+@respond_to(r"^startup\s+importtime$")
+@fast_lane
+def startup_importtime(message: Message) -> None:
+    """
+    プラグインごとのインポートにかかった時間とメモリ使用量を返す
+    """
+    botsend(message, importtime_report())
+
+
+@respond_to(r"^stats$")
+@fast_lane
+def stats(message: Message) -> None:
+    """
+    ハンドラーごとの実行回数、エラー数、処理時間を返す
+    """
+    botsend(message, stats_report())
@@ -1,13 +1,28 @@
 from __future__ import annotations
 
-import random
-from datetime import datetime
+import math
+import re
 
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend, botwebapi
-from .term_model import Response, Term
+from ..ngram import NgramIndex
+from ..resources import lazy
+from ..spelling import SpellingIndex
+from .term_model import (
+    MODES,
+    Response,
+    Term,
+    add_responses,
+    count_responses,
+    hash_text,
+    list_commands,
+    list_responses,
+    response_stats,
+    responses,
+    stats,
+)
 
 # すでに存在するコマンドは無視する
 RESERVED = (
@@ -36,10 +51,21 @@ RESERVED = (
     "suddendeath",
     "pycamp",
     "lgtm",
+    "startup",
+    "stats",
 )
 
-# コマンド一覧を初期化
-commands = {term.command for term in Term.select()}
+# 検索結果の1ページの件数
+SEARCH_PAGE_SIZE = 20
+# 登録されていないコマンドのときに表示する候補の数
+SUGGESTION_COUNT = 3
+
+# コマンド一覧(最初の利用時にDBから読み込む)
+commands = lazy("term_commands", lambda: {term.command for term in Term.select()})
+# $term search で使うコマンドのインデックス(最初の検索時に作成する)
+command_index = lazy("term_command_index", lambda: NgramIndex(commands))
+# 入力ミスの候補を探すためのインデックス(最初に候補を探すときに作成する)
+spelling = lazy("term_spelling", lambda: SpellingIndex(commands))
 
 
 @respond_to(r"^term\s+([\w-]+)$")
@@ -49,7 +75,7 @@ def term_create(message: Message, command: str) -> None:
     """
     指定されたコマンドを生成する
     """
-    if command in ("list", "help"):
+    if command in ("list", "help", "stats"):
         return
 
     # コマンドは小文字に統一
@@ -70,8 +96,13 @@ def term_create(message: Message, command: str) -> None:
         msg += f"`${command} add (レスポンス)` でレスポンスを追加できます"
         botsend(message, msg)
 
-        # コマンド一覧の set に追加
+        # コマンド一覧の set とインデックスに追加
         commands.add(command)
+        stats.invalidate()
+        if command_index.ready:
+            command_index.add(command)
+        if spelling.ready:
+            spelling.add(command)
 
 
 @respond_to(r"^term\s+(drop|del|delete)\s+([\w-]+)$")
@@ -91,8 +122,14 @@ def term_drop(message: Message, subcommand: str, command: str) -> None:
     term.delete_instance(recursive=True)
     term.save()
 
-    # コマンド一覧の set から削除
+    # コマンド一覧の set と応答のキャッシュから削除
     commands.remove(command)
+    stats.invalidate()
+    if command_index.ready:
+        command_index.remove(command)
+    if spelling.ready:
+        spelling.remove(command)
+    responses.invalidate(command)
     botsend(message, f"コマンド `${command}` を消去しました")
 
 
@@ -118,27 +155,61 @@ def _create_attachments_for_list(
     return attachments
 
 
-@respond_to(r"^term\s+search\s+([\w-]+)$")
-def term_search(message: Message, keyword: str) -> None:
+def _page(items: list, page: str | None) -> tuple[list, int, int]:
+    """
+    指定されたページの要素と、ページ番号、ページ数を返す
+    """
+    pages = max(math.ceil(len(items) / SEARCH_PAGE_SIZE), 1)
+    current = min(max(int(page or 1), 1), pages)
+    start = (current - 1) * SEARCH_PAGE_SIZE
+    return items[start : start + SEARCH_PAGE_SIZE], current, pages
+
+
+@respond_to(r"^term\s+search\s+([\w-]+)(?:\s+(\d+))?$")
+def term_search(message: Message, keyword: str, page: str | None) -> None:
     """
     指定したキーワードを含む用語コマンドの一覧を返す
+
+    部分一致するコマンドのあとに、似ているコマンドを返す
     """
-    pretext = f"`{keyword}` を含む用語コマンドの一覧です"
-    data = []
-    for command in sorted(commands):
-        if keyword in command:
-            data.append(command)
-    attachments = _create_attachments_for_list(pretext, data)
+    matches = command_index.search(keyword)
+    if not matches:
+        botsend(message, f"`{keyword}` を含む用語コマンドはありません")
+        return
+
+    matches, current, pages = _page(matches, page)
+    pretext = f"`{keyword}` を含む用語コマンドの一覧です({current}/{pages}ページ)"
+    exact = [match.key for match in matches if match.score >= 1]
+    similar = [match.key for match in matches if match.score < 1]
+    attachments = _create_attachments_for_list(pretext, exact)
+    text = attachments[0]["text"]
+    if similar:
+        text += "\n似ているコマンド: " + ", ".join(f"`${x}`" for x in similar)
+    if current < pages:
+        text += f"\n次のページ: `$term search {keyword} {current + 1}`"
+    attachments[0]["text"] = text.strip()
     botwebapi(message, attachments)
 
 
-@respond_to(r"^term\s+list$")
-def term_list(message: Message) -> None:
+@respond_to(r"^term\s+list(?:\s+--after\s+([\w-]+))?$")
+def term_list(message: Message, after: str | None) -> None:
     """
     現在使用可能な用語コマンドの一覧を返す
+
+    一覧が長い場合は1ページ分を返し、続きを表示するコマンドを添える
     """
+    page = list_commands(after=(after or "").lower())
+    if not page.items:
+        botsend(
+            message,
+            "用語コマンドの続きはありません" if after else "用語コマンドはありません",
+        )
+        return
+
     pretext = "用語コマンドの一覧です"
-    attachments = _create_attachments_for_list(pretext, sorted(commands))
+    attachments = _create_attachments_for_list(pretext, page.items)
+    if page.cursor is not None:
+        attachments[0]["text"] += f"\n次のページ: `$term list --after {page.cursor}`"
     botwebapi(message, attachments)
 
 
@@ -151,12 +222,27 @@ def _available_command(message: Message, command: str) -> bool:
     if command in RESERVED:
         result = False
     elif command not in commands:
-        botsend(message, f"コマンド `${command}` は登録されていません")
+        msg = f"コマンド `${command}` は登録されていません"
+        suggestions = _suggest(command)
+        if suggestions:
+            msg += "\nもしかして: " + ", ".join(f"`${x}`" for x in suggestions)
+        botsend(message, msg)
         result = False
 
     return result
 
 
+def _suggest(command: str) -> list[str]:
+    """
+    入力ミスと思われるコマンドの候補を、編集距離の近い順に返す
+    """
+    command = command.lower()
+    # 短いコマンドは1文字違いのみを候補にする
+    max_distance = 1 if len(command) <= 3 else 2
+    matches = spelling.search(command, max_distance)
+    return [word for _, word in matches[:SUGGESTION_COUNT]]
+
+
 def _send_markdown_text(message: Message, text: str) -> None:
     """
     指定されたtextをmarkdown形式で送信する
@@ -178,14 +264,14 @@ def return_response(message: Message, command: str) -> None:
     if not _available_command(message, command):
         return
 
-    response_set = Term.get(command=command).response_set
-    if len(response_set) == 0:
+    # 応答はキャッシュから選ぶ(データベースは最初の1回のみ参照する)
+    text = responses.choice(command)
+    if text is None:
         msg = f"コマンド `${command}` には応答が登録されていません\n"
         msg += f"`${command} add (レスポンス)` で応答を登録してください"
         botsend(message, msg)
     else:
-        response = random.choice(response_set)
-        _send_markdown_text(message, response.text)
+        _send_markdown_text(message, text)
 
 
 @respond_to(r"^([\w-]+)\s+(.*)")
@@ -193,6 +279,10 @@ def response(message: Message, command: str, params: str) -> None:
     """
     用語コマンドの処理をする
     """
+    if params.strip() == "import":
+        # 1行目が import のみの場合は import_responses で処理する
+        # (`$python import this` のように続きがある場合は通常の応答として追加する)
+        return
     if not _available_command(message, command):
         return
 
@@ -204,13 +294,17 @@ def response(message: Message, command: str, params: str) -> None:
             pop_response(message, command)
         elif subcommand == "list":
             # 応答の一覧を返す
-            get_responses(message, command)
+            get_responses(message, command, data[1] if len(data) > 1 else "")
         elif subcommand == "search":
             # 応答を検索
             search_responses(message, command, data[1])
         elif subcommand in ("del", "delete", "remove"):
             # 応答を削除
             del_response(message, command, data[1])
+        elif subcommand == "weight":
+            # 応答の重みを変更
+            args = data[1].split(maxsplit=1)
+            set_weight(message, command, args[0], args[1])
         elif subcommand == "add":
             # 応答を追加
             add_response(message, command, data[1])
@@ -223,38 +317,17 @@ def response(message: Message, command: str, params: str) -> None:
         pass
 
 
-def _exist_response(command: str, text: str) -> bool:
-    """
-    指定されたコマンドに応答が登録されているかを調べて返す
-    """
-    term = Term.get(command=command)
-    count = (
-        Response.select().where(Response.term == term, Response.text == text).count()
-    )
-    if count == 0:
-        return False
-    else:
-        return True
-
-
 def add_response(message: Message, command: str, text: str) -> None:
     """
     用語コマンドに応答を追加する
     """
-
-    # 登録済かどうかを確認する
-    if _exist_response(command, text):
+    # 登録済みの場合は一意インデックスで無視される
+    if add_responses(command, [text], message.body["user"]) == 0:
         reply = f"コマンド `${command}` に「{text}」は登録済みです"
         _send_markdown_text(message, reply)
         return
 
-    term = Term.get(command=command)
-    creator = message.body["user"]
-    # 用語を登録する
-    resp, created = Response.get_or_create(
-        term=term, text=text, creator=creator, created=datetime.now()
-    )
-    resp.save()
+    responses.invalidate(command)
     text = f"コマンド `${command}` に「{text}」を追加しました"
     _send_markdown_text(message, text)
 
@@ -265,7 +338,7 @@ def del_response(message: Message, command: str, text: str) -> None:
     """
     term = Term.get(command=command)
     try:
-        response = Response.get(term=term, text=text)
+        response = Response.get(term=term, text_hash=hash_text(text))
     except Response.DoesNotExist:
         reply = f"コマンド `${command}` に「{text}」は登録されていません"
         _send_markdown_text(message, reply)
@@ -273,64 +346,224 @@ def del_response(message: Message, command: str, text: str) -> None:
 
     # 応答を削除する
     response.delete_instance()
+    responses.invalidate(command)
 
     reply = f"コマンド `${command}` から「{text}」を削除しました"
     _send_markdown_text(message, reply)
 
 
+def set_weight(message: Message, command: str, weight: str, text: str) -> None:
+    """
+    用語コマンドの応答の重み(mode が weighted の場合の選ばれやすさ)を変更する
+    """
+    if not weight.isdigit():
+        botsend(message, f"重みには0以上の整数を指定してください: `{weight}`")
+        return
+
+    term = Term.get(command=command)
+    updated = (
+        Response.update(weight=int(weight))
+        .where(Response.term == term, Response.text_hash == hash_text(text))
+        .execute()
+    )
+    if updated == 0:
+        reply = f"コマンド `${command}` に「{text}」は登録されていません"
+    else:
+        responses.invalidate(command)
+        reply = f"コマンド `${command}` の「{text}」の重みを {weight} にしました"
+    _send_markdown_text(message, reply)
+
+
+@respond_to(r"^([\w-]+)\s+import(?:[^\S\n]*\n(.*))?$", re.DOTALL)
+def import_responses(message: Message, command: str, text: str | None) -> None:
+    """
+    改行区切りの複数の応答を1つのトランザクションでまとめて追加する
+
+    $酒 import
+    ビール
+    ワイン
+    """
+    if not _available_command(message, command):
+        return
+
+    texts = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    if not texts:
+        botsend(
+            message,
+            f"`${command} import` の次の行から1行に1つずつ応答を指定してください",
+        )
+        return
+
+    added = add_responses(command, texts, message.body["user"])
+    if added:
+        responses.invalidate(command)
+    botsend(
+        message,
+        f"コマンド `${command}` に {added} 件の応答を追加しました"
+        f"(登録済み: {len(texts) - added} 件)",
+    )
+
+
 def pop_response(message: Message, command: str) -> None:
     """
     用語コマンドで最後に登録された応答を削除する
     """
-    response_set = Term.get(command=command).response_set
+    # 同時に追加した応答は ID の大きい方を最後とする
+    last_response = (
+        Term.get(command=command)
+        .response_set.order_by(Response.created.desc(), Response.id.desc())
+        .first()
+    )
     # 応答が登録されていない
-    if len(response_set) == 0:
+    if last_response is None:
         msg = f"コマンド `${command}` には応答が登録されていません\n"
         msg += f"`${command} add (レスポンス)` で応答を登録してください"
         botsend(message, msg)
         return
 
-    last_response = response_set.order_by(Response.created.desc())[0]
     text = last_response.text
     last_response.delete_instance()
+    responses.invalidate(command)
 
     reply = f"コマンド `${command}` から「{text}」を削除しました"
     _send_markdown_text(message, reply)
 
 
-def search_responses(message: Message, command: str, keyword: str) -> None:
+def search_responses(message: Message, command: str, params: str) -> None:
     """
     用語コマンドに登録されている応答のうち、キーワードにマッチするものを返す
+
+    最後にページ番号を指定できる(例: `$酒 search ビール 2`)
     """
-    term = Term.get(command=command)
-    pat = f"%{keyword}%"
-    responses = Response.select().where(term == term, Response.text**pat)
+    keyword, page = params, None
+    words = params.rsplit(maxsplit=1)
+    if len(words) == 2 and words[1].isdigit():
+        keyword, page = words
 
-    if len(responses) == 0:
+    found = responses.get(command).search(keyword)
+    if len(found) == 0:
         botsend(message, f"コマンド `${command}` に `{keyword}` を含む応答はありません")
     else:
-        pretext = f"コマンド `${command}` の `{keyword}` を含む応答は {len(responses)} 件あります\n"
-        data = [x.text for x in responses]
+        data, current, pages = _page(found, page)
+        pretext = (
+            f"コマンド `${command}` の `{keyword}` を含む応答は {len(found)} 件あります"
+            f"({current}/{pages}ページ)\n"
+        )
+        if current < pages:
+            data.append(f"次のページ: `${command} search {keyword} {current + 1}`")
         attachments = _create_attachments_for_list(pretext, data, False)
         botwebapi(message, attachments)
 
 
-def get_responses(message: Message, command: str) -> None:
+def get_responses(message: Message, command: str, params: str = "") -> None:
     """
-    用語コマンドに登録されている応答の一覧を返す
+    用語コマンドに登録されている応答の一覧を登録順に返す
+
+    一覧が長い場合は1ページ分を返し、続きを表示するコマンドを添える
+    (例: `$酒 list --after 120`)
     """
-    response_set = Term.get(command=command).response_set
-    if len(response_set) == 0:
+    after = 0
+    args = params.split()
+    if len(args) == 2 and args[0] == "--after" and args[1].isdigit():
+        after = int(args[1])
+    elif args:
+        botsend(message, f"`${command} list --after (番号)` で続きを表示できます")
+        return
+
+    page = list_responses(command, after=after)
+    if not page.items and after:
+        botsend(message, f"コマンド `${command}` の応答の続きはありません")
+    elif not page.items:
         msg = f"コマンド `${command}` には応答が登録されていません\n"
         msg += f"`${command} add (レスポンス)` で応答を登録してください"
         botsend(message, msg)
     else:
-        pretext = f"コマンド `${command}` の応答は {len(response_set)} 件あります\n"
-        data = [x.text for x in response_set]
+        total = count_responses(command)
+        pretext = f"コマンド `${command}` の応答は {total} 件あります\n"
+        data = page.items
+        if page.cursor is not None:
+            data.append(f"次のページ: `${command} list --after {page.cursor}`")
         attachments = _create_attachments_for_list(pretext, data, False)
         botwebapi(message, attachments)
 
 
+@respond_to(r"^term\s+mode\s+([\w-]+)(?:\s+(\w+))?$")
+def term_mode(message: Message, command: str, mode: str | None) -> None:
+    """
+    用語コマンドの応答の選び方を表示、変更する
+    """
+    command = command.lower()
+    if not _available_command(message, command):
+        return
+
+    term = Term.get(command=command)
+    if mode is None:
+        botsend(message, f"コマンド `${command}` の応答の選び方は `{term.mode}` です")
+        return
+    if mode not in MODES:
+        modes = ", ".join(f"`{x}`" for x in MODES)
+        botsend(message, f"応答の選び方には {modes} のいずれかを指定してください")
+        return
+
+    term.mode = mode
+    # 利用回数はバッファーから別に書き込むので、mode のみ更新する
+    term.save(only=[Term.mode])
+    responses.invalidate(command)
+    botsend(message, f"コマンド `${command}` の応答の選び方を `{mode}` にしました")
+
+
+@respond_to(r"^term\s+stats(?:\s+([\w-]+))?$")
+def term_stats(message: Message, command: str | None) -> None:
+    """
+    用語コマンドの利用状況を返す
+
+    用語を指定した場合は、その用語コマンドの応答ごとの利用状況を返す
+    (利用回数は一定の間隔でまとめて保存するため、直近の利用は含まれない場合がある)
+    """
+    if command is not None:
+        _term_stats(message, command.lower())
+        return
+
+    snapshot = stats.get()
+    if snapshot.total == 0:
+        botsend(message, "用語コマンドはありません")
+        return
+
+    top = ", ".join(f"`${x}` ({hits}回)" for x, hits in snapshot.top)
+    unused = ", ".join(f"`${x}`" for x in snapshot.unused)
+    recent = ", ".join(f"`${x}` ({created:%Y-%m-%d})" for x, created in snapshot.recent)
+    text = f"よく使われる: {top or 'なし'}\n"
+    text += f"使われていない({snapshot.unused_count}件、古い順): {unused or 'なし'}\n"
+    text += f"最近追加された: {recent}"
+    attachments = [
+        {
+            "pretext": f"用語コマンド {snapshot.total} 件の利用状況です",
+            "text": text,
+            "mrkdwn_in": ["pretext", "text"],
+        }
+    ]
+    botwebapi(message, attachments)
+
+
+def _term_stats(message: Message, command: str) -> None:
+    """
+    用語コマンドの応答ごとの利用状況を返す
+    """
+    if not _available_command(message, command):
+        return
+
+    term = Term.get(command=command)
+    top, unused = response_stats(command)
+    last_used = f"{term.last_used:%Y-%m-%d %H:%M}" if term.last_used else "なし"
+    pretext = (
+        f"コマンド `${command}` は {term.hits} 回使われました(最終利用: {last_used})"
+    )
+    data = [f"{text} ({hits}回)" for text, hits in top]
+    data.append(f"一度も返していない応答: {unused} 件")
+    attachments = _create_attachments_for_list(pretext, data, False)
+    botwebapi(message, attachments)
+
+
 @respond_to(r"term\s+help")
 def term_help(message: Message) -> None:
     """
@@ -341,15 +574,19 @@ def term_help(message: Message) -> None:
         """- `$term (用語)`: 用語コマンドを作成する
 - `$term create (用語)`: 用語コマンドを作成する
 - `$term drop (用語)`: 用語コマンドを消去する
-- `$term search (キーワード)`: キーワードを含む用語コマンドの一覧を返す
-- `$term list`: 用語コマンドの一覧を返す
+- `$term search (キーワード) [ページ]`: キーワードを含む用語コマンドの一覧を返す(似ているコマンドも含む)
+- `$term list`: 用語コマンドの一覧を返す(長い場合は続きを表示するコマンドも返す)
+- `$term stats [用語]`: 用語コマンドの利用状況(よく使われる、使われていない、最近追加された)を返す。用語を指定した場合は応答ごとの利用回数を返す
+- `$term mode (用語) [uniform|shuffle|weighted]`: 応答の選び方を表示、変更する(ランダム、一巡するまで重複なし、重み付き)
 
-- `$(用語)`: 用語コマンドに登録してある応答からランダムに一つ返す
+- `$(用語)`: 用語コマンドに登録してある応答から選び方に応じて一つ返す
 - `$(用語) add (応答)`: 用語コマンドに応答を追加する
 - `$(用語) del (応答)`: 用語コマンドから応答を削除する
 - `$(用語) pop`: 用語コマンドの最後に登録した応答を削除する
-- `$(用語) list`: 用語コマンドの応答一覧を返す
-- `$(用語) search (キーワード)`: 用語コマンドのうちキーワードを含む応答一覧を返す
+- `$(用語) list`: 用語コマンドの応答一覧を返す(長い場合は続きを表示するコマンドも返す)
+- `$(用語) search (キーワード) [ページ]`: 用語コマンドのうちキーワードを含む応答一覧を返す
+- `$(用語) import (改行区切りの応答)`: 用語コマンドに複数の応答をまとめて追加する
+- `$(用語) weight (重み) (応答)`: 応答の重みを変更する(選び方が weighted の場合のみ使用する)
 ```
 > $term create 酒
 コマンド `$酒` を作成しました。
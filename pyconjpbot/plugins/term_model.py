@@ -1,9 +1,57 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import logging
 import os.path
+import random
+import threading
 from datetime import datetime
+from typing import Iterable, NamedTuple
+
+from peewee import (
+    BlobField,
+    CharField,
+    DateTimeField,
+    ForeignKeyField,
+    IntegerField,
+    Model,
+    SqliteDatabase,
+    chunked,
+)
+from playhouse.migrate import SqliteMigrator, migrate
+from slackbot import settings
+
+from ..ngram import NgramIndex
+from ..resources import LazyDatabase
+from ..sampling import ShuffleBag, WeightedSampler
+
+logger = logging.getLogger(__name__)
 
-from peewee import CharField, DateTimeField, ForeignKeyField, Model, SqliteDatabase
+# 応答の選び方
+# uniform: 毎回ランダム、shuffle: 一巡するまで同じ応答を返さない、weighted: 重み付き
+MODES = ("uniform", "shuffle", "weighted")
+# まとめて追加するときの1回の INSERT の行数(SQLite の変数の数の上限を超えないようにする)
+INSERT_SIZE = 500
+# 一覧の1ページの最大件数
+LIST_PAGE_SIZE = 100
+# 一覧の1ページの最大文字数(Slack で省略されない長さに収める)
+LIST_TEXT_LIMIT = 3000
+# 利用回数と shuffle の順番のバッファーを書き込む間隔(秒)
+USAGE_FLUSH_INTERVAL = 60
+# バッファーの用語と応答の数がこの数以上になったら、間隔を待たずに書き込む
+USAGE_FLUSH_SIZE = 1000
+# $term stats で表示する件数
+STATS_SIZE = 10
 
-db = SqliteDatabase(os.path.join(os.path.dirname(__file__), "term.db"))
+db = LazyDatabase(
+    "term.db",
+    # WAL モードにして、利用回数の書き込み中でも読み込みを待たせない
+    lambda: SqliteDatabase(
+        os.path.join(os.path.dirname(__file__), "term.db"),
+        pragmas={"journal_mode": "wal", "synchronous": "normal"},
+    ),
+)
 
 
 class BaseModel(Model):
@@ -22,7 +70,13 @@ class Term(BaseModel):
 
     command = CharField(unique=True)
     creator = CharField()
-    created = DateTimeField(default=datetime.now())
+    created = DateTimeField(default=datetime.now)
+    # 応答の選び方(MODES のいずれか)
+    mode = CharField(default="uniform")
+    # 応答を返した回数と最後に返した日時(UsageBuffer がまとめて更新する)
+    # hits のインデックスは _migrate で作成する
+    hits = IntegerField(default=0)
+    last_used = DateTimeField(null=True)
 
 
 class Response(BaseModel):
@@ -33,8 +87,566 @@ class Response(BaseModel):
     term = ForeignKeyField(Term)
     text = CharField()
     creator = CharField()
-    created = DateTimeField(default=datetime.now())
+    created = DateTimeField(default=datetime.now)
+    # mode が weighted の場合の選ばれやすさ
+    weight = IntegerField(default=1)
+    # 応答として返した回数
+    hits = IntegerField(default=0)
+    # text のハッシュ(term との組で一意、インデックスは _migrate で作成する)
+    text_hash = CharField(max_length=40, default="")
+
+
+class TermBag(BaseModel):
+    """
+    mode が shuffle の用語の、応答の ID をシャッフルした順番と次に返す位置
+    """
+
+    term = ForeignKeyField(Term, primary_key=True)
+    order = BlobField()
+    cursor = IntegerField(default=0)
+
+
+def hash_text(text: str) -> str:
+    """
+    応答の重複の判定に使うハッシュを返す
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _migrate(database: SqliteDatabase) -> None:
+    """
+    あとから追加したカラムとインデックスを既存のテーブルに追加する
+
+    データベースのプロキシは初期化前なので、モデルは使わずに SQL を実行する
+    """
+    migrator = SqliteMigrator(database)
+    operations = []
+    fields = (
+        Term.mode,
+        Term.hits,
+        Term.last_used,
+        Response.weight,
+        Response.text_hash,
+        Response.hits,
+    )
+    for field in fields:
+        table = field.model._meta.table_name
+        columns = {column.name for column in database.get_columns(table)}
+        if field.column_name not in columns:
+            operations.append(migrator.add_column(table, field.column_name, field))
+    if operations:
+        migrate(*operations)
+
+    # テーブルの作成時にインデックスを作成すると、カラムの追加前の既存のテーブルでは
+    # 存在しないカラム名が文字列として扱われるので、カラムの追加後に作成する
+    if not any(index.columns == ["hits"] for index in database.get_indexes("term")):
+        migrate(migrator.add_index("term", ["hits"]))
+
+    unique = ["term_id", "text_hash"]
+    indexes = database.get_indexes("response")
+    if any(index.unique and index.columns == unique for index in indexes):
+        return
+    with database.atomic():
+        # 既存の応答のハッシュを計算し、重複した応答は最初に登録したもの以外を削除する
+        rows = database.execute_sql("SELECT id, text FROM response").fetchall()
+        database.connection().executemany(
+            "UPDATE response SET text_hash = ? WHERE id = ?",
+            [(hash_text(text), response_id) for response_id, text in rows],
+        )
+        database.execute_sql(
+            "DELETE FROM response WHERE id NOT IN "
+            "(SELECT MIN(id) FROM response GROUP BY term_id, text_hash)"
+        )
+        migrate(migrator.add_index("response", unique, unique=True))
+
+
+def add_responses(command: str, texts: list[str], creator: str) -> int:
+    """
+    応答を1つのトランザクションでまとめて追加し、追加した件数を返す
+
+    登録済みの応答は (term, text_hash) の一意インデックスで無視する
+    """
+    created = datetime.now()
+    with db.atomic():
+        term = Term.get(Term.command == command)
+        rows = [
+            {
+                "term": term,
+                "text": text,
+                "text_hash": hash_text(text),
+                "creator": creator,
+                "created": created,
+            }
+            for text in texts
+        ]
+        added = 0
+        for batch in chunked(rows, INSERT_SIZE):
+            query = Response.insert_many(batch).on_conflict_ignore()
+            added += query.as_rowcount().execute()
+    return added
+
+
+class Page(NamedTuple):
+    """
+    一覧の1ページ分の要素
+    """
+
+    items: list[str]
+    # 次のページを取得するためのカーソル(最後のページの場合は None)
+    cursor: str | None
+
+
+def _page(rows: Iterable[tuple], limit: int, max_chars: int) -> Page:
+    """
+    (カーソル, 文字列) の行から、件数と文字数の上限に収まる1ページ分を返す
+
+    rows は上限より1件多く取得し、次のページがあるかどうかの判定に使う
+    """
+    items: list[str] = []
+    size = 0
+    cursor = None
+    for key, text in rows:
+        size += len(text) + 1
+        # 1件目は長くても表示する
+        if len(items) >= limit or (items and size > max_chars):
+            return Page(items, cursor)
+        items.append(text)
+        cursor = str(key)
+    return Page(items, None)
+
+
+def list_commands(
+    after: str = "", limit: int = LIST_PAGE_SIZE, max_chars: int = LIST_TEXT_LIMIT
+) -> Page:
+    """
+    after より後の用語コマンドを名前順に1ページ分返す
+
+    OFFSET は使わず、command の一意インデックスで前のページの最後から読む
+    """
+    query = (
+        Term.select(Term.command, Term.command)
+        .where(Term.command > after)
+        .order_by(Term.command)
+        .limit(limit + 1)
+        .tuples()
+    )
+    return _page(query, limit, max_chars)
+
+
+def list_responses(
+    command: str,
+    after: int = 0,
+    limit: int = LIST_PAGE_SIZE,
+    max_chars: int = LIST_TEXT_LIMIT,
+) -> Page:
+    """
+    用語コマンドの応答のうち、ID が after より後のものを登録順に1ページ分返す
+    """
+    query = (
+        Response.select(Response.id, Response.text)
+        .join(Term)
+        .where(Term.command == command, Response.id > after)
+        .order_by(Response.id)
+        .limit(limit + 1)
+        .tuples()
+    )
+    return _page(query, limit, max_chars)
+
+
+def count_responses(command: str) -> int:
+    """
+    用語コマンドの応答の件数を返す(応答は読み込まない)
+    """
+    return Response.select().join(Term).where(Term.command == command).count()
+
+
+# 最初のクエリの実行時に接続してテーブルを作成する
+db.create_tables_on_connect([Term, Response, TermBag])
+db.migrate_on_connect(_migrate)
+
+
+class TermResponses:
+    """
+    用語コマンドの応答の一覧と、mode に応じて応答を選ぶための状態
+    """
+
+    def __init__(
+        self,
+        term_id: int,
+        mode: str,
+        rows: list[tuple[int, str, int]],
+        bag: TermBag | None = None,
+    ) -> None:
+        """
+        :param rows: 登録順の (応答の ID, 応答, 重み) の一覧
+        """
+        self.term_id = term_id
+        self.mode = mode
+        self.ids = tuple(row[0] for row in rows)
+        self.texts = tuple(row[1] for row in rows)
+        self._index = {response_id: i for i, response_id in enumerate(self.ids)}
+        self._lock = threading.Lock()
+        self._bag: ShuffleBag | None = None
+        self._sampler: WeightedSampler | None = None
+        # 応答の検索に使う n-gram のインデックス(最初の検索時に作成する)
+        self._search_index: NgramIndex | None = None
+        # 保存された(保存待ちを含む)順番が現在の順番と同じか
+        # (違う場合は次回に順番ごと保存する)
+        self._saved = False
+        if mode == "shuffle":
+            order = ShuffleBag.loads(bag.order) if bag else []
+            self._bag = ShuffleBag(self.ids, order, bag.cursor if bag else 0)
+            self._saved = bag is not None and self._bag.order == order
+        elif mode == "weighted":
+            self._sampler = WeightedSampler([max(row[2], 0) for row in rows])
+
+    def choice(self) -> str | None:
+        """
+        mode に応じて応答を一つ返す(応答がない場合は None)
+        """
+        if not self.texts:
+            return None
+        if self._bag is not None:
+            i = self._index[self._next_in_bag()]
+        elif self._sampler is not None:
+            i = self._sampler.next()
+        else:
+            i = random.randrange(len(self.texts))
+        usage.record(self.term_id, self.ids[i])
+        return self.texts[i]
+
+    def search(self, keyword: str) -> list[str]:
+        """
+        キーワードを含む応答を、完全一致、前方一致、短い順に返す
+        """
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = NgramIndex(self.texts)
+        return [match.key for match in self._search_index.search(keyword, fuzzy=False)]
+
+    def _next_in_bag(self) -> int:
+        """
+        次の応答の ID を返し、順番と位置を usage のバッファーから保存する
+
+        順番が変わった場合は順番と位置を、それ以外は位置のみを保存する
+        """
+        assert self._bag is not None
+        with self._lock:
+            shuffled = self._bag.cursor >= len(self._bag)
+            response_id = self._bag.next()
+            order = self._bag.dumps() if shuffled or not self._saved else None
+            usage.record_bag(self.term_id, order, self._bag.cursor)
+            self._saved = True
+        return response_id
+
+
+class ResponseCache:
+    """
+    用語コマンドごとの応答の一覧のキャッシュ
+
+    - 最初に参照したときにデータベースから読み込む
+    - 応答の追加や削除、コマンドの削除、mode の変更のあとに invalidate を呼び出すと、
+      次の参照時に読み込み直す
+    - 参照はロックなしで行える
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # コマンドごとの応答の一覧
+        self._responses: dict[str, TermResponses] = {}
+        # 破棄するたびに増やす(読み込み中の更新の検出に使う)
+        self._generation = 0
+
+    def get(self, command: str) -> TermResponses:
+        """
+        応答の一覧を返す
+        """
+        cached = self._responses.get(command)
+        if cached is not None:
+            return cached
+        generation = self._generation
+        responses = self._load(command)
+        with self._lock:
+            # 読み込み中に更新された場合は古い可能性があるのでキャッシュしない
+            if generation == self._generation:
+                responses = self._responses.setdefault(command, responses)
+        return responses
+
+    def _load(self, command: str) -> TermResponses:
+        term = Term.get_or_none(Term.command == command)
+        if term is None:
+            return TermResponses(0, "uniform", [])
+        query = (
+            Response.select(Response.id, Response.text, Response.weight)
+            .where(Response.term == term)
+            .order_by(Response.id)
+            .tuples()
+        )
+        bag = None
+        if term.mode == "shuffle":
+            # 書き込み待ちの順番と位置はデータベースより新しい
+            pending = usage.pending_bag(term.id)
+            bag = TermBag.get_or_none(TermBag.term == term)
+            if pending is not None:
+                order, cursor = pending
+                if order is None:
+                    order = bag.order if bag else b""
+                bag = TermBag(term=term.id, order=order, cursor=cursor)
+        return TermResponses(term.id, term.mode, list(query), bag)
+
+    def choice(self, command: str) -> str | None:
+        """
+        用語の mode に応じて応答を一つ返す(応答がない場合は None)
+        """
+        return self.get(command).choice()
+
+    def invalidate(self, command: str) -> None:
+        """
+        データベースの更新のあとに、コマンドの応答のキャッシュを破棄する
+        """
+        with self._lock:
+            self._responses.pop(command, None)
+            self._generation += 1
+
+
+responses = ResponseCache()
+
+
+class UsageBuffer:
+    """
+    用語コマンドと応答の利用回数と、shuffle の順番と位置を
+    メモリ上でまとめてから書き込むバッファー
+
+    - record と record_bag は辞書を更新するだけで、データベースへの書き込みを待たない
+    - 書き込みはバックグラウンドのスレッドで、interval 秒ごと、
+      size 件たまったとき、終了時に行う
+    """
+
+    def __init__(
+        self, interval: float = USAGE_FLUSH_INTERVAL, size: int = USAGE_FLUSH_SIZE
+    ) -> None:
+        self.interval = interval
+        self.size = size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # size 件たまったときに書き込みスレッドを起こす
+        self._wakeup = threading.Event()
+        # 用語の ID ごとの回数と最後に返した日時、応答の ID ごとの回数
+        self._terms: dict[int, int] = {}
+        self._last_used: dict[int, datetime] = {}
+        self._responses: dict[int, int] = {}
+        # 用語の ID ごとの shuffle の順番(変わっていない場合は None)と位置
+        # 書き込み中のものは書き込みが終わるまで _flushing_bags に残す
+        self._bags: dict[int, tuple[bytes | None, int]] = {}
+        self._flushing_bags: dict[int, tuple[bytes | None, int]] = {}
+        self._started = False
+
+    def _start(self) -> None:
+        self._started = True
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to flush term usage")
+
+    def record(self, term_id: int, response_id: int) -> None:
+        """
+        応答を返したことを記録する
+        """
+        with self._lock:
+            if not self._started:
+                self._start()
+            self._terms[term_id] = self._terms.get(term_id, 0) + 1
+            self._last_used[term_id] = datetime.now()
+            self._responses[response_id] = self._responses.get(response_id, 0) + 1
+            full = len(self._terms) + len(self._responses) >= self.size
+        if full:
+            self._wakeup.set()
+
+    def record_bag(self, term_id: int, order: bytes | None, cursor: int) -> None:
+        """
+        shuffle の順番(変わっていない場合は None)と次に返す位置を記録する
+        """
+        with self._lock:
+            if not self._started:
+                self._start()
+            if order is None:
+                # 書き込み待ちの順番がある場合は、その順番の位置のみ更新する
+                order = self._bags.get(term_id, (None, 0))[0]
+            self._bags[term_id] = (order, cursor)
+
+    def pending_bag(self, term_id: int) -> tuple[bytes | None, int] | None:
+        """
+        書き込み待ち(書き込み中を含む)の順番と位置を返す(ない場合は None)
+
+        順番が None の場合は、書き込み中か保存済みの順番の位置のみ更新されている
+        """
+        with self._lock:
+            pending = self._bags.get(term_id)
+            flushing = self._flushing_bags.get(term_id)
+        if pending is None:
+            return flushing
+        if pending[0] is None and flushing is not None:
+            return flushing[0], pending[1]
+        return pending
+
+    def flush(self) -> None:
+        """
+        バッファーの回数と順番を1つのトランザクションでデータベースに書き込む
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._terms and not self._bags:
+                    return
+                terms, last_used, responses = (
+                    self._terms,
+                    self._last_used,
+                    self._responses,
+                )
+                self._terms, self._last_used, self._responses = {}, {}, {}
+                bags = self._flushing_bags = self._bags
+                self._bags = {}
+            try:
+                with db.atomic():
+                    for term_id, hits in terms.items():
+                        Term.update(
+                            hits=Term.hits + hits, last_used=last_used[term_id]
+                        ).where(Term.id == term_id).execute()
+                    for response_id, hits in responses.items():
+                        Response.update(hits=Response.hits + hits).where(
+                            Response.id == response_id
+                        ).execute()
+                    _save_bags(bags)
+            except Exception:
+                # 書き込めなかった回数は次回に持ち越す
+                with self._lock:
+                    for term_id, hits in terms.items():
+                        self._terms[term_id] = self._terms.get(term_id, 0) + hits
+                        self._last_used.setdefault(term_id, last_used[term_id])
+                    for response_id, hits in responses.items():
+                        self._responses[response_id] = (
+                            self._responses.get(response_id, 0) + hits
+                        )
+                    for term_id, (order, cursor) in bags.items():
+                        if term_id not in self._bags:
+                            self._bags[term_id] = (order, cursor)
+                        elif self._bags[term_id][0] is None:
+                            self._bags[term_id] = (order, self._bags[term_id][1])
+                    self._flushing_bags = {}
+                raise
+            with self._lock:
+                self._flushing_bags = {}
+        if terms:
+            stats.invalidate()
+
+
+def _save_bags(bags: dict[int, tuple[bytes | None, int]]) -> None:
+    """
+    shuffle の順番と位置を保存する(削除済みの用語コマンドの分は無視する)
+    """
+    for term_id, (order, cursor) in bags.items():
+        if order is None:
+            TermBag.update(cursor=cursor).where(TermBag.term == term_id).execute()
+        elif Term.select().where(Term.id == term_id).exists():
+            TermBag.insert(term=term_id, order=order, cursor=cursor).on_conflict(
+                "replace"
+            ).execute()
+
+
+class StatsSnapshot(NamedTuple):
+    """
+    $term stats で表示する集計結果
+    """
+
+    # 用語コマンドの数
+    total: int
+    # 利用回数の多い順の (コマンド, 回数)
+    top: list[tuple[str, int]]
+    # 一度も使われていないコマンドの数と、古い順のコマンド
+    unused_count: int
+    unused: list[str]
+    # 新しい順の (コマンド, 作成日時)
+    recent: list[tuple[str, datetime]]
+
+
+class UsageStats:
+    """
+    $term stats の集計結果のキャッシュ
+
+    集計は最初に参照したときに行い、利用回数の書き込みや用語コマンドの
+    作成、削除のあとに invalidate を呼び出すと、次の参照時に集計し直す
+    """
+
+    def __init__(self, size: int = STATS_SIZE) -> None:
+        self.size = size
+        self._lock = threading.Lock()
+        self._snapshot: StatsSnapshot | None = None
+
+    def get(self) -> StatsSnapshot:
+        """
+        集計結果を返す
+        """
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._load()
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """
+        集計結果を破棄する
+        """
+        with self._lock:
+            self._snapshot = None
+
+    def _load(self) -> StatsSnapshot:
+        # いずれも hits のインデックスか主キーの順に LIMIT 件のみ読む
+        top = (
+            Term.select(Term.command, Term.hits)
+            .where(Term.hits > 0)
+            .order_by(Term.hits.desc(), Term.command)
+            .limit(self.size)
+            .tuples()
+        )
+        unused = Term.select(Term.command).where(Term.hits == 0)
+        recent = (
+            Term.select(Term.command, Term.created)
+            .order_by(Term.id.desc())
+            .limit(self.size)
+            .tuples()
+        )
+        return StatsSnapshot(
+            total=Term.select().count(),
+            top=list(top),
+            unused_count=unused.count(),
+            unused=[term.command for term in unused.order_by(Term.id).limit(self.size)],
+            recent=list(recent),
+        )
+
+
+def response_stats(command: str, size: int = STATS_SIZE) -> tuple[list, int]:
+    """
+    用語コマンドの応答のうち、返した回数の多い順の (応答, 回数) と、
+    一度も返していない応答の数を返す
+    """
+    query = Response.select(Response.text, Response.hits).join(Term)
+    query = query.where(Term.command == command)
+    top = (
+        query.where(Response.hits > 0)
+        .order_by(Response.hits.desc(), Response.id)
+        .limit(size)
+        .tuples()
+    )
+    return list(top), query.where(Response.hits == 0).count()
 
 
-db.connect()
-db.create_tables([Term, Response], safe=True)
+usage = UsageBuffer(
+    interval=getattr(settings, "TERM_USAGE_FLUSH_INTERVAL", USAGE_FLUSH_INTERVAL),
+    size=getattr(settings, "TERM_USAGE_FLUSH_SIZE", USAGE_FLUSH_SIZE),
+)
+stats = UsageStats()
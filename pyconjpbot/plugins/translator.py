@@ -1,12 +1,18 @@
 import json
+from typing import TYPE_CHECKING
 
 import requests
-from langdetect import detect
 from slackbot import settings
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend
+from ..lazyimport import lazy_import
+
+if TYPE_CHECKING:
+    import langdetect
+else:
+    langdetect = lazy_import("langdetect")
 
 # Microsoft Translator API の BASE URL
 API_BASE_URL = "https://api-apc.cognitive.microsofttranslator.com/"
@@ -26,7 +32,7 @@ def translate(message: Message, cmd: str, option: str, text: str) -> None:
     if option:
         # 指定した言語に翻訳する
         _, lang = option.split("-", 1)
-    elif detect(text) in ("ja", "ko"):
+    elif langdetect.detect(text) in ("ja", "ko"):
         # 漢字が多いと日本語なのに ko と判定される
         # 日本語の場合は英語に翻訳する
         lang = "en"
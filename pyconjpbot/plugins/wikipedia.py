@@ -1,8 +1,15 @@
-import wikipedia
+from typing import TYPE_CHECKING
+
 from slackbot.bot import respond_to
 from slackbot.dispatcher import Message
 
 from ..botmessage import botsend, botwebapi
+from ..lazyimport import lazy_import
+
+if TYPE_CHECKING:
+    import wikipedia
+else:
+    wikipedia = lazy_import("wikipedia")
 
 
 @respond_to(r"^wikipedia(\s+-\w+)?\s+(.*)")
@@ -0,0 +1,296 @@
+"""
+Slack API のレートリミットに合わせて送信を待たせるスケジューラー
+
+- https://api.slack.com/docs/rate-limits
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from slack_sdk.errors import SlackApiError
+
+from .metrics import metrics, outbound, record_ratelimit_wait
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Tier ごとの1分あたりの呼び出し回数
+TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+# API メソッドごとの Tier
+METHOD_TIERS = {
+    "users.list": 2,
+    "users.info": 4,
+    "users.getPresence": 3,
+    "conversations.members": 4,
+    "reactions.add": 3,
+    "files.upload": 2,
+    "files.getUploadURLExternal": 4,
+    "files.completeUploadExternal": 4,
+}
+# METHOD_TIERS にないメソッドの Tier
+DEFAULT_TIER = 3
+# メッセージの投稿はチャンネルごとに1秒に1件程度に制限されている
+# rtm.send は RTM API でのメッセージの送信
+MESSAGE_METHODS = {"chat.postMessage", "chat.postEphemeral", "rtm.send"}
+MESSAGE_RATE = 1.0
+# メッセージを続けて送信できる数
+MESSAGE_BURST = 3
+# 429 Too Many Requests のときにリトライする回数
+MAX_RETRIES = 3
+# これ以上待たされたら警告のログを出力する秒数
+WAIT_WARNING = 10
+
+
+class TokenBucket:
+    """
+    一定の間隔でトークンが補充されるバケット
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        # 1秒あたりに補充されるトークン数
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # Retry-After で指定された待ち時間の終了時刻
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ予約し、使えるようになるまでの秒数を返す
+
+        トークンが足りないときはマイナスにして、後から来た呼び出しをさらに待たせる
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            return max(wait, self._blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        """
+        指定された秒数の間、トークンを使えなくする
+        """
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._blocked_until = max(self._blocked_until, until)
+
+
+class _ChannelTurn:
+    """
+    チャンネルごとの送信の順番待ち
+    """
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        # 発行済みの番号と、送信中の番号
+        self.issued = 0
+        self.serving = 0
+
+
+class OutboundScheduler:
+    """
+    Slack への送信をレートリミットに合わせて待たせるスケジューラー
+
+    - API メソッドごとに Tier に合わせたトークンバケットで呼び出しを待たせる
+    - メッセージの投稿はチャンネルごとのトークンバケットで待たせる
+    - 同じチャンネルへの送信は呼び出された順番に実行する
+    - 429 が返ってきたら Retry-After の秒数だけ待ってリトライする
+    """
+
+    def __init__(self) -> None:
+        # False の場合は待たずに送信する(ベンチマーク用)
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._channels: dict[str, _ChannelTurn] = {}
+        # 同じスレッドで順番を確保済みのチャンネル
+        self._local = threading.local()
+
+        self._stats_lock = threading.Lock()
+        self._waiting = 0
+        self._calls = 0
+        self._waited = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._retries = 0
+
+    def _bucket(self, method: str, channel: str | None) -> TokenBucket:
+        if method in MESSAGE_METHODS and channel:
+            key = f"message:{channel}"
+            rate, capacity = MESSAGE_RATE, MESSAGE_BURST
+        else:
+            key = method
+            per_minute = TIER_LIMITS[METHOD_TIERS.get(method, DEFAULT_TIER)]
+            rate, capacity = per_minute / 60, max(1, per_minute // 10)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    @contextmanager
+    def _turn(self, channel: str | None) -> Iterator[None]:
+        """
+        チャンネルへの送信の順番が来るまで待つ
+        """
+        held = getattr(self._local, "channels", None)
+        if held is None:
+            held = self._local.channels = set()
+        if not channel or channel in held:
+            yield
+            return
+
+        with self._lock:
+            turn = self._channels.get(channel)
+            if turn is None:
+                turn = self._channels[channel] = _ChannelTurn()
+            ticket = turn.issued
+            turn.issued += 1
+        with turn.cond:
+            while turn.serving != ticket:
+                turn.cond.wait()
+
+        held.add(channel)
+        try:
+            yield
+        finally:
+            held.discard(channel)
+            with self._lock, turn.cond:
+                turn.serving += 1
+                if turn.serving == turn.issued:
+                    # 待っている送信がなければ片付ける
+                    del self._channels[channel]
+                turn.cond.notify_all()
+
+    def call(self, method: str, channel: str | None, func: Callable[[], T]) -> T:
+        """
+        レートリミットに合わせて待ってから func を呼び出す
+
+        :param method: Slack API のメソッド名(例: chat.postMessage)
+        :param channel: 送信先のチャンネル(チャンネルに関係ない場合はNone)
+        """
+        if not self.enabled:
+            with outbound("slack"):
+                return func()
+
+        start = time.monotonic()
+        with self._stats_lock:
+            self._waiting += 1
+        queued = True
+        # 通信にかかった時間(全体からこれを引いた時間をレートリミットの待ち時間にする)
+        sending = 0.0
+        try:
+            with self._turn(channel):
+                bucket = self._bucket(method, channel)
+                for attempt in range(MAX_RETRIES + 1):
+                    wait = bucket.reserve()
+                    if wait > 0:
+                        time.sleep(wait)
+                    if queued:
+                        queued = False
+                        self._record_wait(method, time.monotonic() - start)
+                    sent = time.monotonic()
+                    try:
+                        with outbound("slack"):
+                            return func()
+                    except SlackApiError as e:
+                        if e.response.status_code != 429 or attempt == MAX_RETRIES:
+                            raise
+                        retry_after = _retry_after(e)
+                        logger.warning(
+                            "%s is rate limited, retry after %s seconds",
+                            method,
+                            retry_after,
+                        )
+                        bucket.block(retry_after)
+                        with self._stats_lock:
+                            self._retries += 1
+                    finally:
+                        sending += time.monotonic() - sent
+                raise AssertionError("unreachable")  # pragma: no cover
+        finally:
+            if queued:
+                with self._stats_lock:
+                    self._waiting -= 1
+            record_ratelimit_wait(time.monotonic() - start - sending)
+
+    def _record_wait(self, method: str, wait: float) -> None:
+        """
+        送信待ちの状態から送信した状態にして、待ち時間を記録する
+        """
+        with self._stats_lock:
+            self._waiting -= 1
+            self._calls += 1
+            if wait >= 0.01:
+                self._waited += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            queued = self._waiting
+        if wait >= WAIT_WARNING:
+            logger.warning(
+                "%s waited %.1f seconds for rate limit (queued: %d)",
+                method,
+                wait,
+                queued,
+            )
+
+    def stats(self) -> dict[str, float]:
+        """
+        送信の待ち状況を返す
+
+        - queued: 送信待ちの数
+        - calls: 送信した数
+        - waited: 待たされた送信の数
+        - total_wait, max_wait: 待たされた秒数の合計と最大
+        - retries: 429 でリトライした数
+        """
+        with self._stats_lock:
+            return {
+                "queued": self._waiting,
+                "calls": self._calls,
+                "waited": self._waited,
+                "total_wait": self._total_wait,
+                "max_wait": self._max_wait,
+                "retries": self._retries,
+            }
+
+
+def _retry_after(error: SlackApiError) -> float:
+    """
+    429 のレスポンスの Retry-After ヘッダーの秒数を返す
+    """
+    headers = error.response.headers or {}
+    value = headers.get("Retry-After") or headers.get("retry-after") or 1
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+scheduler = OutboundScheduler()
+metrics.register_gauge(
+    "outbound_queued",
+    "Number of outbound Slack calls waiting for rate limit",
+    lambda: scheduler.stats()["queued"],
+)
+metrics.register_counter(
+    "outbound_wait_seconds_total",
+    "Time spent waiting for Slack rate limit",
+    lambda: scheduler.stats()["total_wait"],
+)
+metrics.register_counter(
+    "outbound_retries_total",
+    "Number of retries after 429 Too Many Requests",
+    lambda: scheduler.stats()["retries"],
+)
@@ -0,0 +1,183 @@
+"""
+初回の利用時に生成する外部サービスのクライアントやDB接続
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Generic, Iterator, TypeVar
+
+from peewee import Database, DatabaseProxy, Model, SchemaManager, sort_models
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 名前ごとの登録済みのリソース
+_registry: dict[str, LazyResource] = {}
+_registry_lock = threading.Lock()
+
+
+class LazyResource(Generic[T]):
+    """
+    初回の利用時に factory を呼び出してオブジェクトを生成するプロキシ
+
+    属性へのアクセスは生成したオブジェクトにそのまま渡す
+
+    jira = lazy("jira", lambda: JIRA(url, basic_auth=auth))
+    jira.search_issues(query)  # ここで初めてログインする
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]) -> None:
+        self.name = name
+        self._factory = factory
+        self._obj: T | None = None
+        self._lock = threading.Lock()
+        # 生成にかかった秒数(未生成ならNone)
+        self.elapsed: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        """
+        オブジェクトを生成済みかどうかを返す
+        """
+        return self._obj is not None
+
+    def get(self) -> T:
+        """
+        オブジェクトを返す(未生成なら生成する)
+
+        生成に失敗した場合は例外をそのまま送出し、次回の利用時に再度生成する
+        """
+        obj = self._obj
+        if obj is not None:
+            return obj
+        with self._lock:
+            if self._obj is None:
+                start = time.perf_counter()
+                self._obj = self._factory()
+                self.elapsed = time.perf_counter() - start
+                logger.info("created %s in %.3f seconds", self.name, self.elapsed)
+            return self._obj
+
+    def replace(self, factory: Callable[[], T]) -> Callable[[], T]:
+        """
+        生成方法を差し替え、次回の利用時に生成し直す(ベンチマークなどで使用する)
+
+        元に戻せるように、差し替える前の生成方法を返す
+        """
+        with self._lock:
+            previous, self._factory = self._factory, factory
+        self.reset()
+        return previous
+
+    def reset(self) -> None:
+        """
+        生成済みのオブジェクトを破棄し、次回の利用時に生成し直す
+        """
+        with self._lock:
+            self._obj = None
+            self.elapsed = None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.get(), attr)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.get())  # type: ignore
+
+    def __contains__(self, item: object) -> bool:
+        return item in self.get()  # type: ignore
+
+
+def lazy(name: str, factory: Callable[[], T]) -> LazyResource[T]:
+    """
+    初回の利用時に生成するリソースを登録する
+
+    同じ名前のリソースが登録済みの場合はそれを返す(複数のプラグインで共有できる)
+    """
+    with _registry_lock:
+        resource = _registry.get(name)
+        if resource is None:
+            resource = _registry[name] = LazyResource(name, factory)
+    return resource
+
+
+def resources() -> list[LazyResource]:
+    """
+    登録済みのリソースを登録順に返す
+    """
+    with _registry_lock:
+        return list(_registry.values())
+
+
+class LazyDatabase(DatabaseProxy):
+    """
+    初回のクエリ実行時に接続し、テーブルを作成する peewee のデータベース
+
+    db = LazyDatabase("plusplus.db", lambda: SqliteDatabase(path))
+
+    class Plusplus(Model):
+        class Meta:
+            database = db
+
+    db.create_tables_on_connect([Plusplus])
+    """
+
+    __slots__ = (
+        "obj",
+        "_callbacks",
+        "_Model",
+        "_factory",
+        "_resource",
+        "_models",
+        "_migrations",
+    )
+
+    def __init__(self, name: str, factory: Callable[[], Database]) -> None:
+        super().__init__()
+        self._models: list[type[Model]] = []
+        self._migrations: list[Callable[[Database], None]] = []
+        self._factory = factory
+        self._resource = lazy(name, lambda: self._create(factory))
+
+    def create_tables_on_connect(self, models: list[type[Model]]) -> None:
+        """
+        初回の接続時に作成するテーブルを登録する
+        """
+        self._models.extend(models)
+
+    def migrate_on_connect(self, migration: Callable[[Database], None]) -> None:
+        """
+        初回の接続時に、テーブルの作成のあとに呼び出す関数を登録する
+
+        既存のテーブルへのカラムの追加などに使用する
+        """
+        self._migrations.append(migration)
+
+    def replace(self, factory: Callable[[], Database]) -> Callable[[], Database]:
+        """
+        接続先のデータベースを差し替える(ベンチマークなどで一時的なDBを使う場合)
+
+        元に戻せるように、差し替える前のデータベースの生成方法を返す
+        """
+        previous, self._factory = self._factory, factory
+        self._resource.replace(lambda: self._create(factory))
+        self.initialize(None)
+        return previous
+
+    def _create(self, factory: Callable[[], Database]) -> Database:
+        database = factory()
+        # プロキシはまだ初期化前なので、データベースを指定してテーブルを作成する
+        # (bind_ctx でモデルを付け替えると、他のスレッドのクエリに影響する)
+        for model in sort_models(self._models):
+            SchemaManager(model, database).create_all(safe=True)
+        for migration in self._migrations:
+            migration(database)
+        return database
+
+    def __getattr__(self, attr: str) -> Any:
+        if self.obj is None:
+            self.initialize(self._resource.get())
+        return getattr(self.obj, attr)
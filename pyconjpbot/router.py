@@ -0,0 +1,303 @@
+"""
+listen_to のパターンをまとめて1回の走査で判定するルーター
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterator, Pattern
+
+try:
+    # Python 3.11 以降
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+
+# 組み合わせ済みの正規表現をキャッシュする数
+COMBINED_CACHE_SIZE = 128
+
+# インラインで指定できるフラグ
+INLINE_FLAGS = {
+    re.IGNORECASE: "i",
+    re.MULTILINE: "m",
+    re.DOTALL: "s",
+    re.VERBOSE: "x",
+}
+# コンパイル時に自動で付与されるフラグ
+IMPLICIT_FLAGS = re.UNICODE
+
+
+def _literal_run_candidates(subpattern) -> list[set[str]]:
+    """
+    パース済みの正規表現から、マッチ時に必ず含まれる文字列の候補を返す
+
+    候補はそれぞれ「いずれかの文字列が必ず含まれる」集合になっている
+    """
+    candidates = []
+    run: list[str] = []
+
+    def flush() -> None:
+        if run:
+            candidates.append({"".join(run)})
+            run.clear()
+
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            required = required_literals(av[-1])
+            if required:
+                candidates.append(required)
+        elif op is sre_parse.BRANCH:
+            union: set[str] = set()
+            for branch in av[1]:
+                required = required_literals(branch)
+                if not required:
+                    break
+                union |= required
+            else:
+                candidates.append(union)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            min_count, _, item = av
+            if min_count >= 1:
+                required = required_literals(item)
+                if required:
+                    candidates.append(required)
+        elif op is sre_parse.IN:
+            # [はわ] のような文字だけの文字クラス
+            if all(item_op is sre_parse.LITERAL for item_op, _ in av):
+                candidates.append({chr(c) for _, c in av})
+    flush()
+    return candidates
+
+
+def required_literals(subpattern) -> set[str] | None:
+    """
+    マッチ時に必ずいずれかが含まれる文字列の集合を返す(見つからない場合はNone)
+
+    例: 'おはよう|お早う' -> {'おはよう', 'お早う'}
+    """
+    candidates = _literal_run_candidates(subpattern)
+    if not candidates:
+        return None
+    # 最短の文字列が長く、候補数が少ないものほど絞り込みに効く
+    return max(candidates, key=lambda c: (min(len(x) for x in c), -len(c)))
+
+
+class Route:
+    """
+    listen_to に登録された1つのパターンとハンドラー
+    """
+
+    def __init__(self, pattern: Pattern, func: Callable) -> None:
+        self.pattern = pattern
+        self.func = func
+        # マッチ時に必ずいずれかが含まれる文字列(見つからない場合はNone)
+        self.keywords: set[str] | None = None
+        # 他のパターンと組み合わせるための正規表現(組み合わせ不可ならNone)
+        self.fragment: str | None = None
+
+        try:
+            parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        except re.error:
+            return
+
+        self.keywords = required_literals(parsed)
+        self.fragment = self._build_fragment(parsed)
+
+    def _build_fragment(self, parsed) -> str | None:
+        """
+        他のパターンと1つの正規表現にまとめるための断片を生成する
+
+        パターンの先頭から任意の位置で最初にマッチする部分を先読みで捕捉するので、
+        re.search() と同じグループが得られる
+        """
+        if isinstance(self.pattern.pattern, bytes):
+            return None
+        # 後方参照、名前付きグループがあると番号がずれるので組み合わせない
+        if self.pattern.groupindex or "(?P=" in self.pattern.pattern:
+            return None
+        if any(op is sre_parse.GROUPREF for op, _ in _walk(parsed)):
+            return None
+
+        flags = self.pattern.flags & ~IMPLICIT_FLAGS
+        inline = ""
+        for flag, char in INLINE_FLAGS.items():
+            if flags & flag:
+                inline += char
+                flags &= ~flag
+        if flags:
+            # インライン指定できないフラグがある
+            return None
+
+        body = self.pattern.pattern
+        if inline:
+            body = f"(?{inline}:{body})"
+        prefix = r"[\s\S]*?"
+        if _is_anchored(parsed, self.pattern.flags):
+            # 先頭に固定されたパターンは先頭から判定するだけでよい
+            prefix = ""
+        fragment = rf"(?:(?={prefix}({body}))|)"
+        try:
+            re.compile(fragment)
+        except re.error:
+            return None
+        return fragment
+
+
+def _is_anchored(parsed, flags: int) -> bool:
+    """
+    パターンが文字列の先頭に固定されているかを返す
+    """
+    if not parsed:
+        return False
+    op, av = parsed[0]
+    if op is not sre_parse.AT:
+        return False
+    if av is sre_parse.AT_BEGINNING_STRING:
+        return True
+    return av is sre_parse.AT_BEGINNING and not flags & re.MULTILINE
+
+
+def _overlaps(keyword: str, other: str) -> bool:
+    """
+    keyword の末尾と other の先頭が重なるかを返す
+    """
+    return any(other.startswith(keyword[i:]) for i in range(1, len(keyword)))
+
+
+def _walk(subpattern) -> Iterator[tuple]:
+    """
+    パース済みの正規表現のノードを再帰的に返す
+    """
+    for op, av in subpattern:
+        yield op, av
+        items = av if isinstance(av, (list, tuple)) else ()
+        for item in items:
+            if isinstance(item, sre_parse.SubPattern):
+                yield from _walk(item)
+            elif isinstance(item, (list, tuple)):
+                for sub in item:
+                    if isinstance(sub, sre_parse.SubPattern):
+                        yield from _walk(sub)
+
+
+class ListenRouter:
+    """
+    listen_to のパターンをまとめて判定するルーター
+
+    1. 各パターンが必ず含む文字列(キーワード)を1つの正規表現で走査して候補を絞る
+    2. 候補のパターンを1つの正規表現に結合し、1回のマッチで全パターンを判定する
+    """
+
+    def __init__(self, commands: dict[Pattern, Callable]) -> None:
+        self.routes = [Route(pattern, func) for pattern, func in commands.items()]
+        # 候補のパターンの組み合わせごとの判定方法のキャッシュ
+        self._plans: dict[frozenset[int], tuple] = {}
+
+        # キーワードは小文字にしたテキストから探す
+        # 大文字小文字を区別するパターンも含まれるが、絞り込みなので問題ない
+        always = set()
+        keyword_routes: dict[str, set[int]] = {}
+        for index, route in enumerate(self.routes):
+            if route.keywords is None:
+                always.add(index)
+                continue
+            for keyword in route.keywords:
+                keyword_routes.setdefault(keyword.lower(), set()).add(index)
+        self._always = frozenset(always)
+
+        # 見つかったキーワードに含まれる別のキーワードも見つかったものとする
+        self._keyword_index: dict[str, frozenset[int]] = {}
+        # 見つかったキーワードと重なっていて走査で見落とす可能性のあるキーワード
+        # 例: 'beeramen' の 'beer' と 'ramen'
+        self._overlaps: dict[str, list[str]] = {}
+        for keyword in keyword_routes:
+            indexes = set(always)
+            for other, routes in keyword_routes.items():
+                if other in keyword:
+                    indexes.update(routes)
+                elif _overlaps(keyword, other):
+                    self._overlaps.setdefault(keyword, []).append(other)
+            self._keyword_index[keyword] = frozenset(indexes)
+
+        self._scanner = None
+        if keyword_routes:
+            # 同じ位置から始まるキーワードは長いものを優先する
+            keywords = sorted(keyword_routes, key=len, reverse=True)
+            self._scanner = re.compile("|".join(re.escape(k) for k in keywords))
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def candidates(self, text: str) -> frozenset[int]:
+        """
+        キーワードによる事前フィルターを通過したパターンの番号を返す
+        """
+        if self._scanner is None:
+            return self._always
+        lower_text = text.lower()
+        found = self._scanner.findall(lower_text)
+        if not found:
+            return self._always
+
+        indexes = set(self._always)
+        for keyword in set(found):
+            indexes.update(self._keyword_index[keyword])
+            for other in self._overlaps.get(keyword, ()):
+                if other in lower_text:
+                    indexes.update(self._keyword_index[other])
+        return frozenset(indexes)
+
+    def _get_plan(self, indexes: frozenset[int]) -> tuple:
+        """
+        指定されたパターンを結合した正規表現と、各パターンのグループの位置を返す
+
+        結合できないパターンはグループの位置を None にして個別に判定する
+        """
+        plan = self._plans.get(indexes)
+        if plan is not None:
+            return plan
+
+        fragments = []
+        steps: list[tuple[Route, int | None]] = []
+        group = 1
+        for index in sorted(indexes):
+            route = self.routes[index]
+            if route.fragment is None:
+                steps.append((route, None))
+                continue
+            fragments.append(route.fragment)
+            steps.append((route, group))
+            group += route.pattern.groups + 1
+        combined = re.compile("".join(fragments)) if fragments else None
+
+        plan = (combined, steps)
+        if len(self._plans) >= COMBINED_CACHE_SIZE:
+            self._plans.clear()
+        self._plans[indexes] = plan
+        return plan
+
+    def match(self, text: str) -> Iterator[tuple[Callable, tuple]]:
+        """
+        テキストにマッチするハンドラーとグループを登録順に返す
+        """
+        indexes = self.candidates(text)
+        if not indexes:
+            return
+        combined, steps = self._get_plan(indexes)
+
+        groups: tuple = ()
+        if combined is not None:
+            m = combined.match(text)
+            spans = m.regs
+            groups = m.groups()
+        for route, group in steps:
+            if group is None:
+                m = route.pattern.search(text)
+                if m:
+                    yield route.func, m.groups()
+            elif spans[group][0] != -1:
+                yield route.func, groups[group : group + route.pattern.groups]
@@ -0,0 +1,135 @@
+"""
+一覧から要素を選ぶための仕組み
+
+- ShuffleBag: 一巡するまで同じ要素を選ばない(状態は ID の配列とカーソルのみ)
+- WeightedSampler: 重みに比例した確率で選ぶ(Walker の alias method)
+
+どちらも1回の選択は O(1) で、一覧を走査しない
+"""
+
+from __future__ import annotations
+
+import random
+from array import array
+from typing import Sequence
+
+# ID の配列を保存するときの型(符号なし32ビット整数)
+ARRAY_TYPECODE = "I"
+
+
+class ShuffleBag:
+    """
+    ID をシャッフルした順に返し、全て返したらシャッフルし直す
+
+    bag = ShuffleBag([1, 2, 3])
+    bag.next()  # => 2
+    state = bag.dumps()  # シャッフルした順番を保存する
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[int],
+        order: Sequence[int] = (),
+        cursor: int = 0,
+        rand: random.Random | None = None,
+    ) -> None:
+        """
+        :param order: 保存していた順番(ids にない ID は除き、ない ID は残りに加える)
+        :param cursor: 保存していた次に返す位置
+        """
+        self._random = rand or random.Random()
+        valid = set(ids)
+        # 保存後に削除された ID を除き、その分カーソルを戻す
+        self.order = [i for i in order if i in valid]
+        self.cursor = sum(1 for i in order[:cursor] if i in valid)
+        # 保存後に追加された ID は、今回の巡回の残りのどこかに入れる
+        known = set(self.order)
+        for i in ids:
+            if i not in known:
+                position = self._random.randint(self.cursor, len(self.order))
+                self.order.insert(position, i)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def next(self) -> int:
+        """
+        次の ID を返す(空の場合は IndexError)
+        """
+        if not self.order:
+            raise IndexError("empty shuffle bag")
+        if self.cursor >= len(self.order):
+            self.shuffle()
+        value = self.order[self.cursor]
+        self.cursor += 1
+        return value
+
+    def shuffle(self) -> None:
+        """
+        シャッフルし直す(直前に返した ID がすぐに続かないようにする)
+        """
+        last = self.order[self.cursor - 1] if self.cursor else None
+        self._random.shuffle(self.order)
+        if len(self.order) > 1 and self.order[0] == last:
+            i = self._random.randrange(1, len(self.order))
+            self.order[0], self.order[i] = self.order[i], self.order[0]
+        self.cursor = 0
+
+    def dumps(self) -> bytes:
+        """
+        順番を保存するためのバイト列を返す
+        """
+        return array(ARRAY_TYPECODE, self.order).tobytes()
+
+    @staticmethod
+    def loads(data: bytes) -> list[int]:
+        """
+        dumps で保存した順番を返す
+        """
+        order = array(ARRAY_TYPECODE)
+        order.frombytes(data)
+        return order.tolist()
+
+
+class WeightedSampler:
+    """
+    重みに比例した確率でインデックスを返す(Walker の alias method)
+
+    sampler = WeightedSampler([1, 1, 8])
+    sampler.next()  # => 80% の確率で 2
+    """
+
+    def __init__(self, weights: Sequence[float], rand: random.Random | None = None):
+        self._random = rand or random.Random()
+        count = len(weights)
+        total = sum(weights)
+        # インデックスごとの自身を選ぶ確率と、選ばなかったときのインデックス
+        self._prob = [1.0] * count
+        self._alias = list(range(count))
+        if count == 0 or total <= 0:
+            return
+
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = g
+            scaled[g] -= 1 - scaled[s]
+            (small if scaled[g] < 1 else large).append(g)
+        # 残りは誤差を除いて確率1
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self._prob)
+
+    def next(self) -> int:
+        """
+        インデックスを返す(空の場合は IndexError)
+        """
+        if not self._prob:
+            raise IndexError("empty weighted sampler")
+        i = self._random.randrange(len(self._prob))
+        return i if self._random.random() < self._prob[i] else self._alias[i]
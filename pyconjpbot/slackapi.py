@@ -0,0 +1,159 @@
+"""
+プロセス全体で共有する Slack Web API のクライアント
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import threading
+from http.client import HTTPMessage
+from typing import Any
+from urllib.error import HTTPError, URLError
+from urllib.request import Request
+
+import requests
+from requests.adapters import HTTPAdapter
+from slack_sdk import WebClient
+from slack_sdk.version import __version__ as slack_sdk_version
+from slack_sdk.web import SlackResponse
+from slackbot import settings
+
+from .ratelimit import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Slack API への接続を保持する数(同時にリクエストできる数)
+POOL_SIZE = 10
+# 接続の使い回しのために slack_sdk の非公開メソッドを置き換えるので、
+# 動作を確認したバージョン(requirements.txt で固定している)以外では urllib で接続する
+SLACK_SDK_VERSION = "3.21.3"
+
+_client: PooledWebClient | None = None
+_lock = threading.Lock()
+
+
+class PooledWebClient(WebClient):
+    """
+    requests.Session で Slack API への接続を使い回す WebClient
+
+    WebClient は urllib でリクエストごとに接続する(TLSハンドシェイクが毎回発生する)ため、
+    HTTP 通信の部分だけを keep-alive する requests.Session に置き換える
+
+    公開された差し替え口がないので、非公開の _perform_urllib_http_request_internal を
+    上書きする(リクエストの組み立てやリトライは WebClient のものをそのまま使う)
+    """
+
+    def __init__(self, *args: Any, pool_size: int = POOL_SIZE, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.pooled = slack_sdk_version == SLACK_SDK_VERSION
+        if not self.pooled:
+            logger.warning(
+                "slack_sdk %s is not supported by PooledWebClient (expected %s), "
+                "connections are not pooled",
+                slack_sdk_version,
+                SLACK_SDK_VERSION,
+            )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+    def api_call(self, api_method: str, **kwargs: Any) -> SlackResponse:
+        """
+        OutboundScheduler でレートリミットに合わせて待ってから API を呼び出す
+        """
+        channel = None
+        for key in ("json", "data", "params"):
+            args = kwargs.get(key) or {}
+            channel = (
+                args.get("channel") or args.get("channels") or args.get("channel_id")
+            )
+            if channel:
+                break
+        return scheduler.call(
+            api_method,
+            channel,
+            lambda: super(PooledWebClient, self).api_call(api_method, **kwargs),
+        )
+
+    def _perform_urllib_http_request_internal(
+        self, url: str, req: Request
+    ) -> dict[str, Any]:
+        """
+        urlopen の代わりに requests.Session で通信する
+
+        WebClient のリトライ(ConnectionErrorRetryHandler など)やエラー処理が
+        urllib の例外を前提にしているので、requests の例外は urllib の例外に変換する
+        """
+        if self.ssl is not None or not self.pooled:
+            # 独自の SSLContext は requests では使えないので urllib で接続する
+            return super()._perform_urllib_http_request_internal(url, req)
+
+        proxies = None
+        if self.proxy:
+            proxies = {"http": self.proxy, "https": self.proxy}
+        headers = {key: str(value) for key, value in req.header_items()}
+        try:
+            response = self._session.request(
+                req.get_method(),
+                url,
+                data=req.data,
+                headers=headers,
+                timeout=self.timeout,
+                proxies=proxies,
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # urlopen と同じく接続やタイムアウトのエラーは URLError にする
+            raise URLError(e) from e
+        if response.status_code >= 400:
+            # urlopen と同じく 4xx、5xx は HTTPError にする(429 のリトライなどに使われる)
+            message = HTTPMessage()
+            for key, value in response.headers.items():
+                message[key] = value
+            raise HTTPError(
+                url,
+                response.status_code,
+                response.reason,
+                message,
+                io.BytesIO(response.content),
+            )
+        body: str | bytes = response.text
+        if response.headers.get("Content-Type", "").startswith("application/gzip"):
+            body = response.content
+        return {
+            "status": response.status_code,
+            "headers": response.headers,
+            "body": body,
+        }
+
+    def connection_stats(self) -> dict[str, int]:
+        """
+        接続の利用状況を返す
+
+        - opened: 新しく接続した回数
+        - reused: 既存の接続を使い回した回数
+        """
+        opened = requests_count = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            requests_count += pool.num_requests
+        return {
+            "requests": requests_count,
+            "opened": opened,
+            "reused": requests_count - opened,
+        }
+
+
+def get_client() -> PooledWebClient:
+    """
+    共有の Slack Web API クライアントを返す
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = PooledWebClient(token=settings.API_TOKEN)
+    return _client
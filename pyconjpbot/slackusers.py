@@ -0,0 +1,148 @@
+"""
+Slack のユーザー情報のキャッシュ
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+from slackbot import settings
+
+from .slackapi import get_client
+
+logger = logging.getLogger(__name__)
+
+# ユーザー一覧を取り直すまでの秒数
+TTL = 60 * 60
+# users.list API で一度に取得するユーザー数
+PAGE_SIZE = 200
+# 取得に失敗したときに取り直すまでの秒数(失敗するたびに倍にし、TTL を上限にする)
+RETRY_INTERVAL = 30
+# Slack API の呼び出しで発生する例外
+# (接続やタイムアウトの requests の例外と urllib の URLError は OSError のサブクラス)
+API_ERRORS = (SlackApiError, OSError)
+
+
+class UserDirectory:
+    """
+    ユーザーIDをキーにした Slack のユーザー情報のキャッシュ
+
+    - 起動時にバックグラウンドで users.list API で全ユーザーを取得する
+    - 取得が終わるまでと取得に失敗した場合は、users.info API で1人ずつ取得する
+    - 取得に失敗したら、間隔を空けて(失敗するたびに倍にして)取り直す
+    - TTL を過ぎたらバックグラウンドで取り直す(その間は古い情報を返す)
+    - user_change、team_join イベントで個別に更新する
+
+    users.list API は Tier 2 のレートリミットで全ページの取得に時間がかかるため、
+    ハンドラーのスレッドでは取得を待たない
+    """
+
+    def __init__(
+        self, ttl: float = TTL, retry_interval: float = RETRY_INTERVAL
+    ) -> None:
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._users: dict[str, dict] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # 連続して取得に失敗した回数と、次に取得を試みる時刻
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def start(self) -> None:
+        """
+        バックグラウンドで全ユーザーの取得を開始する(起動時に呼び出す)
+        """
+        self._ensure_loaded()
+
+    def refresh(self) -> None:
+        """
+        users.list API で全ユーザーを取得し直す
+
+        - https://api.slack.com/methods/users.list
+        """
+        users = {}
+        for page in get_client().users_list(limit=PAGE_SIZE):
+            for user in page["members"]:
+                users[user["id"]] = user
+        with self._lock:
+            self._users = users
+            self._loaded_at = time.monotonic()
+            self._failures = 0
+            self._retry_at = 0.0
+        logger.info("loaded %d slack users", len(users))
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            # API のエラー以外(不正なレスポンスなど)でも、すぐに取り直さず間隔を空ける
+            with self._lock:
+                self._failures += 1
+                delay = min(self.retry_interval * 2 ** (self._failures - 1), self.ttl)
+                self._retry_at = time.monotonic() + delay
+            logger.exception("failed to load slack users (retry in %d seconds)", delay)
+        finally:
+            self._refreshing = False
+
+    def _ensure_loaded(self) -> None:
+        """
+        ユーザー一覧が未取得か古くなっていたら、バックグラウンドで取得を開始する
+
+        取得の完了は待たない。失敗したあとは _retry_at まで取得を開始しない
+        """
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at <= self.ttl:
+            return
+        with self._lock:
+            if self._refreshing or now < self._retry_at:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def update(self, user: dict) -> None:
+        """
+        イベントで受け取ったユーザー情報で更新する
+        """
+        with self._lock:
+            self._users[user["id"]] = user
+
+    def get(self, user_id: str) -> dict | None:
+        """
+        ユーザー情報を返す
+
+        キャッシュにない場合(全ユーザーの取得前や取得の失敗時を含む)は、
+        users.info API でそのユーザーのみ取得する
+        - https://api.slack.com/methods/users.info
+        """
+        self._ensure_loaded()
+        user = self._users.get(user_id)
+        if user is None:
+            try:
+                user = get_client().users_info(user=user_id)["user"]
+            except API_ERRORS:
+                logger.exception("failed to get slack user %s", user_id)
+                return None
+            self.update(user)
+        return user
+
+    def get_name(self, user_id: str) -> str:
+        """
+        ユーザー名を返す(存在しない場合は空文字列)
+        """
+        user = self.get(user_id)
+        return user["name"] if user else ""
+
+    def is_admin(self, user_id: str) -> bool:
+        """
+        ユーザーがSlackのAdminかどうかを返す
+        """
+        user = self.get(user_id)
+        return bool(user and user.get("is_admin", False))
+
+
+users = UserDirectory(ttl=getattr(settings, "SLACK_USER_CACHE_TTL", TTL))
@@ -0,0 +1,142 @@
+"""
+入力ミスの候補を探すための編集距離のインデックス(SymSpell 方式)
+
+文字列から最大 max_distance 文字を削除した文字列をあらかじめ登録しておき、
+検索する文字列から削除した文字列と一致するものを候補とする
+全件と比較せず候補のみ編集距離を計算するため、登録数が数万件でも検索は1ミリ秒未満で終わる
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from typing import Iterable
+
+# 削除した文字列を登録する最大の距離
+MAX_DISTANCE = 2
+# 削除した文字列を作る先頭の文字数(長い文字列でもインデックスが大きくならないようにする)
+PREFIX_LENGTH = 7
+
+
+def levenshtein(a: str, b: str) -> int:
+    """
+    2つの文字列の編集距離(挿入、削除、置換の回数)を返す
+
+    Myers のビットパラレル法で、a の文字ごとの位置をビット列にして1列ずつ計算する
+    """
+    if not a:
+        return len(b)
+    # 文字ごとの a の中の位置のビット列
+    peq: dict[str, int] = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    last = 1 << (len(a) - 1)
+    full = (1 << len(a)) - 1
+    pv, mv, score = full, 0, len(a)
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return score
+
+
+def deletes(word: str, distance: int) -> set[str]:
+    """
+    文字列から distance 文字以下を削除した文字列の集合を返す(元の文字列を含む)
+    """
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1 :] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+class SpellingIndex:
+    """
+    編集距離が近い文字列を探すインデックス
+
+    index = SpellingIndex(["sake", "beer", "wine"])
+    index.search("saka")  # => [(1, "sake")]
+    """
+
+    def __init__(
+        self,
+        words: Iterable[str] = (),
+        max_distance: int = MAX_DISTANCE,
+        prefix_length: int = PREFIX_LENGTH,
+    ) -> None:
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._lock = threading.Lock()
+        self._words: set[str] = set()
+        # 削除した文字列ごとの元の文字列の一覧
+        self._deletes: dict[str, list[str]] = defaultdict(list)
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __contains__(self, word: object) -> bool:
+        return word in self._words
+
+    def _keys(self, word: str) -> set[str]:
+        return deletes(word[: self.prefix_length], self.max_distance)
+
+    def add(self, word: str) -> None:
+        """
+        文字列を追加する(追加済みの場合は何もしない)
+        """
+        with self._lock:
+            if word in self._words:
+                return
+            self._words.add(word)
+            for key in self._keys(word):
+                self._deletes[key].append(word)
+
+    def remove(self, word: str) -> None:
+        """
+        文字列を削除する(存在しない場合は何もしない)
+        """
+        with self._lock:
+            if word not in self._words:
+                return
+            self._words.discard(word)
+            for key in self._keys(word):
+                words = self._deletes[key]
+                words.remove(word)
+                if not words:
+                    del self._deletes[key]
+
+    def search(
+        self, word: str, max_distance: int | None = None
+    ) -> list[tuple[int, str]]:
+        """
+        編集距離が max_distance 以下の文字列を (距離, 文字列) の近い順に返す
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        candidates: set[str] = set()
+        with self._lock:
+            for key in deletes(word[: self.prefix_length], max_distance):
+                candidates.update(self._deletes.get(key, ()))
+        results = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            distance = levenshtein(word, candidate)
+            if distance <= max_distance:
+                results.append((distance, candidate))
+        results.sort()
+        return results
@@ -0,0 +1,102 @@
+"""
+起動時間のレポート
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import NamedTuple
+
+from .lazyimport import lazy_modules
+from .resources import resources
+
+# 遅い順に表示するモジュールの数
+TOP_MODULES = 10
+
+MB = 1024 * 1024
+
+
+class ImportCost(NamedTuple):
+    """
+    プラグインのモジュールのインポートにかかったコスト
+    """
+
+    seconds: float
+    rss_before: int
+    rss_after: int
+
+
+# モジュール名ごとのインポートにかかったコスト
+_import_costs: dict[str, ImportCost] = {}
+_lock = threading.Lock()
+
+
+def record_import(
+    module: str, seconds: float, rss_before: int = 0, rss_after: int = 0
+) -> None:
+    """
+    プラグインのモジュールのインポートにかかった秒数と前後の RSS を記録する
+    """
+    with _lock:
+        _import_costs[module] = ImportCost(seconds, rss_before, rss_after)
+
+
+def import_costs() -> dict[str, ImportCost]:
+    """
+    モジュール名ごとのインポートにかかったコストを返す
+    """
+    with _lock:
+        return dict(_import_costs)
+
+
+def report(top: int = TOP_MODULES) -> str:
+    """
+    プラグインの読み込み時間と、リソースの生成時間のレポートを返す
+    """
+    costs = import_costs()
+    total = sum(cost.seconds for cost in costs.values())
+    lines = [f"*プラグインの読み込み*: {total:.3f}秒"]
+    slowest = sorted(costs.items(), key=lambda item: item[1].seconds, reverse=True)
+    for module, cost in slowest[:top]:
+        lines.append(f"- {module}: {cost.seconds:.3f}秒")
+
+    lines.append("*リソースの生成*")
+    for resource in resources():
+        if resource.elapsed is None:
+            lines.append(f"- {resource.name}: 未使用")
+        else:
+            lines.append(f"- {resource.name}: {resource.elapsed:.3f}秒")
+    return "\n".join(lines)
+
+
+def importtime_report() -> str:
+    """
+    python -X importtime のようなインポートのコストのレポートを返す
+
+    - プラグインごとのインポートにかかった秒数と前後の RSS
+    - 遅延インポートするモジュールのインポートにかかった秒数と前後の RSS
+    """
+    lines = ["     秒 | RSS(前)MB | RSS(後)MB | モジュール"]
+    costs = import_costs()
+    for module, cost in sorted(costs.items()):
+        lines.append(
+            f"{cost.seconds:7.3f} | {cost.rss_before / MB:9.1f} | "
+            f"{cost.rss_after / MB:9.1f} | {module}"
+        )
+
+    lines.append("")
+    lines.append("     秒 | RSS(前)MB | RSS(後)MB | 遅延インポート(利用するプラグイン)")
+    for record in lazy_modules():
+        plugins = ", ".join(plugin.rsplit(".", 1)[-1] for plugin in record.plugins)
+        name = f"{record.name} ({plugins})"
+        if record.module is None:
+            lines.append(f"{'-':>7} | {'-':>9} | {'-':>9} | {name} 未インポート")
+        elif record.elapsed is None:
+            lines.append(f"{'-':>7} | {'-':>9} | {'-':>9} | {name} インポート済み")
+        else:
+            before = (record.rss_before or 0) / MB
+            after = (record.rss_after or 0) / MB
+            lines.append(
+                f"{record.elapsed:7.3f} | {before:9.1f} | {after:9.1f} | {name}"
+            )
+    return "```\n" + "\n".join(lines) + "\n```"
@@ -0,0 +1,394 @@
+"""
+respond_to/listen_to のハンドラーを実行するスレッドプール
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable
+
+from slackbot import settings
+
+from .metrics import handler_name, metrics
+
+logger = logging.getLogger(__name__)
+
+# 通常のハンドラーを実行するスレッド数
+WORKERS = 8
+# 軽いハンドラーを実行するスレッド数
+FAST_WORKERS = 2
+# 実行待ちのハンドラーの最大数
+QUEUE_SIZE = 100
+# キューが空くのを待つ秒数(過ぎたらハンドラーの実行を取りやめる)
+QUEUE_TIMEOUT = 5
+# プラグインごとの同時実行数のデフォルト値
+DEFAULT_CONCURRENCY = 4
+# プラグインごとの同時実行数
+CONCURRENCY = {
+    "pyconjpbot.plugins.pycamp": 1,
+    "pyconjpbot.plugins.github": 2,
+    "pyconjpbot.google_plugins.googledrive": 1,
+}
+
+# ハンドラーの優先度(値が小さいほど先に実行する)
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITIES = {"high": HIGH, "normal": NORMAL, "low": LOW}
+# 過負荷のときの優先度の低いハンドラーの扱い(shed: 破棄する、defer: 後回しにする)
+OVERLOAD_POLICY = "shed"
+# 実行待ちのハンドラーがこの数以上なら過負荷とみなす
+OVERLOAD_QUEUE_DEPTH = 50
+# 実行待ちの時間(秒)がこの値以上なら過負荷とみなす
+OVERLOAD_LATENCY = 5.0
+# 後回しにしたハンドラーを破棄するまでの秒数
+DEFER_TIMEOUT = 60
+# 実行待ちの時間の移動平均の重み
+LATENCY_WEIGHT = 0.2
+
+
+def fast_lane(func: Callable) -> Callable:
+    """
+    すぐに終わるハンドラーを専用のスレッドで実行するようにするデコレーター
+
+    @respond_to(r"^ping$")
+    @fast_lane
+    def ping(message):
+        ...
+    """
+    func.fast_lane = True  # type: ignore
+    return func
+
+
+def priority(level: int) -> Callable[[Callable], Callable]:
+    """
+    ハンドラーの優先度を指定するデコレーター
+
+    過負荷のときは優先度の低い(LOW)ハンドラーから破棄または後回しにする
+
+    @listen_to("おはよう")
+    @priority(LOW)
+    def morning(message):
+        ...
+    """
+
+    def decorator(func: Callable) -> Callable:
+        func.priority = level  # type: ignore
+        return func
+
+    return decorator
+
+
+class Task:
+    """
+    実行待ちのハンドラー
+    """
+
+    _sequence = itertools.count()
+
+    def __init__(
+        self,
+        func: Callable,
+        run: Callable[[], None],
+        priority: int = NORMAL,
+        fast: bool = False,
+    ) -> None:
+        self.func = func
+        self.run = run
+        self.priority = priority
+        self.fast = fast
+        # 同時実行数を制限する単位(プラグインのモジュール名)
+        self.plugin = func.__module__
+        # 別のレーンのハンドラーから実行枠を引き継いだか
+        self.acquired = False
+        self.submitted = time.monotonic()
+        # 同じ優先度のハンドラーは予約した順に実行する
+        self.sequence = next(self._sequence)
+
+    @property
+    def name(self) -> str:
+        return handler_name(self.func)
+
+    def __lt__(self, other: Task) -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class HandlerPool:
+    """
+    ハンドラーを実行するスレッドプール
+
+    - 実行待ちのキューの長さに上限がある
+    - プラグインごとに同時に実行できるハンドラーの数を制限する
+    - fast_lane のハンドラーは重いハンドラーと別のスレッドで実行する
+    - 優先度の高いハンドラーから実行する
+    - 過負荷のときは優先度の低いハンドラーを破棄するか後回しにする
+    """
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        fast_workers: int = FAST_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+        concurrency: dict[str, int] | None = None,
+        fast_lane: list[str] | None = None,
+        priorities: dict[str, str] | None = None,
+        overload_policy: str = OVERLOAD_POLICY,
+        overload_queue_depth: int = OVERLOAD_QUEUE_DEPTH,
+        overload_latency: float = OVERLOAD_LATENCY,
+    ) -> None:
+        self.workers = workers
+        self.fast_workers = fast_workers
+        self.queue_size = queue_size
+        self.concurrency = dict(CONCURRENCY, **(concurrency or {}))
+        # fast_lane デコレーター以外で軽いハンドラーとして扱う関数名
+        self.fast_lane = set(fast_lane or [])
+        # priority デコレーター以外で優先度を指定する関数名と優先度の名前
+        self.priorities = {
+            name: PRIORITIES[level] for name, level in (priorities or {}).items()
+        }
+        if overload_policy not in ("shed", "defer"):
+            raise ValueError(f"unknown overload policy: {overload_policy}")
+        self.overload_policy = overload_policy
+        self.overload_queue_depth = overload_queue_depth
+        self.overload_latency = overload_latency
+
+        self._queue: queue.Queue[Task] = queue.PriorityQueue(maxsize=queue_size)
+        self._fast_queue: queue.Queue[Task] = queue.PriorityQueue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._running: dict[str, int] = defaultdict(int)
+        # (fast, プラグイン) ごとの実行枠の空きを待っているハンドラー
+        self._waiting: dict[tuple[bool, str], deque[Task]] = defaultdict(deque)
+        # 実行待ちと実行中のハンドラーの数
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        # 過負荷のため後回しにしたハンドラー
+        self._deferred: deque[Task] = deque()
+        # 実行待ちの時間の移動平均(秒)
+        self.latency = 0.0
+
+    @classmethod
+    def from_settings(cls) -> HandlerPool:
+        """
+        slackbot_settings.py の設定でスレッドプールを生成する
+        """
+        return cls(
+            workers=getattr(settings, "HANDLER_WORKERS", WORKERS),
+            fast_workers=getattr(settings, "HANDLER_FAST_WORKERS", FAST_WORKERS),
+            queue_size=getattr(settings, "HANDLER_QUEUE_SIZE", QUEUE_SIZE),
+            concurrency=getattr(settings, "HANDLER_CONCURRENCY", None),
+            fast_lane=getattr(settings, "HANDLER_FAST_LANE", None),
+            priorities=getattr(settings, "HANDLER_PRIORITY", None),
+            overload_policy=getattr(settings, "OVERLOAD_POLICY", OVERLOAD_POLICY),
+            overload_queue_depth=getattr(
+                settings, "OVERLOAD_QUEUE_DEPTH", OVERLOAD_QUEUE_DEPTH
+            ),
+            overload_latency=getattr(settings, "OVERLOAD_LATENCY", OVERLOAD_LATENCY),
+        )
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            threading.Thread(
+                target=self._work, args=(self._queue,), daemon=True
+            ).start()
+        for _ in range(self.fast_workers):
+            threading.Thread(
+                target=self._work, args=(self._fast_queue,), daemon=True
+            ).start()
+
+    def is_fast(self, func: Callable) -> bool:
+        """
+        軽いハンドラーかどうかを返す
+        """
+        if getattr(func, "fast_lane", False):
+            return True
+        return handler_name(func) in self.fast_lane
+
+    def priority_of(self, func: Callable) -> int:
+        """
+        ハンドラーの優先度を返す(設定が decorator より優先する)
+        """
+        return self.priorities.get(
+            handler_name(func), getattr(func, "priority", NORMAL)
+        )
+
+    def overloaded(self) -> bool:
+        """
+        実行待ちのハンドラーの数か実行待ちの時間が閾値を超えているかを返す
+        """
+        depth = self.qsize()
+        if depth >= self.overload_queue_depth:
+            return True
+        return depth > 0 and self.latency >= self.overload_latency
+
+    def submit(self, func: Callable, run: Callable[[], None]) -> bool:
+        """
+        ハンドラーの実行を予約する
+
+        キューが一杯のまま QUEUE_TIMEOUT 秒経過したら実行を取りやめて False を返す
+        過負荷のときは優先度の低いハンドラーを OVERLOAD_POLICY に従って
+        破棄(False を返す)するか後回しにする
+        """
+        task = Task(func, run, self.priority_of(func), self.is_fast(func))
+        if task.priority >= LOW and self.overloaded():
+            if self.overload_policy == "defer" and self._defer(task):
+                return True
+            logger.info("handler pool is overloaded, shed %s", task.name)
+            metrics.record_shed(task.name)
+            return False
+
+        with self._lock:
+            self._pending += 1
+        try:
+            self._lane(task).put(task, timeout=QUEUE_TIMEOUT)
+        except queue.Full:
+            logger.warning("handler queue is full, dropped %s", task.name)
+            metrics.record_shed(task.name)
+            self._done()
+            return False
+        return True
+
+    def _lane(self, task: Task) -> queue.Queue[Task]:
+        return self._fast_queue if task.fast else self._queue
+
+    def _defer(self, task: Task) -> bool:
+        """
+        ハンドラーを後回しにする(後回しにできる数を超えたら False を返す)
+        """
+        with self._lock:
+            if len(self._deferred) >= self.queue_size:
+                return False
+            self._deferred.append(task)
+            self._pending += 1
+        metrics.record_deferred(task.name)
+        return True
+
+    def _resume_deferred(self) -> None:
+        """
+        過負荷でなくなったら、後回しにしたハンドラーを実行待ちに戻す
+
+        DEFER_TIMEOUT 秒より前に後回しにしたハンドラーは破棄する
+        """
+        while self._deferred and not self.overloaded():
+            with self._lock:
+                if not self._deferred:
+                    return
+                task = self._deferred.popleft()
+            if time.monotonic() - task.submitted > DEFER_TIMEOUT:
+                logger.info("deferred too long, shed %s", task.name)
+                metrics.record_shed(task.name)
+                self._done()
+                continue
+            try:
+                self._lane(task).put_nowait(task)
+            except queue.Full:
+                with self._lock:
+                    self._deferred.appendleft(task)
+                return
+
+    def join(self, timeout: float | None = None) -> bool:
+        """
+        実行待ちと実行中のハンドラーがなくなるまで待つ
+
+        timeout 秒を過ぎても終わらなければ False を返す
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _done(self) -> None:
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def qsize(self) -> int:
+        """
+        実行待ちのハンドラーの数を返す
+        """
+        with self._lock:
+            waiting = sum(len(tasks) for tasks in self._waiting.values())
+        return self._queue.qsize() + self._fast_queue.qsize() + waiting
+
+    def _work(self, lane: queue.Queue[Task]) -> None:
+        while True:
+            try:
+                task = lane.get(timeout=1)
+            except queue.Empty:
+                self._resume_deferred()
+                continue
+            if self._acquire(task):
+                self._run(task)
+            self._resume_deferred()
+
+    def _acquire(self, task: Task) -> bool:
+        """
+        プラグインの実行枠を確保する
+
+        同時実行数の上限に達している場合は、実行中のハンドラーの終了を待たせる
+        """
+        if task.acquired:
+            # 別のレーンで実行が終わったハンドラーの実行枠を引き継いでいる
+            return True
+        limit = self.concurrency.get(task.plugin, DEFAULT_CONCURRENCY)
+        with self._lock:
+            if self._running[task.plugin] < limit:
+                self._running[task.plugin] += 1
+                return True
+            waiting = self._waiting[(task.fast, task.plugin)]
+            if len(waiting) < self.queue_size:
+                waiting.append(task)
+                return False
+        logger.warning("too many waiting handlers, dropped %s", task.name)
+        metrics.record_shed(task.name)
+        self._done()
+        return False
+
+    def _release(self, task: Task) -> Task | None:
+        """
+        実行が終わったハンドラーのプラグインの実行枠を手放す
+
+        待っているハンドラーがあれば、実行枠を手放さずに最も先に実行するものに渡す
+        - 同じレーンのハンドラーは、このスレッドで続けて実行するために返す
+        - 別のレーンのハンドラーは、そのレーンのキューに戻す
+          (軽いハンドラーのスレッドで重いハンドラーを実行しないようにする)
+        """
+        while True:
+            with self._lock:
+                heads = [
+                    waiting
+                    for waiting in (
+                        self._waiting[(task.fast, task.plugin)],
+                        self._waiting[(not task.fast, task.plugin)],
+                    )
+                    if waiting
+                ]
+                if not heads:
+                    self._running[task.plugin] -= 1
+                    return None
+                next_task = min(heads, key=lambda waiting: waiting[0]).popleft()
+            if next_task.fast == task.fast:
+                return next_task
+            next_task.acquired = True
+            try:
+                self._lane(next_task).put(next_task, timeout=QUEUE_TIMEOUT)
+                return None
+            except queue.Full:
+                logger.warning("handler queue is full, dropped %s", next_task.name)
+                metrics.record_shed(next_task.name)
+                self._done()
+
+    def _run(self, task: Task) -> None:
+        next_task: Task | None = task
+        while next_task is not None:
+            wait = time.monotonic() - next_task.submitted
+            self.latency += (wait - self.latency) * LATENCY_WEIGHT
+            try:
+                next_task.run()
+            except Exception:
+                logger.exception("failed to run handler %s", next_task.name)
+            next_task = self._release(next_task)
+            self._done()
@@ -1,4 +1,4 @@
-from slackbot.bot import Bot
+from pyconjpbot.bot import Bot
 
 
 def main() -> None:
@@ -0,0 +1,24 @@
+"""
+対応している Python(tox の py39)でモジュールを読み込めることを確認する
+
+`X | None` などの型ヒントは `from __future__ import annotations` がないと
+Python 3.9 では読み込み時に TypeError になる
+"""
+
+import importlib
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "pyconjpbot.plugins.plusplus_model",
+        "pyconjpbot.plugins.plusplus",
+        "pyconjpbot.plugins.term_model",
+        "pyconjpbot.plugins.term",
+        "pyconjpbot.backfill",
+    ],
+)
+def test_import(module: str) -> None:
+    importlib.import_module(module)
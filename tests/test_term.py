@@ -0,0 +1,94 @@
+from unittest import mock
+
+import pytest
+from peewee import SqliteDatabase
+from slackbot.manager import PluginsManager
+
+# term_model.db は参照すると接続する遅延プロキシなので、名前を直接 import しない
+# (pytest がテストを集めるときに参照して、実際のデータベースに接続してしまう)
+from pyconjpbot.plugins import term, term_model
+from pyconjpbot.plugins.term_model import Response, Term
+
+
+@pytest.fixture
+def sent(tmp_path, monkeypatch):
+    """
+    一時的なデータベースを使い、ボットが送信したテキストの一覧を返す
+
+    終了後は、データベースを元に戻し、一時的なデータベースから作ったキャッシュを破棄する
+    """
+    restore_db = term_model.db.replace(
+        lambda: SqliteDatabase(str(tmp_path / "term.db"))
+    )
+    reset_caches()
+
+    texts: list[str] = []
+    monkeypatch.setattr(term, "botsend", lambda message, text: texts.append(text))
+    monkeypatch.setattr(
+        term, "_send_markdown_text", lambda message, text: texts.append(text)
+    )
+    monkeypatch.setattr(
+        term,
+        "botwebapi",
+        lambda message, attachments: texts.append(attachments[0]["pretext"]),
+    )
+    yield texts
+
+    term_model.usage.flush()
+    term_model.db.close()
+    term_model.db.replace(restore_db)
+    reset_caches()
+
+
+def reset_caches() -> None:
+    """
+    データベースから作ったコマンドの一覧や索引、応答のキャッシュを破棄する
+    """
+    for resource in (term.commands, term.command_index, term.spelling):
+        resource.reset()
+    term_model.responses.invalidate("python")
+
+
+def send(text: str) -> None:
+    """
+    ボットと同じように、マッチした全てのハンドラーを呼び出す
+    """
+    message = mock.Mock(body={"user": "U1", "text": text})
+    for func, args in PluginsManager().get_plugins("respond_to", text):
+        if func is not None:
+            func(message, *args)
+
+
+def texts_of(command: str) -> list[str]:
+    query = Response.select().join(Term).where(Term.command == command)
+    return sorted(response.text for response in query)
+
+
+def test_single_line_import_is_added_as_response(sent):
+    send("term create python")
+    sent.clear()
+
+    send("python import this")
+
+    assert sent == ["コマンド `$python` に「import this」を追加しました"]
+    assert texts_of("python") == ["import this"]
+
+
+def test_multiline_import(sent):
+    send("term create python")
+    sent.clear()
+
+    send("python import\nimport this\nimport antigravity\nimport this")
+
+    assert sent == ["コマンド `$python` に 2 件の応答を追加しました(登録済み: 1 件)"]
+    assert texts_of("python") == ["import antigravity", "import this"]
+
+
+def test_import_without_responses(sent):
+    send("term create python")
+    sent.clear()
+
+    send("python import")
+
+    assert sent == ["`$python import` の次の行から1行に1つずつ応答を指定してください"]
+    assert texts_of("python") == []